@@ -0,0 +1,478 @@
+"""
+Offline benchmarks for spotify_converter. Nothing here talks to Spotify or
+YouTube: a local server stands in for the Spotify Web API (with optional 429
+injection) and for YouTube search and media, with configurable latency and
+bandwidth. spotipy, yt-dlp and ffmpeg must be installed.
+
+    python benchmark.py pipeline --scenario playlist --sizes 10,1000,10000
+    python benchmark.py pipeline --scenario library --throttle-every 50
+    python benchmark.py ytdl-reuse --tracks 200
+
+pipeline runs each size in a fresh child process against the stand-in and
+reports time-to-first-track, tracks/minute, peak RSS and Spotify API calls per
+track. --output appends the results as JSON lines (bench_output.txt is
+ignored by git) so runs can be compared over time.
+
+ytdl-reuse downloads the same set of direct media URLs twice, once with a
+fresh YoutubeDL per track (the old behaviour) and once through a pooled
+YoutubeDownloader, and prints the per-track overhead of each.
+"""
+import argparse
+import functools
+import http.server
+import json
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+import urllib.request
+
+import spotify_converter as sc
+
+BENCH_USER = "benchuser"
+TRACKS_PER_ALBUM = 12
+SEARCH_TOTAL = 1000
+
+class QuietHandler(http.server.SimpleHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+def serve_media(directory):
+    """Serve directory on a free localhost port in a daemon thread; returns (server, base_url)."""
+    handler = functools.partial(QuietHandler, directory=directory)
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+def write_media(directory, count, size):
+    """Write count media files of size bytes and return their names."""
+    payload = os.urandom(size)
+    names = []
+    for i in range(count):
+        name = f"track{i:05d}.m4a"
+        with open(os.path.join(directory, name), "wb") as f:
+            f.write(payload)
+        names.append(name)
+    return names
+
+def timed(label, run, count):
+    started = time.perf_counter()
+    run()
+    elapsed = time.perf_counter() - started
+    print(f"{label:<10} {elapsed:8.2f}s total  {elapsed / count * 1000:8.1f} ms/track")
+    return elapsed
+
+def bench_ytdl_reuse(args):
+    import yt_dlp
+
+    work = tempfile.mkdtemp(prefix="spotify_converter_bench_")
+    media_dir = os.path.join(work, "media")
+    out_dir = os.path.join(work, "out")
+    os.makedirs(media_dir)
+    os.makedirs(out_dir)
+    server, base_url = serve_media(media_dir)
+    try:
+        urls = [f"{base_url}/{name}" for name in write_media(media_dir, args.tracks, args.size)]
+        opts = dict(sc.YTDL_BASE_OPTIONS)
+
+        def fresh():
+            for i, url in enumerate(urls):
+                template = os.path.join(out_dir, f"fresh{i:05d}.%(ext)s")
+                with yt_dlp.YoutubeDL({**opts, "format": "best", "outtmpl": template}) as ydl:
+                    ydl.extract_info(url, download=True)
+
+        def pooled():
+            downloader = sc.YoutubeDownloader(opts)
+            try:
+                for i, url in enumerate(urls):
+                    downloader.download(url, "best", os.path.join(out_dir, f"pooled{i:05d}.%(ext)s"))
+            finally:
+                downloader.close()
+
+        print(f"ytdl-reuse: {args.tracks} tracks of {args.size} bytes from {base_url}")
+        fresh_time = timed("fresh", fresh, args.tracks)
+        pooled_time = timed("pooled", pooled, args.tracks)
+        print(f"speedup    {fresh_time / pooled_time:8.2f}x")
+    finally:
+        server.shutdown()
+        shutil.rmtree(work, ignore_errors=True)
+
+# ======= Stand-in Server =======
+# One HTTP server plays both sides. /v1/... answers the Spotify Web API calls
+# the converter makes, for a library of `size` generated tracks; /yt/...
+# answers YouTube searches and serves the same short media file for every
+# video; /cover/... serves album art.
+
+def bench_track(server, i):
+    album = i // TRACKS_PER_ALBUM
+    return {
+        "id": f"benchtrack{i:07d}",
+        "name": f"Bench Song {i}",
+        "duration_ms": int(server.media_seconds * 1000),
+        "track_number": i % TRACKS_PER_ALBUM + 1,
+        "external_ids": {"isrc": f"BENCH{i:07d}"},
+        "album": {
+            "id": f"benchalbum{album:06d}",
+            "name": f"Bench Album {album}",
+            "images": [{"url": f"{server.base_url}/cover/{album}.jpg", "width": 300, "height": 300}],
+        },
+        "artists": [{"name": f"Bench Artist {i % 97}"}],
+    }
+
+def bench_playlists(server):
+    """
+    playlist id -> (name, track indexes). The two user playlists overlap each
+    other and the saved tracks. IDs must be base62, or spotipy rejects them.
+    """
+    size = server.size
+    return {
+        f"bench{size}": (f"Bench {size}", range(size)),
+        "benchA": ("Bench A", range(0, size // 2)),
+        "benchB": ("Bench B", range(size // 4, size * 3 // 4)),
+    }
+
+def playlist_object(server, playlist_id):
+    name, indexes = bench_playlists(server)[playlist_id]
+    return {
+        "id": playlist_id, "name": name, "snapshot_id": f"snap-{len(indexes)}",
+        "owner": {"id": BENCH_USER}, "tracks": {"total": len(indexes)},
+    }
+
+def page(server, path, query, indexes, item):
+    offset = int(query.get("offset", 0))
+    limit = int(query.get("limit", 20))
+    chosen = indexes[offset:offset + limit]
+    following = None
+    if offset + limit < len(indexes):
+        following = f"{server.base_url}{path}?offset={offset + limit}&limit={limit}"
+    return {"items": [item(i) for i in chosen], "total": len(indexes), "offset": offset, "limit": limit,
+            "next": following}
+
+class BenchHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def handle(self):
+        # Clients drop their keep-alive connections when the run ends.
+        try:
+            super().handle()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def send_body(self, body, content_type, status=200, headers=None):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(body)
+
+    def send_json(self, data, status=200, headers=None):
+        self.send_body(json.dumps(data).encode("utf-8"), "application/json", status, headers)
+
+    def do_HEAD(self):
+        self.do_GET()
+
+    def do_GET(self):
+        url = urllib.parse.urlsplit(self.path)
+        query = dict(urllib.parse.parse_qsl(url.query))
+        try:
+            if url.path.startswith("/v1/"):
+                self.spotify(url.path, query)
+            elif url.path.startswith("/yt/"):
+                self.youtube(url.path, query)
+            elif url.path.startswith("/cover/"):
+                self.send_body(self.server.cover, "image/jpeg")
+            else:
+                self.send_json({"error": "not found"}, 404)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def spotify(self, path, query):
+        server = self.server
+        with server.lock:
+            server.api_requests += 1
+            throttle = server.throttle_every and server.api_requests % server.throttle_every == 0
+            if throttle:
+                server.throttled += 1
+        if server.api_latency:
+            time.sleep(server.api_latency)
+        if throttle:
+            self.send_json({"error": {"status": 429, "message": "API rate limit exceeded"}}, 429,
+                           {"Retry-After": str(server.retry_after)})
+            return
+        playlists = bench_playlists(server)
+        track = functools.partial(bench_track, server)
+        # spotipy asks for some endpoints with a trailing slash (/v1/tracks/?ids=...).
+        parts = path.strip("/").split("/")[1:]
+        if parts[:1] == ["playlists"] and len(parts) == 3 and parts[1] in playlists:
+            _, indexes = playlists[parts[1]]
+            self.send_json(page(server, path, query, indexes, lambda i: {"track": track(i)}))
+        elif parts[:1] == ["playlists"] and len(parts) == 2 and parts[1] in playlists:
+            self.send_json(playlist_object(server, parts[1]))
+        elif parts == ["me", "tracks"]:
+            self.send_json(page(server, path, query, range(server.size), lambda i: {"track": track(i)}))
+        elif parts[:1] == ["users"] and parts[2:] == ["playlists"]:
+            user_playlists = ["benchA", "benchB"]
+            self.send_json(page(server, path, query, range(len(user_playlists)),
+                                lambda i: playlist_object(server, user_playlists[i])))
+        elif parts == ["tracks"]:
+            ids = [int(track_id[len("benchtrack"):]) for track_id in query.get("ids", "").split(",") if track_id]
+            self.send_json({"tracks": [track(i) for i in ids]})
+        elif parts == ["search"]:
+            self.send_json({"tracks": page(server, path, query, range(SEARCH_TOTAL), track)})
+        elif parts == ["me"]:
+            self.send_json({"id": BENCH_USER, "display_name": "Bench User"})
+        else:
+            self.send_json({"error": {"status": 404, "message": "not found"}}, 404)
+
+    def youtube(self, path, query):
+        server = self.server
+        if server.latency:
+            time.sleep(server.latency)
+        if path == "/yt/search":
+            terms = query.get("q", "")
+            video_id = "v" + re.sub(r"\W+", "_", terms)[:60]
+            match = {"id": video_id, "title": terms, "channel": "Bench", "duration": server.media_seconds}
+            # A decoy the candidate scoring has to reject.
+            mix = {"id": video_id + "_mix", "title": f"{terms} 1 hour mix", "channel": "Loops", "duration": 3600}
+            self.send_json({"entries": [match, mix][:max(1, int(query.get("n", 2)))]})
+        elif path.startswith("/yt/media/"):
+            self.send_throttled(server.media, "audio/mp4")
+        else:
+            self.send_json({"error": "not found"}, 404)
+
+    def send_throttled(self, body, content_type):
+        """Send body at no more than the server's bandwidth (bytes/sec per stream)."""
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if self.command == "HEAD":
+            return
+        chunk = 64 * 1024
+        bandwidth = self.server.bandwidth
+        started = time.monotonic()
+        for offset in range(0, len(body), chunk):
+            self.wfile.write(body[offset:offset + chunk])
+            if bandwidth:
+                ahead = (offset + chunk) / bandwidth - (time.monotonic() - started)
+                if ahead > 0:
+                    time.sleep(ahead)
+
+def make_media(work, seconds):
+    """Generate a short AAC file and a cover JPEG with ffmpeg; returns their bytes."""
+    media = os.path.join(work, "media.m4a")
+    cover = os.path.join(work, "cover.jpg")
+    ffmpeg = [sc.FFMPEG_PATH, "-nostdin", "-hide_banner", "-loglevel", "error", "-y"]
+    subprocess.run([*ffmpeg, "-f", "lavfi", "-i", f"sine=frequency=440:duration={seconds}",
+                    "-c:a", "aac", "-b:a", "128k", media], check=True)
+    subprocess.run([*ffmpeg, "-f", "lavfi", "-i", "color=c=navy:s=300x300", "-frames:v", "1", cover], check=True)
+    with open(media, "rb") as f, open(cover, "rb") as g:
+        return f.read(), g.read()
+
+def start_bench_server(args, size, media, cover):
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), BenchHandler)
+    server.daemon_threads = True
+    server.base_url = f"http://127.0.0.1:{server.server_address[1]}"
+    server.size = size
+    server.media = media
+    server.cover = cover
+    server.media_seconds = args.media_seconds
+    server.latency = args.latency
+    server.api_latency = args.api_latency
+    server.bandwidth = args.bandwidth
+    server.throttle_every = args.throttle_every
+    server.retry_after = args.retry_after
+    server.lock = threading.Lock()
+    server.api_requests = 0
+    server.throttled = 0
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+# ======= Pipeline Benchmark =======
+
+class StaticToken:
+    """Auth manager handing spotipy a fixed token; the stand-in does not check it."""
+
+    def get_access_token(self, as_dict=False):
+        return "bench"
+
+class BenchDownloader(sc.YoutubeDownloader):
+    """The real yt-dlp download path, pointed at the stand-in instead of YouTube."""
+    server_url = None
+
+    def search(self, query):
+        key, _, terms = query.partition(":")
+        count = key[len("ytsearch"):] or "1"
+        url = f"{self.server_url}/yt/search?" + urllib.parse.urlencode({"q": terms, "n": count})
+        with urllib.request.urlopen(url) as response:
+            return json.load(response)
+
+    def download(self, url, audio_format, output_template, on_progress=None):
+        video_id = urllib.parse.parse_qs(urllib.parse.urlsplit(url).query)["v"][0]
+        return super().download(f"{self.server_url}/yt/media/{video_id}.m4a", "best", output_template, on_progress)
+
+class BenchFrontend(sc.ConsoleFrontend):
+    """Records when the first track finishes; prints nothing."""
+
+    def __init__(self):
+        super().__init__()
+        self.first_track = None
+
+    def _emit(self, event, **fields):
+        pass
+
+    def track_progress(self, job, track, error):
+        if self.first_track is None:
+            self.first_track = time.perf_counter()
+
+def peak_rss_mb(children=False):
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KiB, macOS bytes.
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+def run_scenario(args):
+    """Child process: convert one scenario against the stand-in and print the results as JSON."""
+    work = tempfile.mkdtemp(prefix="spotify_converter_bench_")
+    try:
+        sc.set_output_root(os.path.join(work, "out"))
+        sc.RESOLUTION_CACHE_PATH = os.path.join(work, "resolutions.sqlite3")
+        sc.JOBS_DB_PATH = os.path.join(work, "jobs.sqlite3")
+        sc.COVER_CACHE_DIR = os.path.join(work, "covers")
+        sc.SPOTIFY_API_PREFIX = f"{args.server}/v1/"
+        sc.sp = sc.make_spotify_client(StaticToken)
+        BenchDownloader.server_url = args.server
+        sc.YoutubeDownloader = BenchDownloader
+        sc.frontend = frontend = BenchFrontend()
+        if args.workers:
+            sc.set_io_limits(downloads=args.workers)
+
+        started = time.perf_counter()
+        if args.scenario == "playlist":
+            jobs = [sc.download_playlist(f"bench{args.tracks}", f"Bench {args.tracks}")]
+        elif args.scenario == "library":
+            jobs = [sc.mirror_library(BENCH_USER, sc.sp, include_saved=True)]
+        else:
+            jobs = []
+            found = 0
+            for offset in range(0, args.tracks, sc.search_limit):
+                _, tracks = sc.search_track_page("bench", offset % SEARCH_TOTAL)
+                found += len(tracks)
+        elapsed = time.perf_counter() - started
+        sc.close_downloaders()
+        sc.close_transcode_pool(wait=True)
+
+        if args.scenario == "search":
+            completed, failed = found, 0
+        else:
+            completed = sum(job.completed for job in jobs if job)
+            failed = sum(job.failed for job in jobs if job)
+        result = {
+            "scenario": args.scenario,
+            "size": args.tracks,
+            "completed": completed,
+            "failed": failed,
+            "seconds": round(elapsed, 3),
+            "first_track_seconds": round(frontend.first_track - started, 3) if frontend.first_track else None,
+            "tracks_per_minute": round(completed * 60 / elapsed, 1) if completed else None,
+            "peak_rss_mb": peak_rss_mb(),
+            "peak_child_rss_mb": peak_rss_mb(children=True),
+            "api_calls": sc.spotify_scheduler.calls,
+            "api_calls_per_track": round(sc.spotify_scheduler.calls / max(1, completed or args.tracks), 3),
+            "throttled": sc.spotify_scheduler.throttled,
+            "stages": {name: stage["seconds"] for name, stage in sc.metrics.snapshot()["stages"].items()},
+        }
+    finally:
+        shutil.rmtree(work, ignore_errors=True)
+    print(json.dumps(result))
+    # A scenario that converted nothing measured nothing.
+    return 0 if completed else 1
+
+def bench_pipeline(args):
+    sizes = [int(size) for size in args.sizes.split(",") if size]
+    work = tempfile.mkdtemp(prefix="spotify_converter_bench_")
+    try:
+        media, cover = make_media(work, args.media_seconds)
+    finally:
+        shutil.rmtree(work, ignore_errors=True)
+    print(f"{'scenario':<9} {'tracks':>7} {'first(s)':>9} {'tracks/min':>11} {'rss(MB)':>8} "
+          f"{'api/track':>10} {'429s':>5} {'failed':>7}")
+    status = 0
+    for size in sizes:
+        server = start_bench_server(args, size, media, cover)
+        try:
+            command = [sys.executable, os.path.abspath(__file__), "_run", "--scenario", args.scenario,
+                       "--tracks", str(size), "--server", server.base_url]
+            if args.workers:
+                command += ["--workers", str(args.workers)]
+            child = subprocess.run(command, capture_output=True, text=True)
+        finally:
+            server.shutdown()
+            server.server_close()
+        if not child.stdout.strip():
+            sys.stderr.write(child.stderr)
+            print(f"{args.scenario:<9} {size:>7} crashed (exit code {child.returncode})")
+            status = 1
+            continue
+        result = json.loads(child.stdout.strip().splitlines()[-1])
+        if child.returncode:
+            status = 1
+        result.update(
+            server_api_requests=server.api_requests, latency=args.latency, api_latency=args.api_latency,
+            bandwidth=args.bandwidth, throttle_every=args.throttle_every, time=round(time.time()),
+        )
+        print(f"{result['scenario']:<9} {size:>7} {result['first_track_seconds'] or '-':>9} "
+              f"{result['tracks_per_minute'] or '-':>11} {result['peak_rss_mb'] or '-':>8} "
+              f"{result['api_calls_per_track']:>10} {result['throttled']:>5} {result['failed']:>7}")
+        if args.output:
+            with open(args.output, "a", encoding="utf-8") as f:
+                f.write(json.dumps(result) + "\n")
+    if status:
+        print("Some runs converted no tracks or crashed; see above.", file=sys.stderr)
+    return status
+
+BENCHMARKS = {
+    "pipeline": bench_pipeline,
+    "ytdl-reuse": bench_ytdl_reuse,
+    "_run": run_scenario,
+}
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Offline spotify_converter benchmarks.")
+    parser.add_argument("benchmark", choices=sorted(BENCHMARKS))
+    parser.add_argument("--tracks", type=int, default=200, help="ytdl-reuse: number of tracks (default 200)")
+    parser.add_argument("--size", type=int, default=256 * 1024,
+                        help="ytdl-reuse: bytes per media file (default 256 KiB)")
+    parser.add_argument("--scenario", choices=("playlist", "library", "search"), default="playlist",
+                        help="pipeline: download_playlist, mirror_library or search pages (default playlist)")
+    parser.add_argument("--sizes", default="10,1000,10000", help="pipeline: track counts (default 10,1000,10000)")
+    parser.add_argument("--workers", type=int, help="pipeline: download workers per job")
+    parser.add_argument("--media-seconds", type=float, default=5, help="length of the served audio (default 5)")
+    parser.add_argument("--latency", type=float, default=0.05, help="YouTube stand-in latency in seconds")
+    parser.add_argument("--api-latency", type=float, default=0.02, help="Spotify stand-in latency in seconds")
+    parser.add_argument("--bandwidth", type=int, default=2 * 1024 * 1024,
+                        help="media bytes/sec per download, 0 for unlimited (default 2 MiB/s)")
+    parser.add_argument("--throttle-every", type=int, default=0,
+                        help="answer every Nth Spotify request with 429 (default off)")
+    parser.add_argument("--retry-after", type=int, default=1, help="Retry-After seconds sent with 429s")
+    parser.add_argument("--output", help="append pipeline results to this file as JSON lines")
+    parser.add_argument("--server", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+    return BENCHMARKS[args.benchmark](args) or 0
+
+if __name__ == "__main__":
+    sys.exit(main())
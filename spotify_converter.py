@@ -1,168 +1,3037 @@
+import argparse
+import collections
+import contextlib
+import hashlib
+import itertools
+import json
+import multiprocessing
 import os
+import queue
+import random
 import re
-import tkinter as tk
-from tkinter import messagebox, ttk
-import spotipy
-from spotipy.oauth2 import SpotifyClientCredentials, SpotifyOAuth
-import yt_dlp
+import shutil
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+
+# tkinter, spotipy and yt_dlp are slow to import, so they are only imported
+# where they are first needed: a one-track CLI run never loads tkinter, and
+# nothing loads yt_dlp until the first download starts.
 
 # ======= Spotify API Configuration =======
-SPOTIFY_CLIENT_ID = "" # Add your own client ID and secret here
-SPOTIFY_CLIENT_SECRET = ""  # Add your own client ID and secret here
+SPOTIFY_CLIENT_ID = os.environ.get("SPOTIFY_CLIENT_ID", "") # Add your own client ID and secret here
+SPOTIFY_CLIENT_SECRET = os.environ.get("SPOTIFY_CLIENT_SECRET", "")  # Add your own client ID and secret here
 SPOTIFY_REDIRECT_URI = "http://localhost:8888/callback"  # for user auth (liked songs)
 SCOPE = "user-library-read playlist-read-private"
 
-# Create a Spotify client for general searches (Client Credentials flow)
-try:
-    sp = spotipy.Spotify(
-        auth_manager=SpotifyClientCredentials(
-            client_id=SPOTIFY_CLIENT_ID,
-            client_secret=SPOTIFY_CLIENT_SECRET
-        )
-    )
-except Exception as e:
-    print(f"Error setting up Spotify client: {e}")
-    exit(1)
+# Point the clients at another Web API root, e.g. a local fake server.
+SPOTIFY_API_PREFIX = os.environ.get("SPOTIFY_API_PREFIX")
+
+# ======= Spotify Request Scheduling =======
+# Every Spotify call from every thread goes through one scheduler: a token
+# bucket keeps the sustained request rate under Spotify's limit, a semaphore
+# caps calls in flight, and a 429 pauses all callers for its Retry-After
+# before the request is retried with jittered exponential backoff.
+
+SPOTIFY_REQUESTS_PER_SECOND = 8.0
+SPOTIFY_BURST = 16
+SPOTIFY_MAX_IN_FLIGHT = 4
+SPOTIFY_MAX_RETRIES = 6
+SPOTIFY_BACKOFF_BASE = 0.5  # seconds
+SPOTIFY_BACKOFF_MAX = 30.0  # seconds
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+
+def spotify_error_status(error):
+    """Return (http_status, retry_after_seconds) for an error raised by a Spotify call."""
+    import requests
+    import spotipy
+    if isinstance(error, spotipy.SpotifyException):
+        headers = getattr(error, "headers", None) or {}
+        try:
+            retry_after = float(headers.get("Retry-After"))
+        except (TypeError, ValueError):
+            retry_after = None
+        return error.http_status, retry_after
+    if isinstance(error, (requests.ConnectionError, requests.Timeout)):
+        return 503, None
+    return None, None
+
+class SpotifyScheduler:
+    def __init__(self, rate=SPOTIFY_REQUESTS_PER_SECOND, burst=SPOTIFY_BURST,
+                 max_in_flight=SPOTIFY_MAX_IN_FLIGHT, max_retries=SPOTIFY_MAX_RETRIES):
+        self.rate = rate
+        self.burst = burst
+        self.max_retries = max_retries
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._blocked_until = 0.0
+        self._lock = threading.Lock()
+        self._in_flight = threading.BoundedSemaphore(max_in_flight)
+        self.calls = 0
+        self.throttled = 0
+
+    def _take_token(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                delay = self._blocked_until - now
+                if delay <= 0:
+                    if self._tokens >= 1:
+                        self._tokens -= 1
+                        return
+                    delay = (1 - self._tokens) / self.rate
+            time.sleep(delay)
+
+    def _backoff(self, attempt):
+        delay = min(SPOTIFY_BACKOFF_MAX, SPOTIFY_BACKOFF_BASE * (2 ** attempt))
+        return random.uniform(delay / 2, delay)
+
+    def call(self, func, *args, **kwargs):
+        with metrics.time("spotify"):
+            return self._call(func, *args, **kwargs)
+
+    def _call(self, func, *args, **kwargs):
+        attempt = 0
+        while True:
+            self._take_token()
+            with self._in_flight:
+                with self._lock:
+                    self.calls += 1
+                try:
+                    return func(*args, **kwargs)
+                except Exception as e:
+                    status, retry_after = spotify_error_status(e)
+                    if status not in RETRYABLE_STATUSES or attempt >= self.max_retries:
+                        raise
+            delay = self._backoff(attempt)
+            if retry_after is not None:
+                delay = retry_after + random.uniform(0, 1)
+            if status == 429:
+                with self._lock:
+                    self.throttled += 1
+                    self._blocked_until = max(self._blocked_until, time.monotonic() + delay)
+            time.sleep(delay)
+            attempt += 1
+
+class ScheduledSpotify:
+    """
+    Wraps a spotipy client so every API method call goes through a
+    SpotifyScheduler. The client is built by factory() on first use.
+    """
+
+    def __init__(self, factory, scheduler):
+        self._factory = factory
+        self._client = None
+        self._client_lock = threading.Lock()
+        self._scheduler = scheduler
+
+    def _get_client(self):
+        with self._client_lock:
+            if self._client is None:
+                self._client = self._factory()
+            return self._client
+
+    def __getattr__(self, name):
+        attr = getattr(self._get_client(), name)
+        if not callable(attr):
+            return attr
+
+        def scheduled(*args, **kwargs):
+            return self._scheduler.call(attr, *args, **kwargs)
+        return scheduled
+
+spotify_scheduler = SpotifyScheduler()
+
+def make_spotify_client(auth_manager_factory):
+    def build():
+        import requests
+        import spotipy
+        # A plain session turns off spotipy's own per-call retries, so 429s reach
+        # the shared scheduler (with their Retry-After header) instead.
+        client = spotipy.Spotify(auth_manager=auth_manager_factory(), requests_session=requests.Session())
+        if SPOTIFY_API_PREFIX:
+            client.prefix = SPOTIFY_API_PREFIX
+        return client
+    return ScheduledSpotify(build, spotify_scheduler)
+
+def client_credentials_auth():
+    from spotipy.oauth2 import SpotifyClientCredentials
+    return SpotifyClientCredentials(
+        client_id=SPOTIFY_CLIENT_ID,
+        client_secret=SPOTIFY_CLIENT_SECRET
+    )
+
+def user_oauth():
+    from spotipy.oauth2 import SpotifyOAuth
+    return SpotifyOAuth(
+        client_id=SPOTIFY_CLIENT_ID,
+        client_secret=SPOTIFY_CLIENT_SECRET,
+        redirect_uri=SPOTIFY_REDIRECT_URI,
+        scope=SCOPE
+    )
+
+# Client for general searches (Client Credentials flow)
+sp = make_spotify_client(client_credentials_auth)
+
+# For user authentication (to get liked songs and private playlists)
+sp_user = None
+# Profile of the logged-in user, fetched once at login.
+current_user = None
+
+# ======= Global Variables for Pagination (Search Tab) =======
+search_limit = 10
+search_query = ""
+search_tracks_offset = 0
+search_tracks_total = 0
+search_playlists_offset = 0
+search_playlists_total = 0
+# Model objects behind each row of the search listboxes.
+search_track_results = []
+search_playlist_results = []
+# Bumped by every new search; background results from an older one are dropped.
+search_generation = 0
+search_futures = []
+search_after_id = None
+
+# ======= Global Variables for Pagination (Account Tab) =======
+account_limit = 10
+account_id = ""
+account_playlists_offset = 0
+account_playlists_total = 0
+account_liked_offset = 0
+account_liked_total = 0
+account_playlist_results = []
+account_liked_results = []
+
+# NEW: Global variables for playlist lookup mode
+playlist_lookup_mode = False
+lookup_playlist_id = ""
+lookup_playlist_name = ""
+
+# ======= Helper Functions =======
+
+def sanitize_filename(name: str) -> str:
+    return re.sub(r'[\\/*?:"<>|]', '_', name)
+
+# Track, album, playlist and artist IDs are 22 base62 characters.
+SPOTIFY_ID_PATTERN = re.compile(r"[0-9A-Za-z]{22}")
+
+def is_spotify_id(value: str) -> bool:
+    return SPOTIFY_ID_PATTERN.fullmatch(value or "") is not None
+
+def parse_spotify_id_from_url(url_or_uri: str, expected_type: str) -> str:
+    url_or_uri = url_or_uri.strip()
+    if url_or_uri.startswith("spotify:") and expected_type in url_or_uri:
+        parts = url_or_uri.split(":")
+        if len(parts) == 3:
+            return parts[2]
+    if "open.spotify.com" in url_or_uri and expected_type in url_or_uri:
+        parts = url_or_uri.split("/")
+        for i, part in enumerate(parts):
+            if part == expected_type and i + 1 < len(parts):
+                raw_id = parts[i + 1]
+                return raw_id.split("?")[0]
+    return url_or_uri
+
+# ======= Track Records =======
+# Spotify returns a lot more than we need for every track (album objects,
+# markets, images...). Playlist requests ask only for these fields, and
+# everything else is collapsed into a compact Track as soon as it arrives.
+
+PLAYLIST_ITEM_FIELDS = (
+    "items(track(id,name,duration_ms,track_number,external_ids(isrc),album(id,name,images),artists(name))),"
+    "next,total"
+)
+# Album art is embedded at this width (Spotify offers 640, 300 and 64 px).
+COVER_ART_WIDTH = 300
+
+def pick_cover_url(images):
+    """Return the URL of the smallest album image at least COVER_ART_WIDTH wide (else the largest)."""
+    images = sorted((image for image in images or [] if image.get("url")), key=lambda image: image.get("width") or 0)
+    for image in images:
+        if (image.get("width") or 0) >= COVER_ART_WIDTH:
+            return image["url"]
+    return images[-1]["url"] if images else None
+
+class Track:
+    __slots__ = ("id", "name", "artists", "duration_ms", "isrc", "album", "track_number", "album_id", "cover_url")
+
+    def __init__(self, id, name, artists, duration_ms=0, isrc=None, album="", track_number=0, album_id=None,
+                 cover_url=None):
+        self.id = id
+        self.name = name
+        self.artists = artists
+        self.duration_ms = duration_ms
+        self.isrc = isrc
+        self.album = album
+        self.track_number = track_number
+        self.album_id = album_id
+        self.cover_url = cover_url
+
+    @classmethod
+    def from_api(cls, track):
+        """Build a Track from a Spotify track object, or return None for empty items."""
+        if not track:
+            return None
+        album = track.get("album") or {}
+        return cls(
+            track.get("id"),
+            track.get("name", ""),
+            ", ".join([a["name"] for a in track.get("artists", [])]),
+            track.get("duration_ms") or 0,
+            (track.get("external_ids") or {}).get("isrc"),
+            album.get("name", ""),
+            track.get("track_number") or 0,
+            album.get("id"),
+            pick_cover_url(album.get("images")),
+        )
+
+    @property
+    def label(self):
+        return f"{self.name} - {self.artists}"
+
+    def to_list(self):
+        return [getattr(self, slot) for slot in self.__slots__]
+
+    @classmethod
+    def from_list(cls, values):
+        return cls(*values)
+
+    def __repr__(self):
+        return f"Track({self.id!r}, {self.label!r})"
+
+PLAYLIST_FIELDS = "id,name,snapshot_id,owner(id),tracks(total)"
+
+class Playlist:
+    __slots__ = ("id", "name", "owner_id", "snapshot_id", "total")
+
+    def __init__(self, id, name, owner_id=None, snapshot_id=None, total=0):
+        self.id = id
+        self.name = name
+        self.owner_id = owner_id
+        self.snapshot_id = snapshot_id
+        self.total = total
+
+    @classmethod
+    def from_api(cls, playlist):
+        if not playlist:
+            return None
+        return cls(
+            playlist.get("id"),
+            playlist.get("name", ""),
+            (playlist.get("owner") or {}).get("id"),
+            playlist.get("snapshot_id"),
+            (playlist.get("tracks") or {}).get("total", 0),
+        )
+
+    def __repr__(self):
+        return f"Playlist({self.id!r}, {self.name!r})"
+
+def playlists_from_items(items):
+    return [Playlist.from_api(item) for item in items if item]
+
+def tracks_from_items(items):
+    """Convert playlist/saved-track items ({"track": {...}}) into Track records."""
+    tracks = []
+    for item in items:
+        track = Track.from_api(item.get("track"))
+        if track is not None:
+            tracks.append(track)
+    return tracks
+
+# ======= Metrics =======
+# Each pipeline stage is timed with metrics.time(stage): Spotify requests,
+# YouTube resolution, media download, transcode and file write. The shared
+# registry keeps a count, error count and latency histogram per stage plus
+# the recent track completions behind the tracks/min and ETA shown with
+# progress, and can be written out as JSON or Prometheus text after a run.
+
+METRIC_STAGES = ("spotify", "resolve", "download", "transcode", "write")
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)  # seconds
+THROUGHPUT_WINDOW = 60  # seconds of completions behind tracks/min
+METRICS_PATH = os.environ.get("SPOTIFY_CONVERTER_METRICS")
+
+class StageMetrics:
+    __slots__ = ("count", "errors", "seconds", "buckets")
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.seconds = 0.0
+        # Per-bucket (not cumulative) counts; the last one is +Inf.
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+
+    def observe(self, seconds):
+        self.count += 1
+        self.seconds += seconds
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if seconds <= bound:
+                self.buckets[i] += 1
+                return
+        self.buckets[-1] += 1
+
+    def cumulative_buckets(self):
+        total = 0
+        for bound, count in zip([*LATENCY_BUCKETS, "+Inf"], self.buckets):
+            total += count
+            yield str(bound), total
+
+class Metrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.started = time.time()
+            self._started_monotonic = time.monotonic()
+            self.stages = {stage: StageMetrics() for stage in METRIC_STAGES}
+            self.counters = {}
+            self.tracks_done = 0
+            self.tracks_failed = 0
+            self._recent = collections.deque()
+
+    def _stage(self, stage):
+        if stage not in self.stages:
+            self.stages[stage] = StageMetrics()
+        return self.stages[stage]
+
+    def observe(self, stage, seconds):
+        with self._lock:
+            self._stage(stage).observe(seconds)
+
+    def error(self, stage):
+        with self._lock:
+            self._stage(stage).errors += 1
+
+    @contextlib.contextmanager
+    def time(self, stage):
+        started = time.perf_counter()
+        try:
+            yield
+        except BaseException:
+            self.error(stage)
+            raise
+        finally:
+            self.observe(stage, time.perf_counter() - started)
+
+    def count(self, name, amount=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def track_finished(self, ok):
+        with self._lock:
+            if ok:
+                self.tracks_done += 1
+            else:
+                self.tracks_failed += 1
+            self._recent.append(time.monotonic())
+
+    def tracks_per_minute(self):
+        now = time.monotonic()
+        with self._lock:
+            while self._recent and self._recent[0] < now - THROUGHPUT_WINDOW:
+                self._recent.popleft()
+            window = min(THROUGHPUT_WINDOW, now - self._started_monotonic)
+            return len(self._recent) * 60 / window if window > 0 else 0.0
+
+    def eta(self, remaining):
+        """Seconds left for remaining tracks at the current rate, or None when nothing has finished lately."""
+        rate = self.tracks_per_minute()
+        return remaining * 60 / rate if rate else None
+
+    def snapshot(self):
+        tracks_per_minute = self.tracks_per_minute()
+        with self._lock:
+            return {
+                "started": round(self.started, 3),
+                "elapsed_seconds": round(time.time() - self.started, 3),
+                "tracks": {"done": self.tracks_done, "failed": self.tracks_failed},
+                "tracks_per_minute": round(tracks_per_minute, 2),
+                "spotify": {"calls": spotify_scheduler.calls, "throttled": spotify_scheduler.throttled},
+                "counters": dict(self.counters),
+                "stages": {
+                    name: {
+                        "count": stage.count,
+                        "errors": stage.errors,
+                        "seconds": round(stage.seconds, 6),
+                        "buckets": dict(stage.cumulative_buckets()),
+                    }
+                    for name, stage in self.stages.items()
+                },
+            }
+
+    def to_prometheus(self):
+        snapshot = self.snapshot()
+        prefix = "spotify_converter"
+        lines = [
+            f"# HELP {prefix}_stage_seconds Time spent per pipeline stage.",
+            f"# TYPE {prefix}_stage_seconds histogram",
+        ]
+        for name, stage in snapshot["stages"].items():
+            for bound, count in stage["buckets"].items():
+                lines.append(f'{prefix}_stage_seconds_bucket{{stage="{name}",le="{bound}"}} {count}')
+            lines.append(f'{prefix}_stage_seconds_sum{{stage="{name}"}} {stage["seconds"]}')
+            lines.append(f'{prefix}_stage_seconds_count{{stage="{name}"}} {stage["count"]}')
+        lines.append(f"# TYPE {prefix}_stage_errors_total counter")
+        for name, stage in snapshot["stages"].items():
+            lines.append(f'{prefix}_stage_errors_total{{stage="{name}"}} {stage["errors"]}')
+        lines.append(f"# TYPE {prefix}_tracks_total counter")
+        for result, count in snapshot["tracks"].items():
+            lines.append(f'{prefix}_tracks_total{{result="{result}"}} {count}')
+        lines.append(f"# TYPE {prefix}_spotify_requests_total counter")
+        lines.append(f'{prefix}_spotify_requests_total {snapshot["spotify"]["calls"]}')
+        lines.append(f"# TYPE {prefix}_spotify_throttled_total counter")
+        lines.append(f'{prefix}_spotify_throttled_total {snapshot["spotify"]["throttled"]}')
+        lines.append(f"# TYPE {prefix}_events_total counter")
+        for name, count in snapshot["counters"].items():
+            lines.append(f'{prefix}_events_total{{event="{name}"}} {count}')
+        lines.append(f"# TYPE {prefix}_tracks_per_minute gauge")
+        lines.append(f'{prefix}_tracks_per_minute {snapshot["tracks_per_minute"]}')
+        return "\n".join(lines) + "\n"
+
+    def write(self, path):
+        """Write the metrics to path: JSON for a .json file, Prometheus text otherwise."""
+        if path.lower().endswith(".json"):
+            text = json.dumps(self.snapshot(), indent=2) + "\n"
+        else:
+            text = self.to_prometheus()
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            f.write(text)
+        os.replace(path + ".tmp", path)
+
+metrics = Metrics()
+
+def format_duration(seconds):
+    seconds = int(seconds)
+    if seconds >= 3600:
+        return f"{seconds // 3600}h{seconds % 3600 // 60:02d}m"
+    if seconds >= 60:
+        return f"{seconds // 60}m{seconds % 60:02d}s"
+    return f"{seconds}s"
+
+# ======= Progress Reporting =======
+# Core code reports through set_status/show_error and report_job_progress,
+# which forward to the active front end: the console (the default, used by
+# the CLI) or the Tk window.
+
+def format_job_progress(job, track, error):
+    finished = job.completed + job.failed
+    if error is not None:
+        message = f"[{finished}/{job.total}] Error downloading {track.name}: {error}"
+    else:
+        message = f"[{finished}/{job.total}] Downloaded: {track.label}"
+    rate = metrics.tracks_per_minute()
+    if rate:
+        eta = metrics.eta(job.remaining)
+        message += f" ({rate:.1f} tracks/min, ETA {format_duration(eta)})"
+    return message
+
+class ConsoleFrontend:
+    """Prints progress to stderr, or as JSON lines on stdout when json_output is set."""
+
+    def __init__(self, json_output=False):
+        self.json_output = json_output
+        self.errors = 0
+        self._lock = threading.Lock()
+
+    def _emit(self, event, **fields):
+        with self._lock:
+            if self.json_output:
+                print(json.dumps({"event": event, "time": round(time.time(), 3), **fields}), flush=True)
+            else:
+                print(fields["message"], file=sys.stderr, flush=True)
+
+    def status(self, message):
+        self._emit("status", message=message)
+
+    def error(self, title, message):
+        with self._lock:
+            self.errors += 1
+        self._emit("error", title=title, message=f"{title}: {message}")
+
+    def track_progress(self, job, track, error):
+        eta = metrics.eta(job.remaining)
+        self._emit(
+            "track",
+            job=job.name,
+            track_id=track.id,
+            name=track.name,
+            artists=track.artists,
+            ok=error is None,
+            error=str(error) if error is not None else None,
+            completed=job.completed,
+            failed=job.failed,
+            total=job.total,
+            tracks_per_minute=round(metrics.tracks_per_minute(), 2),
+            eta_seconds=round(eta) if eta is not None else None,
+            message=format_job_progress(job, track, error),
+        )
+
+class TkFrontend:
+    def status(self, message):
+        post_ui(status_var.set, message)
+
+    def error(self, title, message):
+        post_ui(messagebox.showerror, title, message)
+
+    def track_progress(self, job, track, error):
+        self.status(format_job_progress(job, track, error))
+
+frontend = ConsoleFrontend()
+
+# ======= Background Tasks =======
+# Spotify and yt-dlp calls never run on the Tk thread. Handlers submit work to
+# one of the executors below, and anything that has to touch a widget is put on
+# ui_events, which the Tk main loop drains through root.after.
+
+api_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="spotify-api")
+# Conversion jobs only list tracks and hand them to the shared download and
+# transcode schedulers, so many can run at once and share those fairly.
+job_executor = ThreadPoolExecutor(max_workers=16, thread_name_prefix="convert-job")
+
+ui_events = queue.Queue()
+UI_POLL_MS = 50
+
+def post_ui(callback, *args):
+    ui_events.put((callback, args))
+
+def set_status(message):
+    frontend.status(message)
+
+def show_error(title, message):
+    frontend.error(title, message)
+
+def process_ui_events():
+    while True:
+        try:
+            callback, args = ui_events.get_nowait()
+        except queue.Empty:
+            break
+        try:
+            callback(*args)
+        except Exception as e:
+            print(f"Error handling UI event: {e}", file=sys.stderr)
+    root.after(UI_POLL_MS, process_ui_events)
+
+def run_in_background(task, *args, on_done=None, error_title="Error", error_prefix=None, executor=None):
+    """
+    Run task(*args) on a background executor. on_done(result) is then called
+    on the Tk thread; failures are shown in an error dialog instead.
+    """
+    def runner():
+        try:
+            result = task(*args)
+        except Exception as e:
+            show_error(error_title, f"{error_prefix}: {e}" if error_prefix else str(e))
+            return
+        if on_done is not None:
+            post_ui(on_done, result)
+    return (executor or api_executor).submit(runner)
+
+def run_job_in_background(task, *args):
+    return run_in_background(task, *args, executor=job_executor)
+
+# ======= YouTube Resolution Cache =======
+# Searching YouTube is the slowest and most rate-limited step of a conversion,
+# so the video picked for each track is remembered on disk. Entries are keyed
+# by Spotify track ID, with "name - artists" as a fallback for tracks that
+# were selected without one.
+
+APP_DATA_DIR = os.path.join(os.path.expanduser("~"), ".spotify_converter")
+RESOLUTION_CACHE_PATH = os.path.join(APP_DATA_DIR, "resolutions.sqlite3")
+RESOLUTION_CACHE_TTL = 30 * 24 * 60 * 60  # seconds
+RESOLUTION_CACHE_MAX_ENTRIES = 50000
+
+class ResolutionCache:
+    """SQLite-backed map from a track to its YouTube video, with TTL and LRU eviction."""
+
+    def __init__(self, path, ttl=RESOLUTION_CACHE_TTL, max_entries=RESOLUTION_CACHE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS resolutions ("
+                " cache_key TEXT PRIMARY KEY,"
+                " video_id TEXT NOT NULL,"
+                " format_id TEXT,"
+                " resolved_at REAL NOT NULL,"
+                " last_used REAL NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS resolutions_last_used ON resolutions (last_used)")
+
+    @staticmethod
+    def _keys(track_id, track_name, artist_name):
+        # Only tracks without an ID fall back to their name: different
+        # recordings with the same title and artists have their own videos.
+        if track_id:
+            return [f"id:{track_id}"]
+        if track_name:
+            return [f"name:{track_name.strip().lower()} - {artist_name.strip().lower()}"]
+        return []
+
+    def get(self, track_id, track_name, artist_name):
+        """Return (video_id, format_id) for the track, or None on a miss."""
+        now = time.time()
+        with self._lock, self._conn:
+            for key in self._keys(track_id, track_name, artist_name):
+                row = self._conn.execute(
+                    "SELECT video_id, format_id, resolved_at FROM resolutions WHERE cache_key = ?", (key,)
+                ).fetchone()
+                if row is None:
+                    continue
+                video_id, format_id, resolved_at = row
+                if now - resolved_at > self.ttl:
+                    self._conn.execute("DELETE FROM resolutions WHERE cache_key = ?", (key,))
+                    continue
+                self._conn.execute("UPDATE resolutions SET last_used = ? WHERE cache_key = ?", (now, key))
+                return video_id, format_id
+        return None
+
+    def put(self, track_id, track_name, artist_name, video_id, format_id=None):
+        now = time.time()
+        with self._lock, self._conn:
+            for key in self._keys(track_id, track_name, artist_name):
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO resolutions VALUES (?, ?, ?, ?, ?)",
+                    (key, video_id, format_id, now, now),
+                )
+            (count,) = self._conn.execute("SELECT COUNT(*) FROM resolutions").fetchone()
+            if count > self.max_entries:
+                self._conn.execute(
+                    "DELETE FROM resolutions WHERE cache_key IN"
+                    " (SELECT cache_key FROM resolutions ORDER BY last_used LIMIT ?)",
+                    (count - self.max_entries,),
+                )
+
+    def invalidate(self, track_id, track_name, artist_name):
+        with self._lock, self._conn:
+            for key in self._keys(track_id, track_name, artist_name):
+                self._conn.execute("DELETE FROM resolutions WHERE cache_key = ?", (key,))
+
+_resolution_cache = None
+_resolution_cache_lock = threading.Lock()
+
+def get_resolution_cache():
+    global _resolution_cache
+    with _resolution_cache_lock:
+        if _resolution_cache is None:
+            _resolution_cache = ResolutionCache(RESOLUTION_CACHE_PATH)
+        return _resolution_cache
+
+# ======= I/O Budget =======
+# Global caps that let a bulk export run at a predictable cost: bytes
+# downloaded per second and bytes written to the output disk per second,
+# shared by every download and transcode in the process. How many downloads
+# and transcodes run at once is set on the schedulers (see set_io_limits).
+# All of them can be changed while jobs run.
+
+RATE_UNITS = {"": 1, "k": 1024, "m": 1024 ** 2, "g": 1024 ** 3}
+
+class RateLimiter:
+    """
+    Caps the combined rate of bytes reported by any number of threads:
+    consume(n) is called once n bytes have gone through and blocks while
+    the budget is spent. rate is in bytes per second; 0 means unlimited.
+    """
+
+    def __init__(self, rate=0):
+        self.rate = rate
+        self._cond = threading.Condition()
+        self._ready_at = 0.0
+
+    def set_rate(self, rate):
+        with self._cond:
+            self.rate = max(0, rate)
+            # Waiting threads re-check against the new rate right away.
+            self._ready_at = 0.0
+            self._cond.notify_all()
+
+    def consume(self, amount):
+        with self._cond:
+            while self.rate:
+                now = time.monotonic()
+                if self._ready_at <= now:
+                    self._ready_at = now + amount / self.rate
+                    return
+                self._cond.wait(self._ready_at - now)
+
+download_budget = RateLimiter()
+write_budget = RateLimiter()
+
+def parse_rate(text):
+    """Parse a byte rate such as 500K, 2.5M or 1G/s; 0 or "unlimited" means no cap."""
+    text = text.strip().lower()
+    if text in ("", "unlimited", "none"):
+        return 0
+    match = re.fullmatch(r"(\d+(?:\.\d+)?)\s*([kmg]?)(?:i?b)?(?:/s)?", text)
+    if not match:
+        raise ValueError(f"Not a byte rate: {text!r} (try 500K or 2M)")
+    return int(float(match.group(1)) * RATE_UNITS[match.group(2)])
+
+def format_rate(rate):
+    if not rate:
+        return "unlimited"
+    for unit in ("G", "M", "K"):
+        if rate >= RATE_UNITS[unit.lower()]:
+            return f"{round(rate / RATE_UNITS[unit.lower()], 2):g}{unit}/s"
+    return f"{rate}/s"
+
+# ======= YouTube Downloaders =======
+# Creating a YoutubeDL loads its extractors and opens a new HTTP session,
+# which for short tracks costs about as much as the download. Workers borrow
+# a warm instance from a shared pool instead and keep its extractors and
+# pooled connections across tracks and jobs; only the output path, format and
+# progress hook change per download. Transcoding happens separately, in the
+# transcode pool.
+
+# quiet alone still prints "[download] xx%" lines to stdout, which would
+# break the --json output; progress is reported through the hooks instead.
+YTDL_BASE_OPTIONS = {"noplaylist": True, "quiet": True, "no_warnings": True, "noprogress": True}
+
+class YoutubeDownloader:
+    """
+    A long-lived YoutubeDL for downloads, plus one for flat searches. Not
+    thread-safe: a worker holds it through pooled_downloader() while in use.
+    """
+
+    def __init__(self, options=None):
+        import yt_dlp
+        self._on_progress = None
+        self._downloaded = {}
+        self._selectors = {}
+        self._search_ydl = None
+        opts = {**YTDL_BASE_OPTIONS, **(options or {})}
+        opts.update(outtmpl={"default": "%(id)s.%(ext)s"}, progress_hooks=[self._progress_hook])
+        self.ydl = yt_dlp.YoutubeDL(opts)
+
+    def _progress_hook(self, d):
+        # Bytes are counted per file, as each format of a download restarts
+        # at 0. Only "downloading" events count: "finished" repeats the total
+        # under the final file name.
+        if d.get("status") == "downloading":
+            filename = d.get("tmpfilename") or d.get("filename")
+            downloaded = d.get("downloaded_bytes") or 0
+            received = downloaded - self._downloaded.get(filename, 0)
+            self._downloaded[filename] = downloaded
+            if received > 0:
+                download_budget.consume(received)
+        if self._on_progress:
+            self._on_progress(d)
+
+    def search(self, query):
+        """Metadata-only extraction: search results come back as flat entries."""
+        if self._search_ydl is None:
+            import yt_dlp
+            self._search_ydl = yt_dlp.YoutubeDL(
+                {**YTDL_BASE_OPTIONS, "extract_flat": "in_playlist", "skip_download": True}
+            )
+        return self._search_ydl.extract_info(query, download=False)
+
+    def download(self, url, audio_format, output_template, on_progress=None):
+        """Download url to output_template (an absolute yt-dlp template) and return its info dict."""
+        selector = self._selectors.get(audio_format)
+        if selector is None:
+            selector = self._selectors[audio_format] = self.ydl.build_format_selector(audio_format)
+        self.ydl.format_selector = selector
+        self.ydl.params["outtmpl"]["default"] = output_template
+        self._on_progress = on_progress
+        self._downloaded.clear()
+        try:
+            return self.ydl.extract_info(url, download=True)
+        finally:
+            self._on_progress = None
+
+    def close(self):
+        for ydl in (self.ydl, self._search_ydl):
+            if ydl is not None:
+                ydl.close()
+
+_idle_downloaders = []
+_idle_downloaders_lock = threading.Lock()
+
+@contextlib.contextmanager
+def pooled_downloader():
+    """Borrow an idle YoutubeDownloader (or create one) and return it to the pool afterwards."""
+    with _idle_downloaders_lock:
+        downloader = _idle_downloaders.pop() if _idle_downloaders else None
+    if downloader is None:
+        downloader = YoutubeDownloader()
+    try:
+        yield downloader
+    finally:
+        with _idle_downloaders_lock:
+            _idle_downloaders.append(downloader)
+
+def close_downloaders():
+    with _idle_downloaders_lock:
+        downloaders = list(_idle_downloaders)
+        _idle_downloaders.clear()
+    for downloader in downloaders:
+        downloader.close()
+
+# ======= YouTube Candidate Matching =======
+# Instead of downloading the first search hit, one flat (metadata only)
+# search lists the top MATCH_CANDIDATES videos, each is scored against the
+# Spotify track's duration, title and artists, and only the best one is
+# downloaded. Tracks without a close enough candidate are flagged as
+# "unmatched" instead of fetching a live version or an hour-long mix.
+
+MATCH_CANDIDATES = 8
+MATCH_MIN_SCORE = 0.7
+# Full duration marks within the tolerance, none past the maximum; a
+# candidate further off than the maximum is never picked.
+MATCH_DURATION_TOLERANCE_S = 5
+MATCH_MAX_DURATION_DIFF_S = 45
+MATCH_WEIGHTS = {"duration": 0.5, "title": 0.3, "artists": 0.2}
+# Words that mark a different recording unless the Spotify title has them too.
+MATCH_UNWANTED_WORDS = {
+    "live", "cover", "remix", "karaoke", "instrumental", "acoustic", "sped", "slowed",
+    "reverb", "nightcore", "8d", "hour", "hours", "loop", "mix", "reaction", "tutorial",
+}
+MATCH_UNWANTED_PENALTY = 0.25
+
+class NoMatchError(LookupError):
+    """No YouTube candidate scored above MATCH_MIN_SCORE."""
+
+def match_words(text):
+    return re.findall(r"[^\W_]+", (text or "").lower())
+
+def score_candidate(track_name, artist_name, duration_ms, candidate):
+    """
+    Score a flat search entry from 0 to 1 against the Spotify track, or
+    return None when its duration is too far off to ever be the same song.
+    """
+    score = 0.0
+    duration = candidate.get("duration")
+    if duration_ms and duration:
+        diff = abs(duration - duration_ms / 1000)
+        if diff > MATCH_MAX_DURATION_DIFF_S:
+            return None
+        span = MATCH_MAX_DURATION_DIFF_S - MATCH_DURATION_TOLERANCE_S
+        score += MATCH_WEIGHTS["duration"] * min(1.0, 1 - (diff - MATCH_DURATION_TOLERANCE_S) / span)
+    else:
+        # Unknown on either side: neither reward nor rule out the candidate.
+        score += MATCH_WEIGHTS["duration"] / 2
+    title_words = set(match_words(candidate.get("title")))
+    channel_words = set(match_words(candidate.get("channel") or candidate.get("uploader")))
+    wanted = match_words(track_name)
+    if wanted:
+        score += MATCH_WEIGHTS["title"] * sum(word in title_words for word in wanted) / len(wanted)
+    artists = [match_words(artist) for artist in artist_name.split(",")]
+    artists = [words for words in artists if words]
+    if artists:
+        found = sum(all(word in title_words | channel_words for word in words) for words in artists)
+        score += MATCH_WEIGHTS["artists"] * found / len(artists)
+    extra = (title_words - set(wanted)) & MATCH_UNWANTED_WORDS
+    return max(0.0, score - MATCH_UNWANTED_PENALTY * len(extra))
+
+def search_candidates(track_name, artist_name, extractor=None):
+    """
+    Return the flat entries of one metadata-only YouTube search. extractor
+    is anything with yt-dlp's extract_info(); a pooled downloader is used
+    when omitted.
+    """
+    query = f"ytsearch{MATCH_CANDIDATES}:{track_name} {artist_name}"
+    if extractor is None:
+        with pooled_downloader() as downloader:
+            info = downloader.search(query)
+    else:
+        info = extractor.extract_info(query, download=False)
+    return [entry for entry in (info or {}).get("entries") or [] if entry and entry.get("id")]
+
+def pick_candidate(track_name, artist_name, duration_ms, candidates):
+    """Return (entry, score) for the best candidate; raise NoMatchError if none is good enough."""
+    best, best_score = None, -1.0
+    for candidate in candidates:
+        score = score_candidate(track_name, artist_name, duration_ms, candidate)
+        if score is not None and score > best_score:
+            best, best_score = candidate, score
+    if best is None:
+        raise NoMatchError(f"No YouTube result within {MATCH_MAX_DURATION_DIFF_S}s of the track length")
+    if best_score < MATCH_MIN_SCORE:
+        raise NoMatchError(f"No close YouTube match (best: {best.get('title')!r}, score {best_score:.2f})")
+    return best, best_score
+
+def resolve_youtube_match(track_name, artist_name, duration_ms=0, extractor=None):
+    """Search, score and return the YouTube video ID to download for the track."""
+    candidates = search_candidates(track_name, artist_name, extractor)
+    best, _ = pick_candidate(track_name, artist_name, duration_ms, candidates)
+    return best["id"]
+
+# ======= Playlist Folder Manifests =======
+# Each playlist folder keeps a small JSON manifest of the tracks it already
+# holds (file, size and hash per Spotify track ID) plus the playlist's
+# snapshot_id, so re-running a playlist only fetches what changed. Tracks
+# without a close YouTube match are recorded too, with when they were
+# searched, so they neither hold back the snapshot_id nor get searched again
+# on every sync.
+
+MANIFEST_NAME = ".spotify_manifest.json"
+MANIFEST_SAVE_EVERY = 25
+UNMATCHED_RETRY_SECONDS = 7 * 24 * 3600
+
+# Toggled from the GUI; when set, syncing a playlist deletes the files of
+# tracks that are no longer on it.
+prune_removed_tracks = False
+
+def new_manifest():
+    return {"playlist_id": None, "snapshot_id": None, "tracks": {}, "unmatched": {}}
+
+def load_manifest(folder):
+    try:
+        with open(os.path.join(folder, MANIFEST_NAME), "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return new_manifest()
+    manifest.setdefault("tracks", {})
+    manifest.setdefault("unmatched", {})
+    return manifest
+
+def save_manifest(folder, manifest):
+    path = os.path.join(folder, MANIFEST_NAME)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(tmp_path, path)
+
+def manifest_key(track):
+    # Local files in a playlist have no Spotify ID.
+    return track.id or f"local:{track.label}"
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def manifest_entry(folder, path):
+    return {
+        "file": os.path.relpath(path, folder),
+        "size": os.path.getsize(path),
+        "sha256": file_sha256(path),
+    }
+
+def manifest_entry_present(folder, entry):
+    if not entry:
+        return False
+    try:
+        return os.path.getsize(os.path.join(folder, entry["file"])) == entry["size"]
+    except OSError:
+        return False
+
+def recently_unmatched(manifest, key):
+    searched = manifest["unmatched"].get(key)
+    return searched is not None and time.time() - searched < UNMATCHED_RETRY_SECONDS
+
+def manifest_is_current(folder, manifest, playlist_id, snapshot_id):
+    if not snapshot_id or manifest.get("playlist_id") != playlist_id:
+        return False
+    if manifest.get("snapshot_id") != snapshot_id:
+        return False
+    if not all(recently_unmatched(manifest, key) for key in manifest["unmatched"]):
+        return False  # Time to search for the unmatched tracks again.
+    return all(manifest_entry_present(folder, entry) for entry in manifest["tracks"].values())
+
+def prune_manifest(folder, manifest, wanted_keys):
+    entries = manifest["tracks"]
+    removed = [key for key in entries if key not in wanted_keys]
+    kept_files = {entry["file"] for key, entry in entries.items() if key in wanted_keys}
+    for key in removed:
+        entry = entries.pop(key)
+        # Never delete files outside the folder, e.g. store files an M3U points at.
+        if entry["file"] in kept_files or entry["file"].startswith(os.pardir):
+            continue
+        try:
+            os.remove(os.path.join(folder, entry["file"]))
+        except OSError:
+            pass
+    return removed
+
+# ======= Persistent Job Queue =======
+# Conversions are recorded in SQLite as they run, with a state per track
+# (pending, resolved, downloading, transcoding, done, failed, unmatched). A job still
+# marked running at startup was interrupted, and can be resumed from its
+# unfinished tracks instead of starting over.
+
+JOBS_DB_PATH = os.path.join(APP_DATA_DIR, "jobs.sqlite3")
+TRACK_STATES = ("pending", "resolved", "downloading", "transcoding", "done", "failed", "unmatched")
+
+class JobQueue:
+    def __init__(self, path):
+        self._lock = threading.Lock()
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._conn:
+            if path != ":memory:":
+                self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+                " name TEXT NOT NULL,"
+                " folder TEXT NOT NULL,"
+                " source_id TEXT,"
+                " snapshot_id TEXT,"
+                " state TEXT NOT NULL,"
+                " created_at REAL NOT NULL,"
+                " updated_at REAL NOT NULL)"
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS job_tracks ("
+                " job_id INTEGER NOT NULL,"
+                " track_key TEXT NOT NULL,"
+                " position INTEGER NOT NULL,"
+                " track TEXT NOT NULL,"
+                " state TEXT NOT NULL,"
+                " detail TEXT,"
+                " updated_at REAL NOT NULL,"
+                " PRIMARY KEY (job_id, track_key))"
+            )
+
+    def create_job(self, name, folder, source_id, snapshot_id=None):
+        now = time.time()
+        with self._lock, self._conn:
+            cursor = self._conn.execute(
+                "INSERT INTO jobs (name, folder, source_id, snapshot_id, state, created_at, updated_at)"
+                " VALUES (?, ?, ?, ?, 'running', ?, ?)",
+                (name, folder, source_id, snapshot_id, now, now),
+            )
+            return cursor.lastrowid
+
+    def add_track(self, job_id, track_key, position, track):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR IGNORE INTO job_tracks VALUES (?, ?, ?, ?, 'pending', NULL, ?)",
+                (job_id, track_key, position, json.dumps(track.to_list()), time.time()),
+            )
+
+    def add_tracks(self, job_id, tracks):
+        """Queue (track_key, track) pairs in one transaction, positioned in the given order."""
+        now = time.time()
+        rows = [
+            (job_id, key, position, json.dumps(track.to_list()), now)
+            for position, (key, track) in enumerate(tracks, 1)
+        ]
+        with self._lock, self._conn:
+            self._conn.executemany("INSERT OR IGNORE INTO job_tracks VALUES (?, ?, ?, ?, 'pending', NULL, ?)", rows)
+
+    def set_track_state(self, job_id, track_key, state, detail=None):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "UPDATE job_tracks SET state = ?, detail = ?, updated_at = ? WHERE job_id = ? AND track_key = ?",
+                (state, detail, time.time(), job_id, track_key),
+            )
+
+    def finish_job(self, job_id, state="done"):
+        """Close a job. Finished jobs are removed; cancelled or failed ones are kept for reference."""
+        with self._lock, self._conn:
+            if state == "done":
+                self._conn.execute("DELETE FROM job_tracks WHERE job_id = ?", (job_id,))
+                self._conn.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+            else:
+                self._conn.execute(
+                    "UPDATE jobs SET state = ?, updated_at = ? WHERE id = ?", (state, time.time(), job_id)
+                )
+
+    def interrupted_jobs(self):
+        """Return (id, name, folder, source_id, unfinished_count) for jobs left running."""
+        with self._lock:
+            return self._conn.execute(
+                "SELECT j.id, j.name, j.folder, j.source_id,"
+                " (SELECT COUNT(*) FROM job_tracks t WHERE t.job_id = j.id AND t.state != 'done')"
+                " FROM jobs j WHERE j.state = 'running' ORDER BY j.id"
+            ).fetchall()
+
+    def unfinished_tracks(self, job_id):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT track FROM job_tracks WHERE job_id = ? AND state != 'done' ORDER BY position", (job_id,)
+            ).fetchall()
+        return [Track.from_list(json.loads(row)) for (row,) in rows]
+
+_job_queue = None
+_job_queue_lock = threading.Lock()
+
+def get_job_queue():
+    global _job_queue
+    with _job_queue_lock:
+        if _job_queue is None:
+            _job_queue = JobQueue(JOBS_DB_PATH)
+        return _job_queue
+
+def list_job_source(source_id):
+    """
+    List a job's tracks again from its source_id. Returns None for sources
+    that can't be listed again (the singles folder, or liked songs without
+    a login), whose tracks were all queued when the job started.
+    """
+    kind, _, spotify_id = source_id.partition(":")
+    if kind == "album":
+        _, albums = fetch_singles_and_albums([], [spotify_id], report_failures=False)
+        return [track for _, _, tracks in albums for track in tracks]
+    if kind == "library":
+        client, include_saved = library_client(spotify_id)
+        _, plan = build_library_plan(client, spotify_id, include_saved)
+        return list(plan.values())
+    if kind == "liked":
+        client = playlist_client(spotify_id)
+        return fetch_saved_tracks(client) if client else None
+    if not spotify_id and kind != "singles":
+        playlist, client = load_playlist(source_id)
+        return iter_playlist_tracks(client, playlist.id)
+    return None
+
+def resume_job(job_id, name, folder, source_id):
+    """
+    Continue an interrupted job. The source is listed again so tracks that
+    were never queued are not lost; the manifest and the track store skip
+    those already converted. The job stays interrupted if listing fails.
+    """
+    set_status(f"Resuming: {name}")
+    try:
+        tracks = list_job_source(source_id)
+    except Exception as e:
+        show_error("Error", f"Could not list {name} again to resume it: {e}")
+        return None
+    return sync_folder(name, folder, tracks, source_id, resume_job_id=job_id)
+
+def discard_interrupted_jobs(jobs):
+    queue_db = get_job_queue()
+    for job_id, *_ in jobs:
+        queue_db.finish_job(job_id, "cancelled")
+
+# ======= Cover Art Cache =======
+# Album art is downloaded once per album into the app data folder and then
+# embedded in every track of that album during the transcode pass.
+
+COVER_CACHE_DIR = os.path.join(APP_DATA_DIR, "covers")
+COVER_FETCH_TIMEOUT = 15  # seconds
+
+# One lock per album, so tracks of the same album wait for a single download.
+_cover_locks = {}
+_cover_locks_lock = threading.Lock()
+
+def get_cover_art(track):
+    """Return the cached cover image for the track's album, fetching it first; None if there is none."""
+    if not track.album_id or not track.cover_url:
+        return None
+    path = os.path.join(COVER_CACHE_DIR, sanitize_filename(track.album_id) + ".jpg")
+    if os.path.isfile(path):
+        return path
+    with _cover_locks_lock:
+        lock = _cover_locks.setdefault(track.album_id, threading.Lock())
+    with lock:
+        if os.path.isfile(path):
+            return path
+        import urllib.request
+        try:
+            with urllib.request.urlopen(track.cover_url, timeout=COVER_FETCH_TIMEOUT) as response:
+                data = response.read()
+            os.makedirs(COVER_CACHE_DIR, exist_ok=True)
+            with open(path + ".tmp", "wb") as f:
+                f.write(data)
+            os.replace(path + ".tmp", path)
+        except (OSError, ValueError):
+            # Missing art is not worth failing the track over.
+            return None
+    return path
+
+# ======= Download (Conversion) Functions =======
+# A track is converted in two stages. Worker threads search for it and
+# download the source audio into a private temp directory, then ffmpeg
+# encodes (or remuxes) it in a process pool sized to the CPU count. The
+# stages are joined by bounded queues in DownloadJob.run, so downloads keep
+# the network busy while earlier tracks are being encoded.
+
+OUTPUT_ROOT = os.path.join(os.path.expanduser("~"), "Desktop", "SpotifyMP3s")
+SINGLES_FOLDER_NAME = "SpotifySingles"
+SINGLES_FOLDER = os.path.join(OUTPUT_ROOT, SINGLES_FOLDER_NAME)
+PARTIAL_DIR_NAME = ".partial"
+DOWNLOAD_WORKERS = max(2, os.cpu_count() or 2)
+TRANSCODE_WORKERS = os.cpu_count() or 1
+# Transcodes run at once, up to TRANSCODE_WORKERS; lower it to spare the output disk.
+TRANSCODE_SLOTS = TRANSCODE_WORKERS
+# Downloaded tracks a job lets wait for, or sit in, the transcode pool.
+TRANSCODE_QUEUE_SIZE = TRANSCODE_WORKERS * 2
+FFMPEG_PATH = os.environ.get("FFMPEG_PATH") or shutil.which("ffmpeg") or "ffmpeg"
+
+# codec: (file extension, ffmpeg encoder)
+AUDIO_CODECS = {
+    "mp3": ("mp3", "libmp3lame"),
+    "aac": ("m4a", "aac"),
+    "opus": ("opus", "libopus"),
+}
+# Source codecs (as yt-dlp reports them) that passthrough copies as-is.
+PASSTHROUGH_CODECS = {"mp4a": "m4a", "opus": "opus"}
+
+class AudioFormat:
+    """
+    How a job's tracks are encoded: codec, bitrate in kbit/s, and whether
+    m4a/opus sources are remuxed without re-encoding instead.
+    """
+    __slots__ = ("codec", "bitrate", "passthrough")
+
+    def __init__(self, codec="mp3", bitrate=192, passthrough=False):
+        if codec not in AUDIO_CODECS:
+            raise ValueError(f"Unsupported codec: {codec}")
+        self.codec = codec
+        self.bitrate = bitrate
+        self.passthrough = passthrough
+
+    @property
+    def extensions(self):
+        """File extensions a track in this format can end up with, preferred first."""
+        encoded = AUDIO_CODECS[self.codec][0]
+        if not self.passthrough:
+            return (encoded,)
+        return tuple(dict.fromkeys([*PASSTHROUGH_CODECS.values(), encoded]))
+
+    @property
+    def download_format(self):
+        if self.passthrough:
+            return "bestaudio[acodec^=mp4a]/bestaudio[acodec=opus]/bestaudio/best"
+        return "bestaudio/best"
+
+    @property
+    def name(self):
+        """Identifies the format, e.g. "mp3-192k" or "aac-256k-copy"."""
+        return f"{self.codec}-{self.bitrate}k" + ("-copy" if self.passthrough else "")
+
+    @property
+    def store_variants(self):
+        """(variant, extension) pairs of track store files this format accepts, preferred first."""
+        encoded = (f"{self.bitrate}k", AUDIO_CODECS[self.codec][0])
+        if not self.passthrough:
+            return (encoded,)
+        return (*(("copy", extension) for extension in dict.fromkeys(PASSTHROUGH_CODECS.values())), encoded)
+
+    def plan(self, source_codec):
+        """
+        Return (extension, ffmpeg audio arguments, store variant) for a
+        source encoded with source_codec. The variant is "copy" for remuxed
+        sources, else the bitrate, e.g. "192k".
+        """
+        base_codec = (source_codec or "").split(".")[0]
+        if self.passthrough and base_codec in PASSTHROUGH_CODECS:
+            return PASSTHROUGH_CODECS[base_codec], ["-c:a", "copy"], "copy"
+        extension, encoder = AUDIO_CODECS[self.codec]
+        return extension, ["-c:a", encoder, "-b:a", f"{self.bitrate}k"], f"{self.bitrate}k"
+
+    def __repr__(self):
+        return f"AudioFormat({self.codec!r}, {self.bitrate!r}, passthrough={self.passthrough!r})"
+
+# Used by jobs that are not given a format; the command line can change it.
+DEFAULT_AUDIO_FORMAT = AudioFormat()
+
+# Jobs currently running, so they can be cancelled from the GUI.
+active_jobs = set()
+
+def track_base_name(track_name, artist_name):
+    return sanitize_filename(f"{track_name} - {artist_name}")
+
+def worker_id():
+    """Name this process among the workers sharing a track store or spool."""
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+def last_write(path):
+    """Newest modification time of the directory at path or anything directly in it."""
+    try:
+        with os.scandir(path) as entries:
+            return max([os.stat(path).st_mtime] + [entry.stat().st_mtime for entry in entries])
+    except OSError:
+        # Vanished or unreadable: whoever owns it is still busy with it.
+        return time.time()
+
+# Temp directories are named after the process that owns them, which
+# touches PARTIAL_DIR_NAME/<worker id>.alive while it runs. Cleanup only
+# takes directories whose owner stopped doing so a lease ago, so a source
+# waiting behind a paused job or the write budget is left alone however old.
+PARTIAL_HEARTBEAT_SUFFIX = ".alive"
+PARTIAL_HEARTBEAT_SECONDS = 30
+_partial_heartbeat = None
+_partial_heartbeat_lock = threading.Lock()
+
+def touch_partial_heartbeat():
+    partial_root = os.path.join(STORE_FOLDER, PARTIAL_DIR_NAME)
+    os.makedirs(partial_root, exist_ok=True)
+    path = os.path.join(partial_root, worker_id() + PARTIAL_HEARTBEAT_SUFFIX)
+    with open(path, "a"):
+        pass
+    os.utime(path)
+
+def start_partial_heartbeat():
+    """Mark this process's temp directories as in use, now and every PARTIAL_HEARTBEAT_SECONDS from then on."""
+    global _partial_heartbeat
+    touch_partial_heartbeat()
+    with _partial_heartbeat_lock:
+        if _partial_heartbeat is not None:
+            return
+
+        def beat():
+            while True:
+                time.sleep(PARTIAL_HEARTBEAT_SECONDS)
+                try:
+                    touch_partial_heartbeat()
+                except OSError as e:
+                    set_status(f"Could not mark temp downloads as in use: {e}")
+
+        _partial_heartbeat = threading.Thread(target=beat, name="partial-heartbeat", daemon=True)
+        _partial_heartbeat.start()
+
+def cleanup_partial_downloads(folder):
+    """
+    Remove temp directories left behind by processes that stopped without
+    finishing their downloads: those whose heartbeat is SPOOL_LEASE_SECONDS
+    old, or, without one, that nothing has written to for as long. Running
+    processes sharing the store keep theirs.
+    """
+    partial_root = os.path.join(folder, PARTIAL_DIR_NAME)
+    try:
+        with os.scandir(partial_root) as entries:
+            names = [entry.name for entry in entries]
+    except OSError:
+        return
+    cutoff = time.time() - SPOOL_LEASE_SECONDS
+    heartbeats = {}
+    for name in names:
+        if name.endswith(PARTIAL_HEARTBEAT_SUFFIX):
+            with contextlib.suppress(OSError):
+                heartbeats[name[:-len(PARTIAL_HEARTBEAT_SUFFIX)]] = os.stat(os.path.join(partial_root, name)).st_mtime
+    for name in names:
+        path = os.path.join(partial_root, name)
+        if name.endswith(PARTIAL_HEARTBEAT_SUFFIX):
+            if heartbeats.get(name[:-len(PARTIAL_HEARTBEAT_SUFFIX)], cutoff) < cutoff:
+                with contextlib.suppress(OSError):
+                    os.remove(path)
+            continue
+        # mkdtemp's random suffix never contains "-".
+        owner = name.rpartition("-")[0]
+        if owner in heartbeats:
+            stale = heartbeats[owner] < cutoff
+        else:
+            stale = last_write(path) < cutoff
+        if stale:
+            shutil.rmtree(path, ignore_errors=True)
+
+def download_source(track, work_dir, audio, on_state=None):
+    """
+    Find the track on YouTube and download its audio, as-is, into work_dir.
+    Returns (path, info). Safe to call from worker threads: it never touches
+    the GUI or the working directory.
+
+    on_state(state) is called as the track becomes "resolved" and starts
+    "downloading". Uncached tracks are matched with resolve_youtube_match
+    first, which raises NoMatchError before anything is downloaded if no
+    candidate is close enough.
+    """
+    notify = on_state or (lambda state: None)
+    cache = get_resolution_cache()
+    cached = cache.get(track.id, track.name, track.artists)
+    if cached:
+        video_id, format_id = cached
+        download_format = f"{format_id}/{audio.download_format}" if format_id else audio.download_format
+        metrics.count("resolution_cache_hits")
+    else:
+        with metrics.time("resolve"):
+            video_id = resolve_youtube_match(track.name, track.artists, track.duration_ms)
+        download_format = audio.download_format
+    notify("resolved")
+    started = False
+
+    def progress_hook(d):
+        nonlocal started
+        if not started and d.get("status") == "downloading":
+            started = True
+            notify("downloading")
+
+    try:
+        with metrics.time("download"), pooled_downloader() as downloader:
+            info = downloader.download(
+                f"https://www.youtube.com/watch?v={video_id}", download_format,
+                os.path.join(work_dir, "source.%(ext)s"), progress_hook,
+            )
+    except Exception:
+        if cached:
+            # The video may have been taken down; search again next time.
+            cache.invalidate(track.id, track.name, track.artists)
+        raise
+    if not cached:
+        cache.put(track.id, track.name, track.artists, video_id, info.get("format_id"))
+    download = (info.get("requested_downloads") or [info])[0]
+    path = download.get("filepath") or download.get("_filename")
+    if not path or not os.path.isfile(path):
+        raise RuntimeError("yt-dlp did not produce a file")
+    return path, info
+
+def metadata_arguments(track, extension):
+    """ffmpeg -metadata options for the track's Spotify data."""
+    tags = {"title": track.name, "artist": track.artists, "album": track.album}
+    if track.track_number:
+        tags["track"] = str(track.track_number)
+    # ID3 has a dedicated ISRC frame; the other containers take free-form keys.
+    tags["TSRC" if extension == "mp3" else "ISRC"] = track.isrc
+    tags["SPOTIFY_ID"] = track.id
+    arguments = []
+    for key, value in tags.items():
+        if value:
+            arguments += ["-metadata", f"{key}={value}"]
+    return arguments
+
+def ffmpeg_command(source, output, audio_args, track=None, cover=None):
+    """
+    Build the single ffmpeg pass that encodes source into output, tagged
+    with the track's metadata and, for MP3 and M4A, its album art. Tags from
+    the YouTube source are dropped.
+    """
+    extension = os.path.splitext(output)[1][1:]
+    command = [FFMPEG_PATH, "-nostdin", "-hide_banner", "-loglevel", "error", "-y", "-i", source]
+    # Ogg (opus) files have no attached-picture stream, so they go without.
+    if cover and extension in ("mp3", "m4a"):
+        command += ["-i", cover, "-map", "0:a:0", "-map", "1:v:0", "-c:v", "copy", "-disposition:v:0", "attached_pic"]
+        if extension == "mp3":
+            command += ["-metadata:s:v", "title=Album cover", "-metadata:s:v", "comment=Cover (front)"]
+    else:
+        command += ["-vn"]
+    command += audio_args
+    if track is not None:
+        command += ["-map_metadata", "-1", *metadata_arguments(track, extension)]
+    if extension == "mp3":
+        command += ["-id3v2_version", "3"]
+    elif extension == "m4a":
+        # Keep ISRC and SPOTIFY_ID, which are not standard MP4 tags.
+        command += ["-movflags", "+use_metadata_tags"]
+    command.append(output)
+    return command
+
+def run_ffmpeg(command):
+    """
+    Run one ffmpeg command and return how long it took. Executed in the
+    transcode pool's worker processes, so the caller records the timing.
+    """
+    started = time.perf_counter()
+    result = subprocess.run(command, stdin=subprocess.DEVNULL, capture_output=True, text=True, errors="replace")
+    if result.returncode != 0:
+        raise RuntimeError(f"ffmpeg failed: {result.stderr.strip()[-500:] or result.returncode}")
+    return time.perf_counter() - started
+
+_transcode_pool = None
+_transcode_pool_lock = threading.Lock()
+
+def get_transcode_pool():
+    global _transcode_pool
+    with _transcode_pool_lock:
+        if _transcode_pool is None:
+            # Spawned, not forked: the pool is started from a scheduler thread
+            # while other threads hold locks and read stdin.
+            _transcode_pool = ProcessPoolExecutor(max_workers=TRANSCODE_WORKERS,
+                                                  mp_context=multiprocessing.get_context("spawn"))
+        return _transcode_pool
+
+def close_transcode_pool(wait=False):
+    global _transcode_pool
+    with _transcode_pool_lock:
+        pool, _transcode_pool = _transcode_pool, None
+    if pool is not None:
+        pool.shutdown(wait=wait, cancel_futures=True)
+
+def discard_transcode_pool(pool):
+    """Drop a pool that lost a process, so the next transcode starts a fresh one."""
+    global _transcode_pool
+    with _transcode_pool_lock:
+        if _transcode_pool is pool:
+            _transcode_pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+# ======= Track Store =======
+# Every converted track is kept once in a content store under OUTPUT_ROOT,
+# named by its Spotify ID (ISRC, or a hash of "name - artists", for tracks
+# without one) plus how it was encoded: KEY.192k.mp3, or KEY.copy.m4a for a
+# remuxed source. Playlist folders only get links to the stored file, so a
+# song on five playlists is searched, downloaded and encoded once per format.
+
+STORE_FOLDER_NAME = ".track_store"
+STORE_FOLDER = os.path.join(OUTPUT_ROOT, STORE_FOLDER_NAME)
+# "hardlink", "symlink", "copy", or "m3u" to leave playlist folders with just
+# an .m3u8 playlist that points into the store. Links fall back to a copy when
+# the filesystem does not support them.
+LINK_MODE = "hardlink"
+WRITE_M3U = True
+
+# Store keys being fetched right now, so two jobs never fetch the same track
+# at once. A claim lasts from the download until the transcoded file is in
+# the store, which may span several threads.
+_store_fetches = {}
+_store_fetches_lock = threading.Lock()
+
+def set_output_root(path):
+    """Send all output (playlist folders, singles and the track store) under path."""
+    global OUTPUT_ROOT, SINGLES_FOLDER, STORE_FOLDER
+    OUTPUT_ROOT = os.path.abspath(os.path.expanduser(path))
+    SINGLES_FOLDER = os.path.join(OUTPUT_ROOT, SINGLES_FOLDER_NAME)
+    STORE_FOLDER = os.path.join(OUTPUT_ROOT, STORE_FOLDER_NAME)
+
+def store_key(track):
+    if track.id:
+        return track.id
+    if track.isrc:
+        return f"isrc-{track.isrc}"
+    return "name-" + hashlib.sha1(track.label.lower().encode("utf-8")).hexdigest()[:20]
+
+def store_path(key, variant, extension):
+    return os.path.join(STORE_FOLDER, f"{key}.{variant}.{extension}")
+
+def find_in_store(track, audio):
+    """Return the stored file for the track in one of audio's formats, or None."""
+    key = store_key(track)
+    for variant, extension in audio.store_variants:
+        path = store_path(key, variant, extension)
+        if os.path.isfile(path):
+            return path
+    return None
+
+# How often a download waiting on another job's fetch of the same track
+# checks whether its own job was cancelled.
+STORE_CLAIM_POLL_SECONDS = 0.5
+
+def claim_store_key(key):
+    """Claim key for fetching: returns None, or an Event set when the fetch already under way ends."""
+    with _store_fetches_lock:
+        pending = _store_fetches.get(key)
+        if pending is None:
+            _store_fetches[key] = threading.Event()
+        return pending
+
+def release_store_key(key):
+    with _store_fetches_lock:
+        pending = _store_fetches.pop(key, None)
+    if pending is not None:
+        pending.set()
+
+class TranscodeTask:
+    """A downloaded track waiting for ffmpeg. Holds the claim on its store key until finished or discarded."""
+    __slots__ = ("track", "key", "work_dir", "command", "output", "stored")
+
+    def __init__(self, track, key, work_dir, command, output, stored):
+        self.track = track
+        self.key = key
+        self.work_dir = work_dir
+        self.command = command
+        self.output = output
+        self.stored = stored
+
+    def finish(self):
+        """Move the transcoded file into the store and return its path."""
+        try:
+            with metrics.time("write"):
+                os.replace(self.output, self.stored)
+        finally:
+            self.discard()
+        return self.stored
+
+    def discard(self):
+        shutil.rmtree(self.work_dir, ignore_errors=True)
+        release_store_key(self.key)
+
+def start_store_fetch(track, audio, on_state=None, cancel_event=None):
+    """
+    Download stage for one track. Returns the stored file when the track is
+    already in the store (or another job has just fetched it), otherwise a
+    TranscodeTask for the downloaded source. Returns None if cancel_event is
+    set while waiting for another job's fetch of the same track.
+    """
+    key = store_key(track)
+    while True:
+        stored = find_in_store(track, audio)
+        if stored:
+            return stored
+        pending = claim_store_key(key)
+        if pending is None:
+            break
+        while not pending.wait(STORE_CLAIM_POLL_SECONDS):
+            if cancel_event is not None and cancel_event.is_set():
+                return None
+    try:
+        # It may have been stored between the check and the claim.
+        stored = find_in_store(track, audio)
+        if stored:
+            release_store_key(key)
+            return stored
+        start_partial_heartbeat()
+        work_dir = tempfile.mkdtemp(prefix=f"{worker_id()}-", dir=os.path.join(STORE_FOLDER, PARTIAL_DIR_NAME))
+    except BaseException:
+        release_store_key(key)
+        raise
+    try:
+        source, info = download_source(track, work_dir, audio, on_state)
+        extension, audio_args, variant = audio.plan(info.get("acodec"))
+        output = os.path.join(work_dir, f"{key}.{extension}")
+        command = ffmpeg_command(source, output, audio_args, track, get_cover_art(track))
+        return TranscodeTask(track, key, work_dir, command, output, store_path(key, variant, extension))
+    except BaseException:
+        shutil.rmtree(work_dir, ignore_errors=True)
+        release_store_key(key)
+        raise
+
+def place_track(stored, dest):
+    """Make stored available at dest using LINK_MODE; returns the path to record."""
+    if LINK_MODE == "m3u":
+        return stored
+    if os.path.lexists(dest):
+        if os.path.isfile(dest) and os.path.samefile(stored, dest):
+            return dest
+        os.remove(dest)
+    if LINK_MODE in ("hardlink", "symlink"):
+        try:
+            if LINK_MODE == "hardlink":
+                os.link(stored, dest)
+            else:
+                os.symlink(os.path.relpath(stored, os.path.dirname(dest)), dest)
+            return dest
+        except OSError:
+            pass
+    shutil.copyfile(stored, dest + ".tmp")
+    os.replace(dest + ".tmp", dest)
+    write_budget.consume(os.path.getsize(dest))
+    return dest
+
+def place_in_folder(track, stored, folder):
+    extension = os.path.splitext(stored)[1]
+    with metrics.time("write"):
+        return place_track(stored, os.path.join(folder, track_base_name(track.name, track.artists) + extension))
+
+def write_m3u(folder, name, tracks, entries):
+    """Write name.m3u8 listing the tracks (in order) that the manifest has files for."""
+    lines = ["#EXTM3U"]
+    for key, track in tracks.items():
+        entry = entries.get(key)
+        if not entry:
+            continue
+        lines.append(f"#EXTINF:{track.duration_ms // 1000},{track.artists} - {track.name}")
+        lines.append(entry["file"].replace(os.sep, "/"))
+    path = os.path.join(folder, sanitize_filename(name) + ".m3u8")
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        f.write("\n".join(lines) + "\n")
+    os.replace(path + ".tmp", path)
+
+# ======= Job Scheduling =======
+# Download and transcode slots are shared by every running job. Each job
+# queues its work with the schedulers below; a free slot takes work from the
+# highest-priority job that isn't paused, rotating between jobs of the same
+# priority so one large playlist can't starve the others. A single track
+# picked in the GUI therefore starts as soon as a slot frees up instead of
+# waiting behind a bulk import. Work that has started is never interrupted.
+# Pausing only holds back downloads: a downloaded track keeps the claim on
+# its store key until transcoded, and another job may be waiting for it.
+
+PRIORITY_HIGH, PRIORITY_NORMAL, PRIORITY_LOW = range(3)
+PRIORITY_NAMES = ("high", "normal", "low")
+
+class JobScheduler:
+    """
+    Runs fn(*args) calls queued per job on up to workers threads at once.
+    With holds_paused false, paused jobs are served like any other.
+    """
+
+    def __init__(self, workers, name, holds_paused=True):
+        self.workers = workers
+        self.name = name
+        self.holds_paused = holds_paused
+        self._cond = threading.Condition()
+        # job -> deque of (future, fn, args); jobs are dropped once drained.
+        self._pending = {}
+        # Jobs in round-robin order: the one served last goes to the back.
+        self._order = collections.deque()
+        self._threads = []
+
+    def _start_threads(self):
+        while len(self._threads) < self.workers:
+            thread = threading.Thread(target=self._work, name=f"{self.name}-{len(self._threads)}", daemon=True)
+            self._threads.append(thread)
+            thread.start()
+
+    def set_workers(self, workers):
+        """Change how many calls run at once; surplus threads exit once their current call returns."""
+        with self._cond:
+            self.workers = max(1, workers)
+            if self._pending:
+                self._start_threads()
+            self._cond.notify_all()
+
+    def submit(self, job, fn, *args):
+        future = Future()
+        with self._cond:
+            self._start_threads()
+            if job not in self._pending:
+                self._pending[job] = collections.deque()
+                self._order.append(job)
+            self._pending[job].append((future, fn, args))
+            self._cond.notify()
+        return future
+
+    def queued(self, job):
+        with self._cond:
+            return len(self._pending.get(job, ()))
+
+    def wake(self):
+        """Re-check waiting work after a job was resumed or reprioritized."""
+        with self._cond:
+            self._cond.notify_all()
+
+    def drop(self, job):
+        """Cancel the job's queued work; calls already running carry on."""
+        with self._cond:
+            pending = self._pending.pop(job, ())
+            if pending:
+                self._order.remove(job)
+        for future, _, _ in pending:
+            # No worker will see these again, so waiters are told here.
+            if future.cancel():
+                future.set_running_or_notify_cancel()
+
+    def _next(self):
+        best = None
+        for job in self._order:
+            if not (self.holds_paused and job.paused) and (best is None or job.priority < best.priority):
+                best = job
+        if best is None:
+            return None
+        pending = self._pending[best]
+        item = pending.popleft()
+        self._order.remove(best)
+        if pending:
+            self._order.append(best)
+        else:
+            del self._pending[best]
+        return item
+
+    def _work(self):
+        thread = threading.current_thread()
+        while True:
+            with self._cond:
+                item = None
+                while item is None:
+                    if len(self._threads) > self.workers:
+                        self._threads.remove(thread)
+                        return
+                    item = self._next()
+                    if item is None:
+                        self._cond.wait()
+            future, fn, args = item
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                result = fn(*args)
+            except BaseException as e:
+                future.set_exception(e)
+            else:
+                future.set_result(result)
+
+_download_scheduler = None
+_transcode_scheduler = None
+_scheduler_lock = threading.Lock()
+
+def get_download_scheduler():
+    global _download_scheduler
+    with _scheduler_lock:
+        if _download_scheduler is None:
+            _download_scheduler = JobScheduler(DOWNLOAD_WORKERS, "download")
+        return _download_scheduler
+
+def get_transcode_scheduler():
+    # One thread per transcode process, each waiting on its ffmpeg run, so
+    # the process pool itself never holds a backlog the scheduler can't reorder.
+    global _transcode_scheduler
+    with _scheduler_lock:
+        if _transcode_scheduler is None:
+            _transcode_scheduler = JobScheduler(TRANSCODE_SLOTS, "transcode", holds_paused=False)
+        return _transcode_scheduler
+
+def transcode(command, output):
+    """Run ffmpeg in the transcode pool, then hold the slot until write_budget covers the output."""
+    pool = get_transcode_pool()
+    try:
+        seconds = pool.submit(run_ffmpeg, command).result()
+    except BrokenProcessPool:
+        # A transcode process was killed (out of memory, say); only the
+        # tracks it had in flight fail, later ones get a new pool.
+        discard_transcode_pool(pool)
+        raise
+    with contextlib.suppress(OSError):
+        write_budget.consume(os.path.getsize(output))
+    return seconds
+
+def set_io_limits(download_rate=None, write_rate=None, downloads=None, transcodes=None):
+    """
+    Change the global I/O budget; arguments left as None keep their value.
+    Rates are bytes per second (0 for unlimited), downloads and transcodes
+    how many downloads and transcodes may run at once. Takes effect for
+    running jobs too.
+    """
+    global DOWNLOAD_WORKERS, TRANSCODE_SLOTS
+    if download_rate is not None:
+        download_budget.set_rate(download_rate)
+    if write_rate is not None:
+        write_budget.set_rate(write_rate)
+    if downloads is not None:
+        DOWNLOAD_WORKERS = max(1, downloads)
+        if _download_scheduler is not None:
+            _download_scheduler.set_workers(DOWNLOAD_WORKERS)
+    if transcodes is not None:
+        TRANSCODE_SLOTS = min(max(1, transcodes), TRANSCODE_WORKERS)
+        if _transcode_scheduler is not None:
+            _transcode_scheduler.set_workers(TRANSCODE_SLOTS)
+
+def format_io_limits():
+    return (
+        f"download {format_rate(download_budget.rate)}, write {format_rate(write_budget.rate)}, "
+        f"{DOWNLOAD_WORKERS} download(s) and {TRANSCODE_SLOTS} transcode(s) at once"
+    )
+
+def wake_schedulers():
+    for scheduler in (_download_scheduler, _transcode_scheduler):
+        if scheduler is not None:
+            scheduler.wake()
+
+def queued_jobs():
+    """Running jobs in the order the schedulers favour them."""
+    return sorted(active_jobs, key=lambda job: (job.priority, job.id))
+
+def find_job(job_id):
+    return next((job for job in list(active_jobs) if job.id == job_id), None)
+
+def job_state(job):
+    if job.cancelled:
+        return "cancelling"
+    return "paused" if job.paused else "running"
+
+def format_queue():
+    jobs = queued_jobs()
+    if not jobs:
+        return "No downloads running."
+    lines = []
+    for job in jobs:
+        done = job.completed + job.failed
+        queued = get_download_scheduler().queued(job)
+        lines.append(
+            f"#{job.id} [{PRIORITY_NAMES[job.priority]}] {job_state(job)}: {job.name} "
+            f"({done}/{done + job.remaining} done, {queued} queued)"
+        )
+    return "\n".join(lines)
+
+QUEUE_COMMANDS = (
+    "queue | pause ID | resume ID | priority ID high|normal|low | cancel ID"
+    " | limit [download|write RATE | downloads|transcodes N]"
+)
+LIMIT_SETTINGS = {
+    "download": ("download_rate", parse_rate),
+    "write": ("write_rate", parse_rate),
+    "downloads": ("downloads", int),
+    "transcodes": ("transcodes", int),
+}
+
+def limit_command(args):
+    """Show or change one setting of the I/O budget, as in "limit download 2M"."""
+    if args:
+        if len(args) != 2 or args[0] not in LIMIT_SETTINGS:
+            return f"Commands: {QUEUE_COMMANDS}"
+        name, parse = LIMIT_SETTINGS[args[0]]
+        try:
+            set_io_limits(**{name: parse(args[1])})
+        except ValueError as e:
+            return str(e)
+    return f"Limits: {format_io_limits()}"
+
+def queue_command(line):
+    """Apply one queue command typed on the command line and return the reply."""
+    words = line.split()
+    if not words:
+        return None
+    command, args = words[0].lower(), words[1:]
+    if command in ("queue", "q"):
+        return format_queue()
+    if command == "limit":
+        return limit_command([arg.lower() for arg in args])
+    if command not in ("pause", "resume", "priority", "cancel") or not args or not args[0].lstrip("#").isdigit():
+        return f"Commands: {QUEUE_COMMANDS}"
+    job = find_job(int(args[0].lstrip("#")))
+    if job is None:
+        return f"No running job #{args[0].lstrip('#')}"
+    if command == "pause":
+        job.pause()
+    elif command == "resume":
+        job.resume()
+    elif command == "cancel":
+        job.cancel()
+    elif len(args) > 1 and args[1].lower() in PRIORITY_NAMES:
+        job.set_priority(PRIORITY_NAMES.index(args[1].lower()))
+    else:
+        return f"Commands: {QUEUE_COMMANDS}"
+    return f"#{job.id} [{PRIORITY_NAMES[job.priority]}] {job_state(job)}: {job.name}"
+
+def read_queue_commands(stream):
+    """Answer queue commands read line by line from stream (stdin for --control)."""
+    for line in stream:
+        reply = queue_command(line)
+        if reply:
+            set_status(reply)
+
+# Numbers running jobs for the queue view and queue commands.
+_job_ids = itertools.count(1)
+
+class DownloadJob:
+    """
+    Track records converted by a two-stage pipeline: the shared download
+    workers fetch them and the shared transcode pool encodes them, both
+    taking work from jobs in priority order. tracks may be a generator: it
+    is consumed lazily, with at most a couple of tracks per worker queued at
+    any time, so downloads start as soon as the first item arrives. Progress
+    is reported back on the thread that called run(). With target_folder
+    None tracks are only fetched into the track store.
+    """
+
+    def __init__(self, name, target_folder, tracks, on_state=None, audio=None, expected_total=None,
+                 priority=PRIORITY_NORMAL):
+        self.id = next(_job_ids)
+        self.name = name
+        self.target_folder = target_folder
+        self.tracks = tracks
+        # How many tracks the source has, when known up front, and how many of
+        # those were skipped before reaching the job; both only feed the ETA.
+        self.expected_total = expected_total
+        self.skipped = 0
+        # on_state(track, state, detail) is called as each track moves
+        # through resolved/downloading/transcoding/done/failed, or ends up
+        # unmatched when no YouTube result is close enough.
+        self.on_state = on_state
+        self.audio = audio or DEFAULT_AUDIO_FORMAT
+        self.total = 0
+        self.completed = 0
+        # Failed tracks, including those left unmatched.
+        self.failed = 0
+        self.unmatched = 0
+        self.cancel_event = threading.Event()
+        self.priority = priority
+        self.paused = False
+
+    @property
+    def cancelled(self):
+        return self.cancel_event.is_set()
+
+    @property
+    def remaining(self):
+        """Tracks still to convert: the expected total when known, else those queued so far."""
+        total = max(self.total, (self.expected_total or 0) - self.skipped)
+        return max(0, total - self.completed - self.failed)
+
+    def cancel(self):
+        self.cancel_event.set()
+        for scheduler in (get_download_scheduler(), get_transcode_scheduler()):
+            scheduler.drop(self)
+
+    def pause(self):
+        """Hold back the job's queued downloads; tracks already downloaded are still transcoded."""
+        self.paused = True
+
+    def resume(self):
+        self.paused = False
+        wake_schedulers()
+
+    def set_priority(self, priority):
+        self.priority = priority
+        wake_schedulers()
+
+    def _set_state(self, track, state, detail=None):
+        if self.on_state:
+            self.on_state(track, state, detail)
+
+    def _download(self, track):
+        if self.cancelled:
+            return None
+        return start_store_fetch(track, self.audio, lambda state: self._set_state(track, state), self.cancel_event)
+
+    def _finished(self, track, on_progress, on_result, stored=None, error=None):
+        """Place a stored track in the job's folder, or record its error, and report it."""
+        if error is None and self.target_folder is None:
+            path = stored
+        elif error is None:
+            try:
+                path = place_in_folder(track, stored, self.target_folder)
+            except Exception as e:
+                error = e
+        metrics.track_finished(error is None)
+        if error is None:
+            self.completed += 1
+            self._set_state(track, "done", path)
+            if on_result:
+                on_result(track, path)
+        else:
+            self.failed += 1
+            if isinstance(error, NoMatchError):
+                self.unmatched += 1
+            self._set_state(track, "unmatched" if isinstance(error, NoMatchError) else "failed", str(error))
+        if on_progress:
+            on_progress(self, track, error)
+
+    def run(self, on_progress=None, workers=None, on_result=None):
+        """
+        Convert every track and call on_progress(job, track, error) as each
+        one finishes, plus on_result(track, path) for each success.
+        Tracks not yet started are dropped on cancel(). Errors raised by the
+        tracks iterable itself propagate once in-flight downloads finish.
+        """
+        downloader = get_download_scheduler()
+        transcoder = get_transcode_scheduler()
+        downloads = {}
+        transcodes = {}
+        # Downloaded tracks waiting for a transcode slot; counts against
+        # max_downloads so a slow transcode stage holds back new downloads.
+        ready = collections.deque()
+        tracks = iter(self.tracks)
+        listed_all = False
+        try:
+            while not self.cancelled:
+                while ready and len(transcodes) < TRANSCODE_QUEUE_SIZE:
+                    task = ready.popleft()
+                    self._set_state(task.track, "transcoding")
+                    transcodes[transcoder.submit(self, transcode, task.command, task.output)] = task
+                # Read each time round, as the number of download slots can change.
+                max_downloads = (workers or downloader.workers) * 2
+                while not listed_all and len(downloads) + len(ready) < max_downloads:
+                    track = next(tracks, None)
+                    if track is None:
+                        listed_all = True
+                        break
+                    downloads[downloader.submit(self, self._download, track)] = track
+                    self.total += 1
+                if not downloads and not transcodes:
+                    break
+                done, _ = wait([*downloads, *transcodes], return_when=FIRST_COMPLETED)
+                for future in done:
+                    if future.cancelled():
+                        # Only cancel() drops queued work; the loop ends below.
+                        continue
+                    if future in downloads:
+                        track = downloads.pop(future)
+                        try:
+                            result = future.result()
+                        except Exception as e:
+                            self._finished(track, on_progress, on_result, error=e)
+                            continue
+                        if isinstance(result, TranscodeTask):
+                            ready.append(result)
+                        elif result is not None:
+                            self._finished(track, on_progress, on_result, stored=result)
+                    else:
+                        task = transcodes.pop(future)
+                        try:
+                            metrics.observe("transcode", future.result())
+                        except Exception as e:
+                            metrics.error("transcode")
+                            task.discard()
+                            self._finished(task.track, on_progress, on_result, error=e)
+                            continue
+                        try:
+                            stored = task.finish()
+                        except Exception as e:
+                            self._finished(task.track, on_progress, on_result, error=e)
+                        else:
+                            self._finished(task.track, on_progress, on_result, stored=stored)
+        finally:
+            downloader.drop(self)
+            transcoder.drop(self)
+            # Downloads already running finish on their own, and ffmpeg may
+            # still be writing into the temp directories.
+            wait([*downloads, *transcodes])
+            for task in [*ready, *transcodes.values()]:
+                task.discard()
+            for future in downloads:
+                if not future.cancelled() and future.exception() is None and isinstance(future.result(), TranscodeTask):
+                    future.result().discard()
+        return self
+
+def cancel_downloads():
+    jobs = list(active_jobs)
+    for job in jobs:
+        job.cancel()
+    if jobs:
+        set_status(f"Cancelling {len(jobs)} download job(s)...")
+
+def report_job_progress(job, track, error):
+    frontend.track_progress(job, track, error)
+
+def run_download_job(job, on_result=None):
+    active_jobs.add(job)
+    try:
+        job.run(on_progress=report_job_progress, on_result=on_result)
+    finally:
+        active_jobs.discard(job)
+    if job.cancelled:
+        set_status(f"Cancelled: {job.name} ({job.completed}/{job.total} downloaded)")
+    elif not job.total:
+        set_status(f"Already up to date: {job.name}")
+    elif job.failed:
+        set_status(f"Download completed with {job.failed} error(s): {job.name}")
+    else:
+        set_status("Download completed!")
+    return job
+
+def iter_playlist_pages(spotify_obj, playlist_id):
+    """Yield a playlist's tracks one page at a time, fetching each page on demand."""
+    offset = 0
+    while True:
+        results = spotify_obj.playlist_items(playlist_id, fields=PLAYLIST_ITEM_FIELDS, limit=100, offset=offset)
+        items = results.get("items", [])
+        yield tracks_from_items(items)
+        if not results.get("next") or not items:
+            return
+        offset += len(items)
+
+def iter_playlist_tracks(spotify_obj, playlist_id):
+    for page in iter_playlist_pages(spotify_obj, playlist_id):
+        yield from page
+
+def download_track(track, target_folder=None, priority=PRIORITY_HIGH):
+    """Convert one track picked by the user; it goes ahead of queued bulk work."""
+    set_status(f"Downloading: {track.label}")
+    if target_folder is None:
+        target_folder = SINGLES_FOLDER
+    os.makedirs(target_folder, exist_ok=True)
+    return run_download_job(DownloadJob(track.label, target_folder, [track], priority=priority))
+
+def download_playlist(playlist_id, playlist_name, from_sp_obj=None, sync=True, prune=None, snapshot_id=None,
+                      priority=PRIORITY_NORMAL):
+    """
+    Convert a playlist into its own folder. With sync enabled the folder's
+    manifest is used to skip tracks that are already there, and an unchanged
+    snapshot_id skips the playlist entirely. prune deletes files for tracks
+    that were removed from the playlist (defaults to prune_removed_tracks).
+    Pass snapshot_id when it is already known to skip the metadata request.
+    priority is the job's scheduling priority (see JobScheduler).
+    """
+    if prune is None:
+        prune = prune_removed_tracks
+    set_status(f"Fetching tracks for playlist: {playlist_name}")
+    playlist_folder = os.path.join(OUTPUT_ROOT, sanitize_filename(playlist_name))
+    os.makedirs(playlist_folder, exist_ok=True)
+    spotify_obj = from_sp_obj if from_sp_obj else sp
+    manifest = load_manifest(playlist_folder) if sync else new_manifest()
+    if snapshot_id is None:
+        try:
+            snapshot_id = spotify_obj.playlist(playlist_id, fields="snapshot_id").get("snapshot_id")
+        except Exception as e:
+            show_error("Error", f"Could not fetch playlist tracks: {e}")
+            return
+    if sync and manifest_is_current(playlist_folder, manifest, playlist_id, snapshot_id):
+        set_status(f"Already up to date: {playlist_name}")
+        return
+    return sync_folder(
+        playlist_name, playlist_folder, iter_playlist_tracks(spotify_obj, playlist_id),
+        playlist_id, snapshot_id, manifest=manifest, sync=sync, prune=prune, priority=priority,
+    )
+
+def sync_folder(job_name, folder, tracks, source_id, snapshot_id=None, manifest=None, sync=True, prune=False,
+                resume_job_id=None, write_playlist=True, audio=None, priority=PRIORITY_NORMAL):
+    """
+    Download the given Track records into folder, skipping those the folder's
+    manifest already has when sync is enabled, then update the manifest.
+    Progress is persisted in the job queue; resume_job_id continues a job
+    from there, taking its unfinished tracks from the queue when tracks is
+    None. audio
+    is the job's AudioFormat (default DEFAULT_AUDIO_FORMAT) and priority its
+    scheduling priority.
+    """
+    os.makedirs(folder, exist_ok=True)
+    audio = audio or DEFAULT_AUDIO_FORMAT
+    jobs = get_job_queue()
+    if resume_job_id is None:
+        job_id = jobs.create_job(job_name, folder, source_id, snapshot_id)
+    else:
+        job_id = resume_job_id
+    from_queue = tracks is None
+    if from_queue:
+        tracks = jobs.unfinished_tracks(job_id)
+    # Tracks already in memory are all queued up front, so a resume has
+    # them even when the source can't be listed again; streamed ones are
+    # queued as they arrive and the resume lists the source again.
+    queued_up_front = hasattr(tracks, "__len__")
+    if queued_up_front and not from_queue:
+        jobs.add_tracks(job_id, [(manifest_key(track), track) for track in tracks])
+    if manifest is None:
+        manifest = load_manifest(folder) if sync else new_manifest()
+    manifest["playlist_id"] = source_id
+    entries = manifest["tracks"]
+    unmatched = manifest["unmatched"]
+    # Ordered, so the folder's M3U follows the source order.
+    wanted = {}
+    listed_all = False
+
+    def pending_tracks():
+        nonlocal listed_all
+        for track in tracks:
+            key = manifest_key(track)
+            wanted[key] = track
+            if sync and (manifest_entry_present(folder, entries.get(key)) or recently_unmatched(manifest, key)):
+                job.skipped += 1
+                continue
+            base_name = os.path.join(folder, track_base_name(track.name, track.artists))
+            existing = [base_name + "." + ext for ext in audio.extensions if os.path.isfile(base_name + "." + ext)]
+            if sync and existing:
+                # Downloaded before the folder had a manifest; adopt it as-is.
+                entries[key] = manifest_entry(folder, existing[0])
+                job.skipped += 1
+                continue
+            if not queued_up_front:
+                jobs.add_track(job_id, key, len(wanted), track)
+            yield track
+        # Tracks taken from the queue may not be the whole source; the next
+        # sync lists it again.
+        listed_all = not from_queue
+
+    finished = 0
+
+    def record(track, path):
+        nonlocal finished
+        entries[manifest_key(track)] = manifest_entry(folder, path)
+        unmatched.pop(manifest_key(track), None)
+        finished += 1
+        if finished % MANIFEST_SAVE_EVERY == 0:
+            save_manifest(folder, manifest)
+
+    def persist_state(track, state, detail):
+        jobs.set_track_state(job_id, manifest_key(track), state, detail)
+        if state == "unmatched":
+            unmatched[manifest_key(track)] = time.time()
+
+    job = DownloadJob(
+        job_name, folder, pending_tracks(), on_state=persist_state, audio=audio,
+        expected_total=len(tracks) if hasattr(tracks, "__len__") else None, priority=priority,
+    )
+    try:
+        run_download_job(job, on_result=record)
+    except Exception as e:
+        jobs.finish_job(job_id, "failed")
+        show_error("Error", f"Could not fetch playlist tracks: {e}")
+    else:
+        jobs.finish_job(job_id, "cancelled" if job.cancelled else "done")
+    if listed_all:
+        if prune:
+            prune_manifest(folder, manifest, wanted)
+        for key in [key for key in unmatched if key not in wanted]:
+            del unmatched[key]
+        if write_playlist and (WRITE_M3U or LINK_MODE == "m3u"):
+            write_m3u(folder, job_name, wanted, entries)
+        # Unmatched tracks are retried after UNMATCHED_RETRY_SECONDS, not on the next sync.
+        if job.failed == job.unmatched and not job.cancelled:
+            manifest["snapshot_id"] = snapshot_id
+    save_manifest(folder, manifest)
+    return job
+
+# ======= Bulk Import =======
+# Pasted or listed URLs/URIs are grouped by type and resolved through
+# Spotify's multi-ID endpoints (50 tracks or 20 albums per request) instead
+# of one request per link, then handed straight to the download queue.
+
+TRACKS_PER_REQUEST = 50
+ALBUMS_PER_REQUEST = 20
+ALBUM_TRACKS_PAGE_SIZE = 50
+BULK_IMPORT_TYPES = ("track", "album", "playlist", "user")
+
+def group_sources(sources):
+    """
+    Split URLs/URIs into {type: [ids]} (de-duplicated, in input order) for
+    the BULK_IMPORT_TYPES, plus a list of the sources that are not supported,
+    including those with a malformed ID: one of them would fail the whole
+    multi-ID request it is sent in.
+    """
+    groups = {kind: {} for kind in BULK_IMPORT_TYPES}
+    unsupported = []
+    for source in sources:
+        kind, spotify_id = classify_spotify_url(source)
+        if kind in groups and (kind == "user" or is_spotify_id(spotify_id)):
+            groups[kind][spotify_id] = None
+        else:
+            unsupported.append(source)
+    return {kind: list(ids) for kind, ids in groups.items()}, unsupported
+
+def chunked(items, size):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+def fetch_tracks_by_id(track_ids, client=None, on_error=None):
+    """
+    Resolve track IDs into Track records, TRACKS_PER_REQUEST per call.
+    Unknown IDs are skipped. A failed call raises, or with on_error, calls
+    on_error(ids, error) and carries on with the next chunk.
+    """
+    client = client or sp
+    tracks = []
+    for chunk in chunked(track_ids, TRACKS_PER_REQUEST):
+        try:
+            items = client.tracks(chunk).get("tracks", [])
+        except Exception as e:
+            if on_error is None:
+                raise
+            on_error(chunk, e)
+            continue
+        tracks.extend(Track.from_api(track) for track in items if track)
+    return tracks
+
+def fetch_album(client, album):
+    """Return (album_name, album_id, [track_id, ...]) for an album object, paging through long track lists."""
+    page = album.get("tracks") or {}
+    track_ids = [item["id"] for item in page.get("items", []) if item and item.get("id")]
+    offset = len(page.get("items", []))
+    while page.get("next"):
+        page = client.album_tracks(album["id"], limit=ALBUM_TRACKS_PAGE_SIZE, offset=offset)
+        track_ids.extend(item["id"] for item in page.get("items", []) if item and item.get("id"))
+        offset += len(page.get("items", []))
+    return album.get("name", ""), album.get("id"), track_ids
+
+def fetch_albums_by_id(album_ids, client=None, on_error=None):
+    """
+    Return [(album_name, album_id, [track_id, ...])], ALBUMS_PER_REQUEST
+    per call. Album track listings omit ISRCs, so callers fetch the tracks
+    themselves through fetch_tracks_by_id. Failures are handled as there,
+    per chunk, or per album while paging through its tracks.
+    """
+    client = client or sp
+    albums = []
+    for chunk in chunked(album_ids, ALBUMS_PER_REQUEST):
+        try:
+            items = client.albums(chunk).get("albums", [])
+        except Exception as e:
+            if on_error is None:
+                raise
+            on_error(chunk, e)
+            continue
+        for album in items:
+            if not album:
+                continue
+            try:
+                albums.append(fetch_album(client, album))
+            except Exception as e:
+                if on_error is None:
+                    raise
+                on_error([album.get("id")], e)
+    return albums
+
+def lookup_failed(kind):
+    """An on_error for fetch_tracks_by_id/fetch_albums_by_id that reports the IDs it skips."""
+    def report(ids, error):
+        shown = ", ".join(str(spotify_id) for spotify_id in ids[:3]) + (", ..." if len(ids) > 3 else "")
+        show_error("Error", f"Could not look up {len(ids)} {kind} ({shown}): {error}")
+    return report
+
+def fetch_singles_and_albums(track_ids, album_ids, report_failures=True):
+    """
+    Look up loose tracks and albums: the albums first, then their tracks and
+    the loose ones together in one batched pass. Returns (singles, albums),
+    with albums as [(album_name, album_id, [Track, ...])]. Failed requests
+    are reported and only drop the IDs they were for, or raise when
+    report_failures is false.
+    """
+    albums = fetch_albums_by_id(album_ids, on_error=lookup_failed("albums") if report_failures else None)
+    album_track_ids = [track_id for _, _, ids in albums for track_id in ids]
+    by_id = {
+        track.id: track
+        for track in fetch_tracks_by_id(track_ids + album_track_ids,
+                                        on_error=lookup_failed("tracks") if report_failures else None)
+    }
+    singles = [by_id[track_id] for track_id in track_ids if track_id in by_id]
+    return singles, [
+        (album_name, album_id, [by_id[track_id] for track_id in ids if track_id in by_id])
+        for album_name, album_id, ids in albums
+    ]
+
+def load_playlist(playlist_id):
+    """Return the Playlist and the client to list its tracks with: the owner's login, so private ones work."""
+    playlist = Playlist.from_api(sp.playlist(playlist_id, fields=PLAYLIST_FIELDS))
+    return playlist, playlist_client(playlist.owner_id) or sp
+
+def library_client(user_id):
+    """Return (client, include_saved) for listing a user's library; saved tracks need their login."""
+    client = playlist_client(user_id)
+    return client or sp, client is not None
+
+def list_sources(sources):
+    """
+    Group Spotify URLs/URIs by type, reporting the unsupported ones, and look
+    up the tracks and albums among them. Returns (singles, albums,
+    playlist_ids, user_ids), singles and albums as fetch_singles_and_albums
+    returns them; playlists and users are left to the caller to list.
+    """
+    groups, unsupported = group_sources(sources)
+    for source in unsupported:
+        show_error("Unsupported", f"Not a valid Spotify track, album, playlist or user URL/URI: {source}")
+    singles, albums = [], []
+    if groups["track"] or groups["album"]:
+        set_status(f"Looking up {len(groups['track'])} tracks and {len(groups['album'])} albums...")
+        singles, albums = fetch_singles_and_albums(groups["track"], groups["album"])
+    return singles, albums, groups["playlist"], groups["user"]
+
+def convert_sources(sources, sync=True, prune=False, priority=PRIORITY_LOW):
+    """
+    Convert a batch of Spotify URLs/URIs: tracks go to the singles folder,
+    albums and playlists to a folder each, users are mirrored. Returns the
+    DownloadJobs that ran. Batches default to low priority so tracks picked
+    in the GUI meanwhile go first.
+    """
+    singles, albums, playlist_ids, user_ids = list_sources(sources)
+    jobs = []
+    if singles:
+        jobs.append(sync_folder(
+            "Singles", SINGLES_FOLDER, singles, "singles", sync=sync, write_playlist=False, priority=priority,
+        ))
+    for album_name, album_id, tracks in albums:
+        folder = os.path.join(OUTPUT_ROOT, sanitize_filename(album_name))
+        jobs.append(sync_folder(
+            album_name, folder, tracks, f"album:{album_id}", sync=sync, prune=prune, priority=priority,
+        ))
+    for playlist_id in playlist_ids:
+        try:
+            playlist, client = load_playlist(playlist_id)
+        except Exception as e:
+            show_error("Error", f"Could not load playlist {playlist_id}: {e}")
+            continue
+        jobs.append(download_playlist(
+            playlist.id, playlist.name, from_sp_obj=client,
+            sync=sync, prune=prune, snapshot_id=playlist.snapshot_id, priority=priority,
+        ))
+    for user_id in user_ids:
+        client, include_saved = library_client(user_id)
+        jobs.append(mirror_library(user_id, client, include_saved=include_saved, priority=priority))
+    return [job for job in jobs if job is not None]
+
+# ======= Full Library Export =======
+# Mirroring a whole account reads "total" from the first page of each listing
+# and fetches the remaining offsets in parallel (the shared scheduler keeps
+# that within Spotify's rate limit). Every track found goes into one
+# de-duplicated plan, so a song saved and on three playlists downloads once.
+
+LIBRARY_FOLDER_NAME = "SpotifyLibrary"
+LIKED_SONGS_NAME = "Liked Songs"
+SAVED_TRACKS_PAGE_SIZE = 50
+USER_PLAYLISTS_PAGE_SIZE = 50
+PLAYLIST_ITEMS_PAGE_SIZE = 100
+
+def fetch_all_pages(fetch_page, page_size):
+    """
+    fetch_page(offset, limit) returns (total, records). The first page is
+    fetched on its own to learn the total, the rest concurrently; records are
+    returned in order.
+    """
+    total, records = fetch_page(0, page_size)
+    offsets = range(page_size, total, page_size)
+    if offsets:
+        with ThreadPoolExecutor(max_workers=SPOTIFY_MAX_IN_FLIGHT) as pool:
+            for _, page in pool.map(lambda offset: fetch_page(offset, page_size), offsets):
+                records.extend(page)
+    return records
+
+def fetch_saved_tracks(client):
+    def fetch_page(offset, limit):
+        result = client.current_user_saved_tracks(limit=limit, offset=offset)
+        return result.get("total", 0), tracks_from_items(result.get("items", []))
+    return fetch_all_pages(fetch_page, SAVED_TRACKS_PAGE_SIZE)
+
+def fetch_user_playlists(client, user_id):
+    def fetch_page(offset, limit):
+        result = client.user_playlists(user_id, limit=limit, offset=offset)
+        return result.get("total", 0), playlists_from_items(result.get("items", []))
+    return fetch_all_pages(fetch_page, USER_PLAYLISTS_PAGE_SIZE)
+
+def fetch_playlist_tracks(client, playlist_id):
+    def fetch_page(offset, limit):
+        result = client.playlist_items(playlist_id, fields=PLAYLIST_ITEM_FIELDS, limit=limit, offset=offset)
+        return result.get("total", 0), tracks_from_items(result.get("items", []))
+    return fetch_all_pages(fetch_page, PLAYLIST_ITEMS_PAGE_SIZE)
+
+def build_library_plan(client, user_id, include_saved=True):
+    """
+    Enumerate the user's saved tracks and every playlist they have. Returns
+    (sources, plan): sources is a list of (name, source_id, snapshot_id,
+    tracks) per listing, and plan maps manifest_key -> Track with each song
+    once, de-duplicated by Spotify ID and then by ISRC. Tracks in sources
+    that duplicate a plan entry by ISRC are replaced with that entry, so they
+    resolve to the same stored file.
+    """
+    playlists = fetch_user_playlists(client, user_id)
+    sources = []
+    with ThreadPoolExecutor(max_workers=SPOTIFY_MAX_IN_FLIGHT) as pool:
+        saved = pool.submit(fetch_saved_tracks, client) if include_saved else None
+        playlist_tracks = pool.map(lambda playlist: fetch_playlist_tracks(client, playlist.id), playlists)
+        for playlist, tracks in zip(playlists, playlist_tracks):
+            sources.append((playlist.name, playlist.id, playlist.snapshot_id, tracks))
+        if saved is not None:
+            sources.insert(0, (LIKED_SONGS_NAME, f"liked:{user_id}", None, saved.result()))
+    plan = {}
+    by_isrc = {}
+    for _, _, _, tracks in sources:
+        for i, track in enumerate(tracks):
+            key = manifest_key(track)
+            if key in plan:
+                continue
+            if track.isrc in by_isrc:
+                tracks[i] = by_isrc[track.isrc]
+                continue
+            plan[key] = track
+            if track.isrc:
+                by_isrc[track.isrc] = track
+    return sources, plan
+
+def mirror_library(user_id, client=None, include_saved=True, priority=PRIORITY_LOW):
+    """
+    Download every saved track and every track on the user's playlists once
+    into the track store, then link them into one folder per playlist.
+    """
+    client = client or sp
+    set_status(f"Listing library for {user_id}...")
+    try:
+        sources, plan = build_library_plan(client, user_id, include_saved)
+    except Exception as e:
+        show_error("Error", f"Could not list library: {e}")
+        return None
+    set_status(f"Found {len(plan)} unique tracks across {len(sources)} playlists")
+    folder = os.path.join(OUTPUT_ROOT, LIBRARY_FOLDER_NAME, sanitize_filename(user_id))
+    os.makedirs(folder, exist_ok=True)
+    job = sync_folder(f"Library of {user_id}", folder, plan.values(), f"library:{user_id}", priority=priority)
+    if job.cancelled:
+        return job
+    # Everything is in the store now, so this only creates links.
+    for name, source_id, snapshot_id, tracks in sources:
+        playlist_folder = os.path.join(OUTPUT_ROOT, sanitize_filename(name))
+        os.makedirs(playlist_folder, exist_ok=True)
+        sync_folder(name, playlist_folder, tracks, source_id, snapshot_id, priority=priority)
+    return job
+
+def show_playlist_tracks_by_id(playlist_id, playlist_name):
+    top = tk.Toplevel(root)
+    top.title(f"Tracks in {playlist_name}")
+    listbox = tk.Listbox(top, width=80)
+    listbox.pack(fill=tk.BOTH, expand=True)
+
+    def stream_pages():
+        # Each page is handed to the UI as soon as it arrives.
+        for page in iter_playlist_pages(sp, playlist_id):
+            post_ui(render_playlist_tracks_page, listbox, page)
+
+    run_in_background(stream_pages, error_prefix="Could not fetch playlist tracks")
+
+def render_playlist_tracks_page(listbox, tracks):
+    if not listbox.winfo_exists():
+        return
+    for track in tracks:
+        listbox.insert(tk.END, track.label)
+
+# ======= Distributed Workers =======
+# A large export can be spread over several machines through a spool: a
+# SQLite file on shared storage listing every track to convert. Worker
+# processes (--worker) lease tracks from it one at a time and fetch them into
+# the shared track store; a lease is kept alive by heartbeats, so tracks held
+# by a worker that crashed or lost the network go back to the others once it
+# expires. Playlist folders are then filled by a normal run against the same
+# output folder, which only links what the workers stored.
+#
+# SQLite relies on the file system's locks, so the shared storage has to
+# support them (local disks, NFSv4, SMB). WAL is not used for the same
+# reason: it needs shared memory, which only works on one host.
+
+SPOOL_LEASE_SECONDS = 120
+SPOOL_POLL_SECONDS = 1
+# A track whose lease expires this many times (say it crashes every worker
+# that tries it) is marked failed instead of being handed out again.
+SPOOL_MAX_ATTEMPTS = 3
+
+class Spool:
+    """Tracks to convert, shared by worker processes through a SQLite file."""
+
+    def __init__(self, path, lease_seconds=SPOOL_LEASE_SECONDS):
+        self.lease_seconds = lease_seconds
+        self._lock = threading.Lock()
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, timeout=60, isolation_level=None, check_same_thread=False)
+        with self._transaction():
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS spool ("
+                " key TEXT PRIMARY KEY,"
+                " track TEXT NOT NULL,"
+                " audio TEXT NOT NULL,"
+                " state TEXT NOT NULL,"
+                " worker TEXT,"
+                " lease_until REAL,"
+                " attempts INTEGER NOT NULL DEFAULT 0,"
+                " detail TEXT,"
+                " updated_at REAL NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS spool_state ON spool (state, lease_until)")
+
+    @contextlib.contextmanager
+    def _transaction(self):
+        # IMMEDIATE takes the write lock up front, so two workers can't both
+        # read the same free track before either marks it leased.
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+
+    def add(self, tracks, audio):
+        """Queue tracks in the given AudioFormat; those already spooled are skipped. Returns how many were added."""
+        now = time.time()
+        settings = json.dumps([audio.codec, audio.bitrate, audio.passthrough])
+        rows = [
+            (f"{store_key(track)}.{audio.name}", json.dumps(track.to_list()), settings, now)
+            for track in tracks
+        ]
+        with self._transaction():
+            before = self._conn.total_changes
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO spool (key, track, audio, state, updated_at) VALUES (?, ?, ?, 'pending', ?)",
+                rows,
+            )
+            return self._conn.total_changes - before
+
+    def lease(self, worker):
+        """Lease the next free track to worker: returns (key, Track, AudioFormat), or None."""
+        now = time.time()
+        with self._transaction():
+            self._conn.execute(
+                "UPDATE spool SET state = 'failed', worker = NULL, lease_until = NULL, updated_at = ?,"
+                " detail = 'lease expired ' || attempts || ' times'"
+                " WHERE state = 'leased' AND lease_until < ? AND attempts >= ?",
+                (now, now, SPOOL_MAX_ATTEMPTS),
+            )
+            row = self._conn.execute(
+                "SELECT key, track, audio FROM spool"
+                " WHERE state = 'pending' OR (state = 'leased' AND lease_until < ?)"
+                " ORDER BY rowid LIMIT 1",
+                (now,),
+            ).fetchone()
+            if row is None:
+                return None
+            self._conn.execute(
+                "UPDATE spool SET state = 'leased', worker = ?, lease_until = ?, attempts = attempts + 1,"
+                " updated_at = ? WHERE key = ?",
+                (worker, now + self.lease_seconds, now, row[0]),
+            )
+        key, track, audio = row
+        return key, Track.from_list(json.loads(track)), AudioFormat(*json.loads(audio))
 
-# For user authentication (to get liked songs and private playlists)
-sp_user = None
+    def heartbeat(self, worker):
+        """Extend every lease worker holds."""
+        now = time.time()
+        with self._transaction():
+            self._conn.execute(
+                "UPDATE spool SET lease_until = ?, updated_at = ? WHERE worker = ? AND state = 'leased'",
+                (now + self.lease_seconds, now, worker),
+            )
 
-# ======= Global Variables for Pagination (Search Tab) =======
-search_limit = 10
-search_query = ""
-search_tracks_offset = 0
-search_tracks_total = 0
-search_playlists_offset = 0
-search_playlists_total = 0
+    def finish(self, key, worker, state, detail=None):
+        """Record a leased track as done, failed or unmatched, unless the lease has passed to another worker."""
+        with self._transaction():
+            self._conn.execute(
+                "UPDATE spool SET state = ?, detail = ?, worker = NULL, lease_until = NULL, updated_at = ?"
+                " WHERE key = ? AND worker = ? AND state = 'leased'",
+                (state, detail, time.time(), key, worker),
+            )
 
-# ======= Global Variables for Pagination (Account Tab) =======
-account_limit = 10
-account_id = ""
-account_playlists_offset = 0
-account_playlists_total = 0
-account_liked_offset = 0
-account_liked_total = 0
+    def release(self, worker):
+        """Hand the tracks worker still holds back to the others, as if never tried."""
+        with self._transaction():
+            self._conn.execute(
+                "UPDATE spool SET state = 'pending', worker = NULL, lease_until = NULL, attempts = attempts - 1,"
+                " updated_at = ? WHERE worker = ? AND state = 'leased'",
+                (time.time(), worker),
+            )
 
-# NEW: Global variables for playlist lookup mode
-playlist_lookup_mode = False
-lookup_playlist_id = ""
-lookup_playlist_name = ""
+    def counts(self):
+        """Return {state: number of tracks}."""
+        with self._lock:
+            return dict(self._conn.execute("SELECT state, COUNT(*) FROM spool GROUP BY state").fetchall())
 
-# ======= Helper Functions =======
+    def close(self):
+        with self._lock:
+            self._conn.close()
 
-def sanitize_filename(name: str) -> str:
-    return re.sub(r'[\\/*?:"<>|]', '_', name)
+def format_spool_counts(counts):
+    return ", ".join(f"{counts.get(state, 0)} {state}" for state in ("pending", "leased", "done", "unmatched", "failed"))
 
-def parse_spotify_id_from_url(url_or_uri: str, expected_type: str) -> str:
-    url_or_uri = url_or_uri.strip()
-    if url_or_uri.startswith("spotify:") and expected_type in url_or_uri:
-        parts = url_or_uri.split(":")
-        if len(parts) == 3:
-            return parts[2]
-    if "open.spotify.com" in url_or_uri and expected_type in url_or_uri:
-        parts = url_or_uri.split("/")
-        for i, part in enumerate(parts):
-            if part == expected_type and i + 1 < len(parts):
-                raw_id = parts[i + 1]
-                return raw_id.split("?")[0]
-    return url_or_uri
+def spool_sources(sources, spool, audio=None):
+    """
+    List the tracks of Spotify URLs/URIs, as convert_sources would convert
+    them, and queue them in the spool for workers. Returns how many tracks
+    were added.
+    """
+    audio = audio or DEFAULT_AUDIO_FORMAT
+    singles, albums, playlist_ids, user_ids = list_sources(sources)
+    added = spool.add(singles + [track for _, _, tracks in albums for track in tracks], audio)
+    for playlist_id in playlist_ids:
+        try:
+            playlist, client = load_playlist(playlist_id)
+            set_status(f"Fetching tracks for playlist: {playlist.name}")
+            added += spool.add(iter_playlist_tracks(client, playlist.id), audio)
+        except Exception as e:
+            show_error("Error", f"Could not load playlist {playlist_id}: {e}")
+    for user_id in user_ids:
+        client, include_saved = library_client(user_id)
+        set_status(f"Listing library for {user_id}...")
+        try:
+            _, plan = build_library_plan(client, user_id, include_saved)
+        except Exception as e:
+            show_error("Error", f"Could not list library: {e}")
+            continue
+        added += spool.add(plan.values(), audio)
+    return added
 
-# ======= Download (Conversion) Functions =======
+class SpoolJob(DownloadJob):
+    """Leased spool tracks fetched into the track store, each in the format it was spooled with."""
 
-def download_track(track_name, artist_name, target_folder=None):
-    status_var.set(f"Downloading: {track_name} - {artist_name}")
-    desktop_folder = os.path.join(os.path.expanduser("~"), "Desktop", "SpotifyMP3s")
-    if target_folder is None:
-        target_folder = os.path.join(desktop_folder, "SpotifySingles")
-    os.makedirs(target_folder, exist_ok=True)
-    current_dir = os.getcwd()
-    os.chdir(target_folder)
-    search_query_yt = f"{track_name} {artist_name} audio"
-    ydl_opts = {
-        'format': 'bestaudio/best',
-        'outtmpl': f"{track_name} - {artist_name}.%(ext)s",
-        'noplaylist': True,
-        'postprocessors': [{
-            'key': 'FFmpegExtractAudio',
-            'preferredcodec': 'mp3',
-            'preferredquality': '192',
-        }],
-        'quiet': True,
-        'no_warnings': True,
-    }
+    def __init__(self, name, tracks, formats, on_state=None):
+        super().__init__(name, None, tracks, on_state=on_state)
+        self.formats = formats
+
+    def _download(self, track):
+        if self.cancelled:
+            return None
+        return start_store_fetch(track, self.formats[track], lambda state: self._set_state(track, state),
+                                 self.cancel_event)
+
+def run_spool_worker(path, lease_seconds=SPOOL_LEASE_SECONDS):
+    """
+    Convert tracks from the spool at path into the track store until none
+    are left, including those leased by other workers. Returns the
+    SpoolJobs that ran.
+    """
+    spool = Spool(path, lease_seconds)
+    worker = worker_id()
+    leases = {}
+    formats = {}
+    stopped = threading.Event()
+
+    def heartbeat():
+        while not stopped.wait(lease_seconds / 3):
+            try:
+                spool.heartbeat(worker)
+            except sqlite3.Error as e:
+                # Leases last a few beats, so the next one can still save them.
+                set_status(f"Spool heartbeat failed: {e}")
+
+    def leased_tracks():
+        # Stops when nothing is free, letting the job finish what it holds;
+        # the loop below then waits for leases held elsewhere to finish or expire.
+        while True:
+            leased = spool.lease(worker)
+            if leased is None:
+                return
+            key, track, audio = leased
+            leases[track] = key
+            formats[track] = audio
+            yield track
+
+    def record(track, state, detail):
+        if state in ("done", "failed", "unmatched"):
+            spool.finish(leases.pop(track), worker, state, detail)
+            formats.pop(track, None)
+
+    set_status(f"Worker {worker} started on {path}")
+    threading.Thread(target=heartbeat, name="spool-heartbeat", daemon=True).start()
+    jobs = []
     try:
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            ydl.download([f"ytsearch:{search_query_yt}"])
-    except Exception as e:
-        status_var.set(f"Error downloading {track_name}: {e}")
-    else:
-        status_var.set(f"Downloaded: {track_name} - {artist_name}")
-    os.chdir(current_dir)
-
-def download_playlist(playlist_id, playlist_name, from_sp_obj=None):
-    status_var.set(f"Fetching tracks for playlist: {playlist_name}")
-    sanitized_name = sanitize_filename(playlist_name)
-    desktop_folder = os.path.join(os.path.expanduser("~"), "Desktop", "SpotifyMP3s")
-    playlist_folder = os.path.join(desktop_folder, sanitized_name)
-    os.makedirs(playlist_folder, exist_ok=True)
-    current_dir = os.getcwd()
-    os.chdir(playlist_folder)
-    spotify_obj = from_sp_obj if from_sp_obj else sp
-    all_tracks = []
+        while True:
+            job = SpoolJob(f"Spool worker {worker}", leased_tracks(), formats, on_state=record)
+            active_jobs.add(job)
+            try:
+                job.run(on_progress=report_job_progress)
+            finally:
+                active_jobs.discard(job)
+            if job.total:
+                # Idle polls lease nothing and would only pad the summary.
+                jobs.append(job)
+            counts = spool.counts()
+            if job.cancelled or not (counts.get("pending") or counts.get("leased")):
+                break
+            if not job.total:
+                time.sleep(SPOOL_POLL_SECONDS)
+    finally:
+        stopped.set()
+        spool.release(worker)
+        counts = spool.counts()
+        spool.close()
+    set_status(f"Spool: {format_spool_counts(counts)}")
+    return jobs
+
+# ======= SEARCH TAB Functions =======
+# The search box queries as you type, SEARCH_DEBOUNCE_MS after the last key.
+# Each new search supersedes the previous one: its queued requests are
+# cancelled and late results ignored. Pages are kept in an LRU cache keyed by
+# (query, type, offset), and the page after the one shown is prefetched, so
+# paging and re-typing recent queries rarely wait on Spotify.
+
+SEARCH_DEBOUNCE_MS = 300
+SEARCH_MIN_CHARS = 2
+SEARCH_CACHE_SIZE = 256
+SEARCH_CACHE_TTL = 10 * 60  # seconds
+
+class SearchCache:
+    """Thread-safe LRU of search pages, each kept for at most ttl seconds."""
+
+    def __init__(self, max_entries=SEARCH_CACHE_SIZE, ttl=SEARCH_CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            stored_at, value = entry
+            if time.monotonic() - stored_at > self.ttl:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+search_cache = SearchCache()
+# Pages being fetched right now, so a prefetch and a click share one request.
+_search_requests = {}
+_search_requests_lock = threading.Lock()
+
+def search_cache_key(query, kind, offset):
+    return " ".join(query.lower().split()), kind, offset
+
+def search_page(query, kind, offset):
+    """Return (total, records) for one page of search results, from the cache when possible."""
+    key = search_cache_key(query, kind, offset)
+    cached = search_cache.get(key)
+    if cached is not None:
+        return cached
+    with _search_requests_lock:
+        pending = _search_requests.get(key)
+        if pending is None:
+            _search_requests[key] = future = Future()
+    if pending is not None:
+        return pending.result()
     try:
-        results = spotify_obj.playlist_items(playlist_id, limit=100)
-        all_tracks.extend(results.get("items", []))
-        while results.get("next"):
-            results = spotify_obj.next(results)
-            all_tracks.extend(results.get("items", []))
-    except Exception as e:
-        messagebox.showerror("Error", f"Could not fetch playlist tracks: {e}")
-        os.chdir(current_dir)
+        fetch = search_track_page if kind == "track" else search_playlist_page
+        result = fetch(query, offset)
+        search_cache.put(key, result)
+        future.set_result(result)
+        return result
+    except BaseException as e:
+        future.set_exception(e)
+        raise
+    finally:
+        with _search_requests_lock:
+            del _search_requests[key]
+
+def load_search_results(kind, offset, render, error_prefix):
+    """
+    Show a page of results for the current search: at once from the cache,
+    or once fetched in the background. Then prefetch the following page.
+    """
+    query, generation = search_query, search_generation
+
+    def show(result):
+        if result is None or generation != search_generation:
+            return
+        render(result)
+        next_offset = offset + search_limit
+        if next_offset < result[0] and search_cache.get(search_cache_key(query, kind, next_offset)) is None:
+            search_futures.append(api_executor.submit(prefetch_search_page, query, kind, next_offset, generation))
+
+    def fetch():
+        if generation != search_generation:
+            return None
+        try:
+            return search_page(query, kind, offset)
+        except Exception:
+            if generation != search_generation:
+                return None
+            raise
+
+    cached = search_cache.get(search_cache_key(query, kind, offset))
+    if cached is not None:
+        show(cached)
         return
-    for item in all_tracks:
-        track = item.get("track")
-        if not track:
-            continue
-        track_name = track.get("name", "")
-        artists = ", ".join([artist["name"] for artist in track.get("artists", [])])
-        download_track(track_name, artists, target_folder=playlist_folder)
-    status_var.set("Download completed!")
-    os.chdir(current_dir)
+    search_futures.append(run_in_background(
+        fetch, on_done=show, error_title="Spotify Error", error_prefix=error_prefix,
+    ))
 
-def show_playlist_tracks_by_id(playlist_id, playlist_name):
-    try:
-        all_tracks = []
-        results = sp.playlist_items(playlist_id, limit=100)
-        all_tracks.extend(results.get("items", []))
-        while results.get("next"):
-            results = sp.next(results)
-            all_tracks.extend(results.get("items", []))
-    except Exception as e:
-        messagebox.showerror("Error", f"Could not fetch playlist tracks: {e}")
+def prefetch_search_page(query, kind, offset, generation):
+    if generation != search_generation:
         return
-    top = tk.Toplevel(root)
-    top.title(f"Tracks in {playlist_name}")
-    listbox = tk.Listbox(top, width=80)
-    listbox.pack(fill=tk.BOTH, expand=True)
-    for item in all_tracks:
-        track = item.get("track")
-        if track:
-            tname = track.get("name", "")
-            artists = ", ".join([a["name"] for a in track.get("artists", [])])
-            listbox.insert(tk.END, f"{tname} - {artists}")
+    try:
+        search_page(query, kind, offset)
+    except Exception:
+        pass  # Only a prefetch; the page is fetched again if it is opened.
 
-# ======= SEARCH TAB Functions =======
+def schedule_search(event=None):
+    """Search SEARCH_DEBOUNCE_MS after the last key press in the search box."""
+    global search_after_id
+    if search_after_id is not None:
+        root.after_cancel(search_after_id)
+    search_after_id = root.after(SEARCH_DEBOUNCE_MS, search_as_you_type)
+
+def search_as_you_type():
+    global search_after_id
+    search_after_id = None
+    q = search_entry.get().strip()
+    if len(q) >= SEARCH_MIN_CHARS and q != search_query:
+        perform_search(incremental=True)
 
 def is_direct_url_or_uri(query: str) -> bool:
     query = query.lower()
     return "spotify.com" in query or query.startswith("spotify:")
 
-def perform_search():
-    global search_query, search_tracks_offset, search_playlists_offset
+def perform_search(incremental=False):
+    global search_query, search_tracks_offset, search_playlists_offset, search_generation, search_after_id
+    if search_after_id is not None:
+        root.after_cancel(search_after_id)
+        search_after_id = None
     q = search_entry.get().strip()
     if not q:
-        messagebox.showwarning("Input Error", "Please enter a search term, URL, or URI.")
+        if not incremental:
+            messagebox.showwarning("Input Error", "Please enter a search term, URL, or URI.")
         return
+    if incremental and is_direct_url_or_uri(q):
+        # Wait until a URL being typed or pasted has a whole ID; lookups on
+        # "…/track/" or "…/track/4" would only fail.
+        kind, spotify_id = classify_spotify_url(q)
+        if kind not in ("track", "playlist", "artist") or not is_spotify_id(spotify_id):
+            return
+    # Supersede the previous search: drop its queued requests and late results.
+    search_generation += 1
+    for future in search_futures:
+        future.cancel()
+    search_futures.clear()
     search_tracks_offset = 0
     search_playlists_offset = 0
     search_query = q
@@ -170,12 +3039,12 @@ def perform_search():
         track_id = parse_spotify_id_from_url(q, "track")
         if track_id != q:
             load_direct_track(track_id)
-            search_playlists_listbox.delete(0, tk.END)
+            show_search_playlists([])
             return
         playlist_id = parse_spotify_id_from_url(q, "playlist")
         if playlist_id != q:
             load_direct_playlist(playlist_id)
-            search_tracks_listbox.delete(0, tk.END)
+            show_search_tracks([])
             return
         artist_id = parse_spotify_id_from_url(q, "artist")
         if artist_id != q:
@@ -184,72 +3053,98 @@ def perform_search():
     load_search_tracks()
     load_search_playlists()
 
-def load_direct_track(track_id):
-    global search_tracks_total
-    try:
-        track = sp.track(track_id)
-    except Exception as e:
-        messagebox.showerror("Spotify Error", f"Error loading track: {e}")
-        return
+def show_search_tracks(tracks):
+    global search_track_results
+    search_track_results = list(tracks)
     search_tracks_listbox.delete(0, tk.END)
-    name = track.get("name", "")
-    artists = ", ".join([a["name"] for a in track.get("artists", [])])
-    search_tracks_listbox.insert(tk.END, f"{name} - {artists}")
+    for track in search_track_results:
+        search_tracks_listbox.insert(tk.END, track.label)
+
+def show_search_playlists(playlists):
+    global search_playlist_results
+    search_playlist_results = list(playlists)
     search_playlists_listbox.delete(0, tk.END)
+    for playlist in search_playlist_results:
+        search_playlists_listbox.insert(tk.END, playlist.name)
+
+def load_direct_result(fetch, render, error_prefix):
+    """Look up the item a pasted URL points at; like a search page, it is dropped once superseded."""
+    generation = search_generation
+
+    def lookup():
+        if generation != search_generation:
+            return None
+        try:
+            return fetch()
+        except Exception:
+            if generation != search_generation:
+                return None
+            raise
+
+    def show(result):
+        if result is not None and generation == search_generation:
+            render(result)
+
+    search_futures.append(run_in_background(
+        lookup, on_done=show, error_title="Spotify Error", error_prefix=error_prefix,
+    ))
+
+def load_direct_track(track_id):
+    load_direct_result(lambda: Track.from_api(sp.track(track_id)), render_direct_track, "Error loading track")
+
+def render_direct_track(track):
+    global search_tracks_total
+    show_search_tracks([track])
+    show_search_playlists([])
     search_tracks_total = 1
 
 def load_direct_playlist(playlist_id):
+    load_direct_result(
+        lambda: Playlist.from_api(sp.playlist(playlist_id, fields=PLAYLIST_FIELDS)),
+        render_direct_playlist, "Error loading playlist",
+    )
+
+def render_direct_playlist(playlist):
     global search_playlists_total
-    try:
-        playlist = sp.playlist(playlist_id, fields="name")
-    except Exception as e:
-        messagebox.showerror("Spotify Error", f"Error loading playlist: {e}")
-        return
-    search_playlists_listbox.delete(0, tk.END)
-    name = playlist.get("name", "")
-    search_playlists_listbox.insert(tk.END, name)
-    search_tracks_listbox.delete(0, tk.END)
+    show_search_playlists([playlist])
+    show_search_tracks([])
     search_playlists_total = 1
 
 def load_direct_artist(artist_id):
-    global search_tracks_total
-    try:
-        artist = sp.artist(artist_id)
-    except Exception as e:
-        messagebox.showerror("Spotify Error", f"Error loading artist: {e}")
-        return
+    load_direct_result(lambda: sp.artist(artist_id), render_direct_artist, "Error loading artist")
+
+def render_direct_artist(artist):
+    global search_tracks_total, search_track_results
+    search_track_results = []
     search_tracks_listbox.delete(0, tk.END)
     search_tracks_listbox.insert(tk.END, f"Artist: {artist.get('name', '')}")
-    search_playlists_listbox.delete(0, tk.END)
+    show_search_playlists([])
     search_tracks_total = 1
 
 def load_search_tracks():
+    load_search_results("track", search_tracks_offset, render_search_tracks, "Error during track search")
+
+def search_track_page(query, offset):
+    # The search endpoint has no fields filter, so trim the results here.
+    tracks = sp.search(q=query, type="track", limit=search_limit, offset=offset).get("tracks", {})
+    return tracks.get("total", 0), [Track.from_api(item) for item in tracks.get("items", []) if item]
+
+def render_search_tracks(result):
     global search_tracks_total
-    try:
-        result = sp.search(q=search_query, type="track", limit=search_limit, offset=search_tracks_offset)
-    except Exception as e:
-        messagebox.showerror("Spotify Error", f"Error during track search: {e}")
-        return
-    tracks = result.get("tracks", {})
-    search_tracks_total = tracks.get("total", 0)
-    search_tracks_listbox.delete(0, tk.END)
-    for item in tracks.get("items", []):
-        name = item.get("name", "")
-        artists = ", ".join([artist["name"] for artist in item.get("artists", [])])
-        search_tracks_listbox.insert(tk.END, f"{name} - {artists}")
+    search_tracks_total, tracks = result
+    show_search_tracks(tracks)
 
 def load_search_playlists():
+    load_search_results("playlist", search_playlists_offset, render_search_playlists, "Error during playlist search")
+
+def search_playlist_page(query, offset):
+    playlists = sp.search(q=query, type="playlist", limit=search_limit, offset=offset).get("playlists", {})
+    return playlists.get("total", 0), playlists_from_items(playlists.get("items", []))
+
+def render_search_playlists(result):
     global search_playlists_total
-    try:
-        result = sp.search(q=search_query, type="playlist", limit=search_limit, offset=search_playlists_offset)
-    except Exception as e:
-        messagebox.showerror("Spotify Error", f"Error during playlist search: {e}")
-        return
-    playlists = result.get("playlists", {})
-    search_playlists_total = playlists.get("total", 0)
-    search_playlists_listbox.delete(0, tk.END)
-    for item in playlists.get("items", []):
-        search_playlists_listbox.insert(tk.END, item.get("name", ""))
+    search_playlists_total, playlists = result
+    show_search_playlists(playlists)
 
 def search_tracks_next():
     global search_tracks_offset
@@ -275,36 +3170,32 @@ def search_playlists_prev():
         search_playlists_offset -= search_limit
         load_search_playlists()
 
+def selected_item(listbox, results):
+    """Return the model object behind the listbox's selected row, if any."""
+    index = listbox.curselection()
+    if index and index[0] < len(results):
+        return results[index[0]]
+    return None
+
 def convert_search_selection():
-    t_index = search_tracks_listbox.curselection()
-    if t_index:
-        selected = search_tracks_listbox.get(t_index)
-        if " - " in selected:
-            track_name, artist_names = selected.split(" - ", 1)
-            download_track(track_name, artist_names)
+    if search_tracks_listbox.curselection():
+        track = selected_item(search_tracks_listbox, search_track_results)
+        if track is not None:
+            run_job_in_background(download_track, track)
         return
-    p_index = search_playlists_listbox.curselection()
-    if p_index:
-        try:
-            if search_playlists_total == 1 and is_direct_url_or_uri(search_query):
-                playlist_id = parse_spotify_id_from_url(search_query, "playlist")
-                playlist = sp.playlist(playlist_id, fields="name")
-                download_playlist(playlist_id, playlist.get("name", ""))
-            else:
-                result = sp.search(q=search_query, type="playlist", limit=search_limit, offset=search_playlists_offset)
-                playlists = result.get("playlists", {}).get("items", [])
-                playlist = playlists[p_index[0]]
-                playlist_id = playlist.get("id")
-                playlist_name = playlist.get("name", "")
-                if sp_user is not None and account_id == sp_user.me().get("id"):
-                    download_playlist(playlist_id, playlist_name, from_sp_obj=sp_user)
-                else:
-                    download_playlist(playlist_id, playlist_name)
-        except Exception as e:
-            messagebox.showerror("Error", f"Could not convert playlist: {e}")
+    if search_playlists_listbox.curselection():
+        playlist = selected_item(search_playlists_listbox, search_playlist_results)
+        if playlist is not None:
+            run_job_in_background(convert_playlist, playlist, playlist_client(account_id))
         return
     messagebox.showwarning("No Selection", "Please select a track or playlist to convert.")
 
+def convert_playlist(playlist, spotify_obj=None):
+    try:
+        download_playlist(playlist.id, playlist.name, from_sp_obj=spotify_obj, snapshot_id=playlist.snapshot_id)
+    except Exception as e:
+        show_error("Error", f"Could not convert playlist: {e}")
+
 # ======= ACCOUNT TAB Functions =======
 
 def parse_user_id(url_or_id: str) -> str:
@@ -315,21 +3206,29 @@ def parse_user_id(url_or_id: str) -> str:
         return user_part.split("?")[0]
     return url_or_id
 
+def current_user_id():
+    return current_user.get("id") if current_user else None
+
+def playlist_client(user_id):
+    """Use the logged-in client for the user's own playlists so private ones work."""
+    if sp_user is not None and user_id and user_id == current_user_id():
+        return sp_user
+    return None
+
 def user_login():
-    global sp_user
-    try:
-        sp_user = spotipy.Spotify(
-            auth_manager=SpotifyOAuth(
-                client_id=SPOTIFY_CLIENT_ID,
-                client_secret=SPOTIFY_CLIENT_SECRET,
-                redirect_uri=SPOTIFY_REDIRECT_URI,
-                scope=SCOPE
-            )
-        )
-        user = sp_user.me()
-        login_status_var.set(f"Logged in as: {user.get('display_name', user.get('id'))}")
-    except Exception as e:
-        messagebox.showerror("Login Error", f"Could not log in: {e}")
+    login_status_var.set("Logging in...")
+
+    def login():
+        client = make_spotify_client(user_oauth)
+        return client, client.me()
+
+    run_in_background(login, on_done=finish_login, error_title="Login Error", error_prefix="Could not log in")
+
+def finish_login(result):
+    global sp_user, current_user
+    # The profile is fetched once per login and reused for the whole session.
+    sp_user, current_user = result
+    login_status_var.set(f"Logged in as: {current_user.get('display_name', current_user.get('id'))}")
 
 def load_account_data():
     """
@@ -337,7 +3236,7 @@ def load_account_data():
     Otherwise, treat it as an account ID/URL and load the account's public playlists and liked songs.
     """
     global account_id, account_playlists_offset, account_liked_offset
-    global playlist_lookup_mode, lookup_playlist_id, lookup_playlist_name
+    global playlist_lookup_mode, lookup_playlist_id
     raw_id = account_entry.get().strip()
     if not raw_id:
         messagebox.showwarning("Input Error", "Please enter a user ID, URL, or playlist URL.")
@@ -346,19 +3245,16 @@ def load_account_data():
         # NEW: Handle playlist lookup mode.
         playlist_lookup_mode = True
         lookup_playlist_id = parse_spotify_id_from_url(raw_id, "playlist")
-        try:
-            playlist = sp.playlist(lookup_playlist_id, fields="name")
-            lookup_playlist_name = playlist.get("name", "")
-        except Exception as e:
-            messagebox.showerror("Error", f"Could not load playlist: {e}")
-            return
-        account_playlists_listbox.delete(0, tk.END)
-        account_playlists_listbox.insert(tk.END, lookup_playlist_name)
-        # Bind double-click to show its tracks.
-        account_playlists_listbox.bind("<Double-Button-1>", lambda event: show_playlist_tracks_by_id(lookup_playlist_id, lookup_playlist_name))
-        status_var.set(f"Loaded playlist: {lookup_playlist_name}")
+        playlist_id = lookup_playlist_id
         # Clear account_id so that later account functions don't run.
         account_id = ""
+        # Until it loads, Convert must not pick up the previous lookup.
+        show_account_playlists([])
+        run_in_background(
+            lambda: Playlist.from_api(sp.playlist(playlist_id, fields=PLAYLIST_FIELDS)),
+            on_done=render_lookup_playlist,
+            error_prefix="Could not load playlist",
+        )
         return
 
     # Otherwise, treat the input as an account lookup.
@@ -369,42 +3265,73 @@ def load_account_data():
     load_account_playlists()
     load_account_liked_songs()
 
+def show_account_playlists(playlists):
+    global account_playlist_results
+    account_playlist_results = list(playlists)
+    account_playlists_listbox.delete(0, tk.END)
+    for playlist in account_playlist_results:
+        account_playlists_listbox.insert(tk.END, playlist.name)
+
+def render_lookup_playlist(playlist):
+    global lookup_playlist_name
+    if not playlist_lookup_mode or playlist.id != lookup_playlist_id:
+        return  # Superseded by a later lookup.
+    lookup_playlist_name = playlist.name
+    show_account_playlists([playlist])
+    status_var.set(f"Loaded playlist: {lookup_playlist_name}")
+
+def show_selected_account_playlist():
+    playlist = selected_item(account_playlists_listbox, account_playlist_results)
+    if playlist is not None:
+        show_playlist_tracks_by_id(playlist.id, playlist.name)
+
 def load_account_playlists():
+    show_account_playlists([])
+    user_id, offset = account_id, account_playlists_offset
+
+    def fetch():
+        result = sp.user_playlists(user_id, limit=account_limit, offset=offset)
+        return result.get("total", 0), playlists_from_items(result.get("items", []))
+
+    run_in_background(fetch, on_done=render_account_playlists, error_prefix="Could not load playlists")
+
+def render_account_playlists(result):
     global account_playlists_total
-    account_playlists_listbox.delete(0, tk.END)
-    try:
-        result = sp.user_playlists(account_id, limit=account_limit, offset=account_playlists_offset)
-    except Exception as e:
-        messagebox.showerror("Error", f"Could not load playlists: {e}")
-        return
-    account_playlists_total = result.get("total", 0)
-    for item in result.get("items", []):
-        account_playlists_listbox.insert(tk.END, item.get("name", ""))
+    account_playlists_total, playlists = result
+    show_account_playlists(playlists)
+
+def show_account_liked_songs(tracks, placeholder=None):
+    global account_liked_results
+    account_liked_results = list(tracks)
+    account_liked_listbox.delete(0, tk.END)
+    if placeholder:
+        account_liked_listbox.insert(tk.END, placeholder)
+    for track in account_liked_results:
+        account_liked_listbox.insert(tk.END, track.label)
 
 def load_account_liked_songs():
     global account_liked_total
-    account_liked_listbox.delete(0, tk.END)
     if sp_user is None:
-        account_liked_listbox.insert(tk.END, "Please log in to load liked songs.")
+        show_account_liked_songs([], "Please log in to load liked songs.")
         account_liked_total = 0
         return
-    current_user = sp_user.me().get("id")
-    if account_id != current_user:
-        account_liked_listbox.insert(tk.END, "Liked songs only available for the logged-in account.")
+    if account_id != current_user_id():
+        show_account_liked_songs([], "Liked songs only available for the logged-in account.")
         account_liked_total = 0
         return
-    try:
-        result = sp_user.current_user_saved_tracks(limit=account_limit, offset=account_liked_offset)
-    except Exception as e:
-        messagebox.showerror("Error", f"Could not load liked songs: {e}")
-        return
-    account_liked_total = result.get("total", 0)
-    for item in result.get("items", []):
-        track = item.get("track")
-        if track:
-            track_name = track.get("name", "")
-            artists = ", ".join([a["name"] for a in track.get("artists", [])])
-            account_liked_listbox.insert(tk.END, f"{track_name} - {artists}")
+    show_account_liked_songs([])
+    client, offset = sp_user, account_liked_offset
+
+    def fetch():
+        result = client.current_user_saved_tracks(limit=account_limit, offset=offset)
+        return result.get("total", 0), tracks_from_items(result.get("items", []))
+
+    run_in_background(fetch, on_done=render_account_liked_songs, error_prefix="Could not load liked songs")
+
+def render_account_liked_songs(result):
+    global account_liked_total
+    account_liked_total, tracks = result
+    show_account_liked_songs(tracks)
 
 def account_playlists_next():
     global account_playlists_offset
@@ -433,165 +3360,477 @@ def account_liked_prev():
 def convert_account_selection():
     # NEW: If we are in playlist lookup mode, directly convert that playlist.
     if playlist_lookup_mode:
-        if lookup_playlist_id:
-            try:
-                download_playlist(lookup_playlist_id, lookup_playlist_name)
-            except Exception as e:
-                messagebox.showerror("Error", f"Could not convert playlist: {e}")
+        if not account_playlist_results:
+            messagebox.showwarning("Not Loaded", "The playlist is still loading or could not be loaded.")
             return
+        run_job_in_background(convert_playlist, account_playlist_results[0])
+        return
 
-    p_index = account_playlists_listbox.curselection()
-    if p_index:
-        try:
-            result = sp.user_playlists(account_id, limit=account_limit, offset=account_playlists_offset)
-            playlists = result.get("items", [])
-            playlist = playlists[p_index[0]]
-            playlist_id = playlist.get("id")
-            playlist_name = playlist.get("name", "")
-            if sp_user is not None and account_id == sp_user.me().get("id"):
-                download_playlist(playlist_id, playlist_name, from_sp_obj=sp_user)
-            else:
-                download_playlist(playlist_id, playlist_name)
-        except Exception as e:
-            messagebox.showerror("Error", f"Could not convert playlist: {e}")
+    if account_playlists_listbox.curselection():
+        playlist = selected_item(account_playlists_listbox, account_playlist_results)
+        if playlist is not None:
+            run_job_in_background(convert_playlist, playlist, playlist_client(account_id))
         return
-    l_index = account_liked_listbox.curselection()
-    if l_index:
+    if account_liked_listbox.curselection():
         if sp_user is None:
             messagebox.showwarning("Not Logged In", "You must log in to download liked songs.")
             return
-        try:
-            result = sp_user.current_user_saved_tracks(limit=account_limit, offset=account_liked_offset)
-            items = result.get("items", [])
-            item = items[l_index[0]]
-            track = item.get("track")
-            if track:
-                track_name = track.get("name", "")
-                artists = ", ".join([a["name"] for a in track.get("artists", [])])
-                download_track(track_name, artists)
-        except Exception as e:
-            messagebox.showerror("Error", f"Could not convert track: {e}")
+        track = selected_item(account_liked_listbox, account_liked_results)
+        if track is not None:
+            run_job_in_background(download_track, track)
         return
     messagebox.showwarning("No Selection", "Please select a playlist or liked song to convert.")
 
+def open_bulk_import():
+    top = tk.Toplevel(root)
+    top.title("Bulk Import")
+    ttk.Label(top, text="Paste Spotify track, album, playlist or user URLs/URIs, one per line:").pack(anchor=tk.W, padx=10, pady=(10, 0))
+    text = tk.Text(top, width=80, height=20)
+    text.pack(fill=tk.BOTH, expand=True, padx=10, pady=5)
+
+    def load_file():
+        path = filedialog.askopenfilename(parent=top, filetypes=[("Text files", "*.txt"), ("All files", "*")])
+        if path:
+            try:
+                sources = read_sources([path])
+            except OSError as e:
+                messagebox.showerror("Error", f"Could not read file: {e}", parent=top)
+                return
+            text.insert(tk.END, "\n".join(sources) + "\n")
+
+    def convert():
+        sources = [line.strip() for line in text.get("1.0", tk.END).splitlines() if line.strip()]
+        if not sources:
+            messagebox.showwarning("Input Error", "Please enter at least one URL or URI.", parent=top)
+            return
+        top.destroy()
+        run_job_in_background(convert_sources, sources, True, prune_removed_tracks)
+
+    buttons = ttk.Frame(top)
+    buttons.pack(pady=(0, 10))
+    ttk.Button(buttons, text="Load From File...", command=load_file).pack(side=tk.LEFT, padx=5)
+    ttk.Button(buttons, text="Convert All", command=convert).pack(side=tk.LEFT, padx=5)
+
+def mirror_account():
+    if not account_id:
+        messagebox.showwarning("Input Error", "Please load an account first.")
+        return
+    client = playlist_client(account_id)
+    # Saved tracks can only be read for the logged-in account.
+    run_job_in_background(mirror_library, account_id, client, client is not None)
+
+def offer_resume():
+    def find_interrupted():
+        # Spool workers may be sharing the store, so only stale temp files go.
+        cleanup_partial_downloads(STORE_FOLDER)
+        return get_job_queue().interrupted_jobs()
+
+    run_in_background(find_interrupted, on_done=ask_resume, error_prefix="Could not read the job queue")
+
+def ask_resume(jobs):
+    if not jobs:
+        return
+    names = "\n".join(f"{name} ({remaining} tracks left)" for _, name, _, _, remaining in jobs)
+    if messagebox.askyesno("Resume Conversions", f"These conversions were interrupted:\n\n{names}\n\nResume them now?"):
+        for job_id, name, folder, source_id, _ in jobs:
+            run_job_in_background(resume_job, job_id, name, folder, source_id)
+    else:
+        run_in_background(discard_interrupted_jobs, jobs)
+
+def toggle_prune_removed_tracks():
+    global prune_removed_tracks
+    prune_removed_tracks = prune_var.get()
+
+QUEUE_REFRESH_MS = 1000
+
+def open_download_queue():
+    """Show running jobs with controls to pause, resume, reprioritize or cancel them."""
+    top = tk.Toplevel(root)
+    top.title("Download Queue")
+    columns = ("priority", "state", "progress", "name")
+    tree = ttk.Treeview(top, columns=columns, show="headings", height=12)
+    for column, width in zip(columns, (70, 80, 110, 360)):
+        tree.heading(column, text=column.title())
+        tree.column(column, width=width, stretch=column == "name")
+    tree.pack(fill=tk.BOTH, expand=True, padx=10, pady=(10, 5))
+
+    def refresh():
+        if not top.winfo_exists():
+            return
+        selected = tree.selection()
+        tree.delete(*tree.get_children())
+        for job in queued_jobs():
+            done = job.completed + job.failed
+            tree.insert("", tk.END, iid=str(job.id), values=(
+                PRIORITY_NAMES[job.priority], job_state(job), f"{done}/{done + job.remaining}", job.name,
+            ))
+        tree.selection_set([iid for iid in selected if tree.exists(iid)])
+        top.after(QUEUE_REFRESH_MS, refresh)
+
+    def selected_jobs():
+        return [job for job in map(find_job, map(int, tree.selection())) if job is not None]
+
+    def control(action):
+        for job in selected_jobs():
+            action(job)
+
+    def shift_priority(step):
+        for job in selected_jobs():
+            job.set_priority(min(max(job.priority + step, 0), len(PRIORITY_NAMES) - 1))
+
+    buttons = ttk.Frame(top)
+    buttons.pack(pady=(0, 10))
+    ttk.Button(buttons, text="Pause", command=lambda: control(DownloadJob.pause)).pack(side=tk.LEFT, padx=5)
+    ttk.Button(buttons, text="Resume", command=lambda: control(DownloadJob.resume)).pack(side=tk.LEFT, padx=5)
+    ttk.Button(buttons, text="Raise Priority", command=lambda: shift_priority(-1)).pack(side=tk.LEFT, padx=5)
+    ttk.Button(buttons, text="Lower Priority", command=lambda: shift_priority(1)).pack(side=tk.LEFT, padx=5)
+    ttk.Button(buttons, text="Cancel", command=lambda: control(DownloadJob.cancel)).pack(side=tk.LEFT, padx=5)
+    refresh()
+
+def open_io_limits():
+    """Edit the download/write budget; changes apply to running jobs as well."""
+    top = tk.Toplevel(root)
+    top.title("Limits")
+    fields = (
+        ("download", "Download rate (e.g. 2M, 0 = unlimited):", format_rate(download_budget.rate)),
+        ("write", "Disk write rate (e.g. 10M, 0 = unlimited):", format_rate(write_budget.rate)),
+        ("downloads", "Downloads at once:", str(DOWNLOAD_WORKERS)),
+        ("transcodes", f"Transcodes at once (1-{TRANSCODE_WORKERS}):", str(TRANSCODE_SLOTS)),
+    )
+    values = {}
+    for row, (name, label, value) in enumerate(fields):
+        ttk.Label(top, text=label).grid(row=row, column=0, sticky=tk.W, padx=10, pady=5)
+        values[name] = tk.StringVar(value=value)
+        ttk.Entry(top, textvariable=values[name], width=14).grid(row=row, column=1, padx=10, pady=5)
+
+    def apply():
+        try:
+            limits = {
+                setting: parse(values[name].get())
+                for name, (setting, parse) in LIMIT_SETTINGS.items()
+            }
+        except ValueError as e:
+            messagebox.showerror("Input Error", str(e), parent=top)
+            return
+        set_io_limits(**limits)
+        set_status(f"Limits: {format_io_limits()}")
+
+    ttk.Button(top, text="Apply", command=apply).grid(row=len(fields), column=0, columnspan=2, pady=(5, 10))
+
+def on_close():
+    cancel_downloads()
+    api_executor.shutdown(wait=False, cancel_futures=True)
+    job_executor.shutdown(wait=False, cancel_futures=True)
+    close_downloaders()
+    close_transcode_pool()
+    if METRICS_PATH:
+        try:
+            metrics.write(METRICS_PATH)
+        except OSError as e:
+            print(f"Could not write metrics: {e}", file=sys.stderr)
+    root.destroy()
+
 # ======= GUI Setup =======
-root = tk.Tk()
-root.title("Spotify Converter")
-root.geometry("1000x700")
-root.resizable(True, True)
-root.option_add("*Font", ("Segoe UI", 10))
-
-style = ttk.Style(root)
-style.theme_use("clam")
-
-notebook = ttk.Notebook(root)
-notebook.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
-
-status_var = tk.StringVar(value="Status: Ready")
-login_status_var = tk.StringVar(value="Not logged in")
-
-# ----- TAB 1: SEARCH -----
-search_tab = ttk.Frame(notebook)
-notebook.add(search_tab, text="Search")
-search_frame = ttk.Frame(search_tab, padding="10")
-search_frame.pack(fill=tk.X)
-search_label = ttk.Label(search_frame, text="Search Query / URL / URI:", font=("Segoe UI", 11))
-search_label.pack(side=tk.LEFT)
-search_entry = ttk.Entry(search_frame, width=50)
-search_entry.pack(side=tk.LEFT, padx=10)
-search_button = ttk.Button(search_frame, text="Search", command=perform_search)
-search_button.pack(side=tk.LEFT)
-search_entry.bind("<Return>", lambda e: perform_search())
-
-results_frame = ttk.Frame(search_tab, padding="10")
-results_frame.pack(fill=tk.BOTH, expand=True)
-tracks_frame = ttk.Labelframe(results_frame, text="Tracks")
-tracks_frame.pack(side=tk.LEFT, fill=tk.BOTH, expand=True, padx=(0,5))
-search_tracks_listbox = tk.Listbox(tracks_frame)
-search_tracks_listbox.pack(side=tk.TOP, fill=tk.BOTH, expand=True)
-tracks_scroll = ttk.Scrollbar(tracks_frame, command=search_tracks_listbox.yview)
-tracks_scroll.pack(side=tk.RIGHT, fill=tk.Y)
-search_tracks_listbox.config(yscrollcommand=tracks_scroll.set)
-tracks_pagination = ttk.Frame(tracks_frame)
-tracks_pagination.pack(side=tk.BOTTOM, pady=5)
-tracks_prev_btn = ttk.Button(tracks_pagination, text="<< Prev", command=search_tracks_prev)
-tracks_prev_btn.pack(side=tk.LEFT, padx=5)
-tracks_next_btn = ttk.Button(tracks_pagination, text="Next >>", command=search_tracks_next)
-tracks_next_btn.pack(side=tk.LEFT, padx=5)
-
-playlists_frame = ttk.Labelframe(results_frame, text="Playlists")
-playlists_frame.pack(side=tk.LEFT, fill=tk.BOTH, expand=True, padx=(5,0))
-search_playlists_listbox = tk.Listbox(playlists_frame)
-search_playlists_listbox.pack(side=tk.TOP, fill=tk.BOTH, expand=True)
-playlists_scroll = ttk.Scrollbar(playlists_frame, command=search_playlists_listbox.yview)
-playlists_scroll.pack(side=tk.RIGHT, fill=tk.Y)
-search_playlists_listbox.config(yscrollcommand=playlists_scroll.set)
-playlists_pagination = ttk.Frame(playlists_frame)
-playlists_pagination.pack(side=tk.BOTTOM, pady=5)
-playlists_prev_btn = ttk.Button(playlists_pagination, text="<< Prev", command=search_playlists_prev)
-playlists_prev_btn.pack(side=tk.LEFT, padx=5)
-playlists_next_btn = ttk.Button(playlists_pagination, text="Next >>", command=search_playlists_next)
-playlists_next_btn.pack(side=tk.LEFT, padx=5)
-
-convert_search_btn = ttk.Button(search_tab, text="Convert Selected", command=convert_search_selection)
-convert_search_btn.pack(pady=10)
-
-# ----- TAB 2: ACCOUNT LOOKUP -----
-account_tab = ttk.Frame(notebook)
-notebook.add(account_tab, text="Account Lookup")
-account_frame = ttk.Frame(account_tab, padding="10")
-account_frame.pack(fill=tk.X)
-account_label = ttk.Label(account_frame, text="Account ID/URL or Playlist URL:", font=("Segoe UI", 11))
-account_label.pack(side=tk.LEFT)
-account_entry = ttk.Entry(account_frame, width=30)
-account_entry.pack(side=tk.LEFT, padx=10)
-load_account_btn = ttk.Button(account_frame, text="Load Account/Playlist", command=load_account_data)
-load_account_btn.pack(side=tk.LEFT, padx=5)
-login_btn = ttk.Button(account_frame, text="Login (for Liked Songs)", command=user_login)
-login_btn.pack(side=tk.LEFT, padx=5)
-login_status_label = ttk.Label(account_frame, textvariable=login_status_var)
-login_status_label.pack(side=tk.LEFT, padx=10)
-
-account_results_frame = ttk.Frame(account_tab, padding="10")
-account_results_frame.pack(fill=tk.BOTH, expand=True)
-acc_playlists_frame = ttk.Labelframe(account_results_frame, text="Account Playlists")
-acc_playlists_frame.pack(side=tk.LEFT, fill=tk.BOTH, expand=True, padx=(0,5))
-account_playlists_listbox = tk.Listbox(acc_playlists_frame)
-account_playlists_listbox.pack(side=tk.TOP, fill=tk.BOTH, expand=True)
-acc_playlists_scroll = ttk.Scrollbar(acc_playlists_frame, command=account_playlists_listbox.yview)
-acc_playlists_scroll.pack(side=tk.RIGHT, fill=tk.Y)
-account_playlists_listbox.config(yscrollcommand=acc_playlists_scroll.set)
-acc_playlists_pagination = ttk.Frame(acc_playlists_frame)
-acc_playlists_pagination.pack(side=tk.BOTTOM, pady=5)
-acc_playlists_prev_btn = ttk.Button(acc_playlists_pagination, text="<< Prev", command=account_playlists_prev)
-acc_playlists_prev_btn.pack(side=tk.LEFT, padx=5)
-acc_playlists_next_btn = ttk.Button(acc_playlists_pagination, text="Next >>", command=account_playlists_next)
-acc_playlists_next_btn.pack(side=tk.LEFT, padx=5)
-
-# Bind double-click on account playlists to show tracks.
-account_playlists_listbox.bind("<Double-Button-1>", lambda event: show_playlist_tracks_by_id(
-    parse_spotify_id_from_url(account_entry.get(), "playlist"),
-    account_playlists_listbox.get(account_playlists_listbox.curselection())
-))
-
-acc_liked_frame = ttk.Labelframe(account_results_frame, text="Liked Songs")
-acc_liked_frame.pack(side=tk.LEFT, fill=tk.BOTH, expand=True, padx=(5,0))
-account_liked_listbox = tk.Listbox(acc_liked_frame)
-account_liked_listbox.pack(side=tk.TOP, fill=tk.BOTH, expand=True)
-acc_liked_scroll = ttk.Scrollbar(acc_liked_frame, command=account_liked_listbox.yview)
-acc_liked_scroll.pack(side=tk.RIGHT, fill=tk.Y)
-account_liked_listbox.config(yscrollcommand=acc_liked_scroll.set)
-acc_liked_pagination = ttk.Frame(acc_liked_frame)
-acc_liked_pagination.pack(side=tk.BOTTOM, pady=5)
-acc_liked_prev_btn = ttk.Button(acc_liked_pagination, text="<< Prev", command=account_liked_prev)
-acc_liked_prev_btn.pack(side=tk.LEFT, padx=5)
-acc_liked_next_btn = ttk.Button(acc_liked_pagination, text="Next >>", command=account_liked_next)
-acc_liked_next_btn.pack(side=tk.LEFT, padx=5)
-
-account_convert_btn = ttk.Button(account_tab, text="Convert Selected", command=convert_account_selection)
-account_convert_btn.pack(pady=10)
-
-status_bar = ttk.Label(root, textvariable=status_var, relief=tk.SUNKEN, anchor=tk.W)
-status_bar.pack(side=tk.BOTTOM, fill=tk.X)
-
-root.mainloop()
+
+def build_gui():
+    global tk, ttk, messagebox, filedialog, frontend
+    global root, status_var, login_status_var, prune_var, search_entry, account_entry
+    global search_tracks_listbox, search_playlists_listbox, account_playlists_listbox, account_liked_listbox
+    import tkinter as tk
+    from tkinter import filedialog, messagebox, ttk
+
+    root = tk.Tk()
+    root.title("Spotify Converter")
+    root.geometry("1000x700")
+    root.resizable(True, True)
+    root.option_add("*Font", ("Segoe UI", 10))
+
+    style = ttk.Style(root)
+    style.theme_use("clam")
+
+    notebook = ttk.Notebook(root)
+    notebook.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
+
+    status_var = tk.StringVar(value="Status: Ready")
+    login_status_var = tk.StringVar(value="Not logged in")
+
+    # ----- TAB 1: SEARCH -----
+    search_tab = ttk.Frame(notebook)
+    notebook.add(search_tab, text="Search")
+    search_frame = ttk.Frame(search_tab, padding="10")
+    search_frame.pack(fill=tk.X)
+    search_label = ttk.Label(search_frame, text="Search Query / URL / URI:", font=("Segoe UI", 11))
+    search_label.pack(side=tk.LEFT)
+    search_entry = ttk.Entry(search_frame, width=50)
+    search_entry.pack(side=tk.LEFT, padx=10)
+    search_button = ttk.Button(search_frame, text="Search", command=perform_search)
+    search_button.pack(side=tk.LEFT)
+    search_entry.bind("<Return>", lambda e: perform_search())
+    search_entry.bind("<KeyRelease>", schedule_search)
+
+    results_frame = ttk.Frame(search_tab, padding="10")
+    results_frame.pack(fill=tk.BOTH, expand=True)
+    tracks_frame = ttk.Labelframe(results_frame, text="Tracks")
+    tracks_frame.pack(side=tk.LEFT, fill=tk.BOTH, expand=True, padx=(0,5))
+    search_tracks_listbox = tk.Listbox(tracks_frame)
+    search_tracks_listbox.pack(side=tk.TOP, fill=tk.BOTH, expand=True)
+    tracks_scroll = ttk.Scrollbar(tracks_frame, command=search_tracks_listbox.yview)
+    tracks_scroll.pack(side=tk.RIGHT, fill=tk.Y)
+    search_tracks_listbox.config(yscrollcommand=tracks_scroll.set)
+    tracks_pagination = ttk.Frame(tracks_frame)
+    tracks_pagination.pack(side=tk.BOTTOM, pady=5)
+    tracks_prev_btn = ttk.Button(tracks_pagination, text="<< Prev", command=search_tracks_prev)
+    tracks_prev_btn.pack(side=tk.LEFT, padx=5)
+    tracks_next_btn = ttk.Button(tracks_pagination, text="Next >>", command=search_tracks_next)
+    tracks_next_btn.pack(side=tk.LEFT, padx=5)
+
+    playlists_frame = ttk.Labelframe(results_frame, text="Playlists")
+    playlists_frame.pack(side=tk.LEFT, fill=tk.BOTH, expand=True, padx=(5,0))
+    search_playlists_listbox = tk.Listbox(playlists_frame)
+    search_playlists_listbox.pack(side=tk.TOP, fill=tk.BOTH, expand=True)
+    playlists_scroll = ttk.Scrollbar(playlists_frame, command=search_playlists_listbox.yview)
+    playlists_scroll.pack(side=tk.RIGHT, fill=tk.Y)
+    search_playlists_listbox.config(yscrollcommand=playlists_scroll.set)
+    playlists_pagination = ttk.Frame(playlists_frame)
+    playlists_pagination.pack(side=tk.BOTTOM, pady=5)
+    playlists_prev_btn = ttk.Button(playlists_pagination, text="<< Prev", command=search_playlists_prev)
+    playlists_prev_btn.pack(side=tk.LEFT, padx=5)
+    playlists_next_btn = ttk.Button(playlists_pagination, text="Next >>", command=search_playlists_next)
+    playlists_next_btn.pack(side=tk.LEFT, padx=5)
+
+    search_buttons_frame = ttk.Frame(search_tab)
+    search_buttons_frame.pack(pady=10)
+    convert_search_btn = ttk.Button(search_buttons_frame, text="Convert Selected", command=convert_search_selection)
+    convert_search_btn.pack(side=tk.LEFT, padx=5)
+    bulk_import_btn = ttk.Button(search_buttons_frame, text="Bulk Import...", command=open_bulk_import)
+    bulk_import_btn.pack(side=tk.LEFT, padx=5)
+
+    # ----- TAB 2: ACCOUNT LOOKUP -----
+    account_tab = ttk.Frame(notebook)
+    notebook.add(account_tab, text="Account Lookup")
+    account_frame = ttk.Frame(account_tab, padding="10")
+    account_frame.pack(fill=tk.X)
+    account_label = ttk.Label(account_frame, text="Account ID/URL or Playlist URL:", font=("Segoe UI", 11))
+    account_label.pack(side=tk.LEFT)
+    account_entry = ttk.Entry(account_frame, width=30)
+    account_entry.pack(side=tk.LEFT, padx=10)
+    load_account_btn = ttk.Button(account_frame, text="Load Account/Playlist", command=load_account_data)
+    load_account_btn.pack(side=tk.LEFT, padx=5)
+    login_btn = ttk.Button(account_frame, text="Login (for Liked Songs)", command=user_login)
+    login_btn.pack(side=tk.LEFT, padx=5)
+    login_status_label = ttk.Label(account_frame, textvariable=login_status_var)
+    login_status_label.pack(side=tk.LEFT, padx=10)
+
+    account_results_frame = ttk.Frame(account_tab, padding="10")
+    account_results_frame.pack(fill=tk.BOTH, expand=True)
+    acc_playlists_frame = ttk.Labelframe(account_results_frame, text="Account Playlists")
+    acc_playlists_frame.pack(side=tk.LEFT, fill=tk.BOTH, expand=True, padx=(0,5))
+    account_playlists_listbox = tk.Listbox(acc_playlists_frame)
+    account_playlists_listbox.pack(side=tk.TOP, fill=tk.BOTH, expand=True)
+    acc_playlists_scroll = ttk.Scrollbar(acc_playlists_frame, command=account_playlists_listbox.yview)
+    acc_playlists_scroll.pack(side=tk.RIGHT, fill=tk.Y)
+    account_playlists_listbox.config(yscrollcommand=acc_playlists_scroll.set)
+    acc_playlists_pagination = ttk.Frame(acc_playlists_frame)
+    acc_playlists_pagination.pack(side=tk.BOTTOM, pady=5)
+    acc_playlists_prev_btn = ttk.Button(acc_playlists_pagination, text="<< Prev", command=account_playlists_prev)
+    acc_playlists_prev_btn.pack(side=tk.LEFT, padx=5)
+    acc_playlists_next_btn = ttk.Button(acc_playlists_pagination, text="Next >>", command=account_playlists_next)
+    acc_playlists_next_btn.pack(side=tk.LEFT, padx=5)
+
+    # Bind double-click on account playlists to show tracks.
+    account_playlists_listbox.bind("<Double-Button-1>", lambda event: show_selected_account_playlist())
+
+    acc_liked_frame = ttk.Labelframe(account_results_frame, text="Liked Songs")
+    acc_liked_frame.pack(side=tk.LEFT, fill=tk.BOTH, expand=True, padx=(5,0))
+    account_liked_listbox = tk.Listbox(acc_liked_frame)
+    account_liked_listbox.pack(side=tk.TOP, fill=tk.BOTH, expand=True)
+    acc_liked_scroll = ttk.Scrollbar(acc_liked_frame, command=account_liked_listbox.yview)
+    acc_liked_scroll.pack(side=tk.RIGHT, fill=tk.Y)
+    account_liked_listbox.config(yscrollcommand=acc_liked_scroll.set)
+    acc_liked_pagination = ttk.Frame(acc_liked_frame)
+    acc_liked_pagination.pack(side=tk.BOTTOM, pady=5)
+    acc_liked_prev_btn = ttk.Button(acc_liked_pagination, text="<< Prev", command=account_liked_prev)
+    acc_liked_prev_btn.pack(side=tk.LEFT, padx=5)
+    acc_liked_next_btn = ttk.Button(acc_liked_pagination, text="Next >>", command=account_liked_next)
+    acc_liked_next_btn.pack(side=tk.LEFT, padx=5)
+
+    account_buttons_frame = ttk.Frame(account_tab)
+    account_buttons_frame.pack(pady=10)
+    account_convert_btn = ttk.Button(account_buttons_frame, text="Convert Selected", command=convert_account_selection)
+    account_convert_btn.pack(side=tk.LEFT, padx=5)
+    account_mirror_btn = ttk.Button(account_buttons_frame, text="Mirror Everything", command=mirror_account)
+    account_mirror_btn.pack(side=tk.LEFT, padx=5)
+
+    status_frame = ttk.Frame(root)
+    status_frame.pack(side=tk.BOTTOM, fill=tk.X)
+    cancel_btn = ttk.Button(status_frame, text="Cancel Downloads", command=cancel_downloads)
+    cancel_btn.pack(side=tk.RIGHT)
+    queue_btn = ttk.Button(status_frame, text="Queue...", command=open_download_queue)
+    queue_btn.pack(side=tk.RIGHT)
+    limits_btn = ttk.Button(status_frame, text="Limits...", command=open_io_limits)
+    limits_btn.pack(side=tk.RIGHT)
+    prune_var = tk.BooleanVar(value=prune_removed_tracks)
+    prune_check = ttk.Checkbutton(status_frame, text="Remove tracks deleted from playlists", variable=prune_var, command=toggle_prune_removed_tracks)
+    prune_check.pack(side=tk.RIGHT, padx=10)
+    status_bar = ttk.Label(status_frame, textvariable=status_var, relief=tk.SUNKEN, anchor=tk.W)
+    status_bar.pack(side=tk.LEFT, fill=tk.X, expand=True)
+
+    root.protocol("WM_DELETE_WINDOW", on_close)
+    root.after(UI_POLL_MS, process_ui_events)
+    root.after(500, offer_resume)
+    frontend = TkFrontend()
+    return root
+
+def run_gui():
+    build_gui().mainloop()
+    return 0
+
+# ======= Command Line =======
+# Running the script without arguments opens the GUI. Given Spotify URLs or
+# URIs (on the command line, in a file, or on stdin) it converts them without
+# a window and exits: 0 if everything converted, 1 otherwise.
+
+SPOTIFY_URL_TYPES = ("track", "playlist", "album", "artist", "user")
+
+def classify_spotify_url(url_or_uri):
+    """Return (type, id) for a Spotify URL/URI, or (None, text) if it is not one."""
+    text = url_or_uri.strip()
+    if not is_direct_url_or_uri(text):
+        return None, text
+    for kind in SPOTIFY_URL_TYPES:
+        if kind == "user":
+            if "/user/" in text:
+                return kind, parse_user_id(text)
+            if text.startswith("spotify:user:"):
+                return kind, text.split(":")[2]
+            continue
+        spotify_id = parse_spotify_id_from_url(text, kind)
+        if spotify_id != text:
+            return kind, spotify_id
+    return None, text
+
+def read_sources(paths):
+    """Read URLs/URIs from files ("-" for stdin), one per line; blank lines and # comments are skipped."""
+    sources = []
+    for path in paths:
+        if path == "-":
+            lines = sys.stdin.read().splitlines()
+        else:
+            with open(path, "r", encoding="utf-8") as f:
+                lines = f.read().splitlines()
+        sources.extend(line.strip() for line in lines if line.strip() and not line.lstrip().startswith("#"))
+    return sources
+
+def login_headless():
+    global sp_user, current_user
+    sp_user = make_spotify_client(user_oauth)
+    current_user = sp_user.me()
+    set_status(f"Logged in as: {current_user.get('display_name', current_user.get('id'))}")
+
+def main(argv=None):
+    global frontend, DEFAULT_AUDIO_FORMAT
+    parser = argparse.ArgumentParser(
+        description="Convert Spotify tracks, albums, playlists and users to MP3. Opens the GUI when run without sources.",
+    )
+    parser.add_argument("sources", nargs="*", help="Spotify track/album/playlist/user URLs or URIs")
+    parser.add_argument("-i", "--input", action="append", default=[], metavar="FILE",
+                        help="read URLs/URIs from FILE, one per line ('-' for stdin); may be repeated")
+    parser.add_argument("-o", "--output", help=f"output folder (default: {OUTPUT_ROOT})")
+    parser.add_argument("-w", "--workers", type=int,
+                        help=f"downloads at once, shared by all jobs (default: {DOWNLOAD_WORKERS})")
+    parser.add_argument("--transcodes", type=int, help=f"transcodes at once (default and most: {TRANSCODE_WORKERS})")
+    parser.add_argument("--max-rate", type=parse_rate, default=0, metavar="RATE",
+                        help="cap on download bandwidth across all jobs, e.g. 500K or 2M bytes/s (default: unlimited)")
+    parser.add_argument("--max-write-rate", type=parse_rate, default=0, metavar="RATE",
+                        help="cap on bytes/s written to the output folder (default: unlimited)")
+    parser.add_argument("--codec", choices=sorted(AUDIO_CODECS), default="mp3", help="audio codec (default: mp3)")
+    parser.add_argument("--bitrate", type=int, default=192, help="bitrate in kbit/s (default: 192)")
+    parser.add_argument("--passthrough", action="store_true",
+                        help="keep m4a/opus sources as they are instead of re-encoding them")
+    parser.add_argument("--json", action="store_true", help="print progress as JSON lines on stdout")
+    parser.add_argument("--metrics", metavar="FILE", default=METRICS_PATH,
+                        help="write stage timings and counters to FILE when done (JSON if it ends in .json, "
+                             "Prometheus text otherwise)")
+    parser.add_argument("--login", action="store_true",
+                        help="log in to Spotify to include private playlists and liked songs")
+    parser.add_argument("--no-sync", action="store_true", help="re-download tracks already in the output folders")
+    parser.add_argument("--prune", action="store_true", help="delete files for tracks removed from playlists")
+    parser.add_argument("--resume", action="store_true", help="resume interrupted conversions first")
+    parser.add_argument("--priority", choices=PRIORITY_NAMES, default="low",
+                        help="scheduling priority of these jobs (default: low)")
+    parser.add_argument("--control", action="store_true",
+                        help=f"read queue commands from stdin while converting: {QUEUE_COMMANDS}")
+    parser.add_argument("--spool", metavar="FILE",
+                        help="shared spool for distributed conversion: queue the sources' tracks in FILE for "
+                             "workers instead of converting them here")
+    parser.add_argument("--worker", action="store_true",
+                        help="convert tracks from the --spool into the output folder's track store until it is empty; "
+                             "run again without --spool afterwards to fill the playlist folders")
+    parser.add_argument("--lease", type=int, default=SPOOL_LEASE_SECONDS, metavar="SECONDS",
+                        help=f"how long a worker's tracks stay reserved without a heartbeat "
+                             f"(default: {SPOOL_LEASE_SECONDS})")
+    parser.add_argument("--gui", action="store_true", help="open the GUI even when sources are given")
+    args = parser.parse_args(argv)
+
+    if args.output:
+        set_output_root(args.output)
+    set_io_limits(args.max_rate, args.max_write_rate, args.workers, args.transcodes)
+    DEFAULT_AUDIO_FORMAT = AudioFormat(args.codec, max(8, args.bitrate), args.passthrough)
+    sources = list(args.sources)
+    try:
+        sources.extend(read_sources(args.input))
+    except OSError as e:
+        parser.error(str(e))
+    if args.control and "-" in args.input:
+        parser.error("--control reads commands from stdin, so sources can't be read from there too")
+    if args.worker and not args.spool:
+        parser.error("--worker needs a --spool to take tracks from")
+    if args.gui or not (sources or args.resume or args.worker):
+        return run_gui()
+
+    frontend = ConsoleFrontend(json_output=args.json)
+    if args.control:
+        threading.Thread(target=read_queue_commands, args=(sys.stdin,), name="queue-control", daemon=True).start()
+    jobs = []
+    try:
+        if args.login:
+            login_headless()
+        if args.resume:
+            cleanup_partial_downloads(STORE_FOLDER)
+            for job_id, name, folder, source_id, _ in get_job_queue().interrupted_jobs():
+                jobs.append(resume_job(job_id, name, folder, source_id))
+        if args.spool and sources:
+            spool = Spool(args.spool, max(1, args.lease))
+            try:
+                added = spool_sources(sources, spool)
+                set_status(f"Spooled {added} new tracks: {format_spool_counts(spool.counts())}")
+            finally:
+                spool.close()
+        if args.spool:
+            if args.worker:
+                jobs.extend(run_spool_worker(args.spool, max(1, args.lease)))
+        else:
+            jobs.extend(convert_sources(
+                sources, sync=not args.no_sync, prune=args.prune, priority=PRIORITY_NAMES.index(args.priority),
+            ))
+    except KeyboardInterrupt:
+        cancel_downloads()
+        return 130
+    except Exception as e:
+        show_error("Error", str(e))
+    finally:
+        close_downloaders()
+        # Waiting avoids a wakeup on the pool's closed pipe at interpreter exit.
+        close_transcode_pool(wait=True)
+        if args.metrics:
+            try:
+                metrics.write(args.metrics)
+            except OSError as e:
+                show_error("Error", f"Could not write metrics: {e}")
+    failed = sum(job.failed for job in jobs if job is not None)
+    return 1 if failed or frontend.errors else 0
+
+if __name__ == "__main__":
+    # Transcode workers start by re-running the frozen executable.
+    multiprocessing.freeze_support()
+    sys.exit(main())
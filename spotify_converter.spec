@@ -1,4 +1,9 @@
 # -*- mode: python ; coding: utf-8 -*-
+# Builds a one-folder app with two launchers sharing the same files:
+# spotify_converter (windowed GUI) and spotify_converter_cli (console, for
+# headless/batch use). One-folder builds start much faster than one-file
+# builds because nothing has to be unpacked to a temp directory on launch,
+# and UPX is off so the shared libraries load without being decompressed.
 
 
 a = Analysis(
@@ -19,16 +24,13 @@ pyz = PYZ(a.pure)
 exe = EXE(
     pyz,
     a.scripts,
-    a.binaries,
-    a.datas,
     [],
+    exclude_binaries=True,
     name='spotify_converter',
     debug=False,
     bootloader_ignore_signals=False,
     strip=False,
-    upx=True,
-    upx_exclude=[],
-    runtime_tmpdir=None,
+    upx=False,
     console=False,
     disable_windowed_traceback=False,
     argv_emulation=False,
@@ -36,3 +38,32 @@ exe = EXE(
     codesign_identity=None,
     entitlements_file=None,
 )
+
+cli_exe = EXE(
+    pyz,
+    a.scripts,
+    [],
+    exclude_binaries=True,
+    name='spotify_converter_cli',
+    debug=False,
+    bootloader_ignore_signals=False,
+    strip=False,
+    upx=False,
+    console=True,
+    disable_windowed_traceback=False,
+    argv_emulation=False,
+    target_arch=None,
+    codesign_identity=None,
+    entitlements_file=None,
+)
+
+coll = COLLECT(
+    exe,
+    cli_exe,
+    a.binaries,
+    a.datas,
+    strip=False,
+    upx=False,
+    upx_exclude=[],
+    name='spotify_converter',
+)
@@ -0,0 +1,89 @@
+import pytest
+
+import spotify_converter as sc
+
+def spotify_id(prefix, number):
+    return f"{prefix}{number:0>{22 - len(prefix)}}"
+
+class FakeClient:
+    """Answers multi-ID requests like Spotify, failing the whole request when one of its IDs is in broken."""
+
+    def __init__(self, broken=()):
+        self.broken = set(broken)
+        self.requests = []
+
+    def _check(self, ids):
+        self.requests.append(list(ids))
+        if self.broken & set(ids):
+            raise RuntimeError("http status: 400, invalid id")
+
+    def tracks(self, ids):
+        self._check(ids)
+        return {"tracks": [{"id": track_id, "name": track_id, "artists": [{"name": "Artist"}]} for track_id in ids]}
+
+    def albums(self, ids):
+        self._check(ids)
+        # One track per album, with an ID of its own.
+        tracks = {album_id: {"items": [{"id": album_id[:-2] + "t" + album_id[-1]}], "next": None} for album_id in ids}
+        return {"albums": [{"id": album_id, "name": album_id, "tracks": tracks[album_id]} for album_id in ids]}
+
+def test_group_sources_rejects_malformed_ids():
+    good = spotify_id("track", 1)
+    groups, unsupported = sc.group_sources([
+        f"https://open.spotify.com/track/{good}",
+        "https://open.spotify.com/track/notanid",
+        f"spotify:album:{good[:-1]}!",
+        "https://open.spotify.com/user/some.user-name",
+        "not a url",
+    ])
+    assert groups["track"] == [good]
+    assert groups["album"] == []
+    assert groups["user"] == ["some.user-name"]
+    assert unsupported == ["https://open.spotify.com/track/notanid", f"spotify:album:{good[:-1]}!", "not a url"]
+
+def test_a_failed_track_chunk_only_drops_its_own_ids():
+    ids = [spotify_id("track", number) for number in range(120)]
+    client = FakeClient(broken=[ids[60]])
+    failed = []
+    tracks = sc.fetch_tracks_by_id(ids, client, on_error=lambda chunk, error: failed.append(chunk))
+    assert [len(request) for request in client.requests] == [50, 50, 20]
+    assert failed == [ids[50:100]]
+    assert [track.id for track in tracks] == ids[:50] + ids[100:]
+
+def test_a_failed_album_chunk_only_drops_its_own_ids():
+    ids = [spotify_id("album", number) for number in range(30)]
+    failed = []
+    albums = sc.fetch_albums_by_id(ids, FakeClient(broken=[ids[5]]), on_error=lambda chunk, error: failed.append(chunk))
+    assert failed == [ids[:20]]
+    assert [album_id for _, album_id, _ in albums] == ids[20:]
+
+def test_failures_raise_without_on_error():
+    with pytest.raises(RuntimeError):
+        sc.fetch_tracks_by_id([spotify_id("track", 1)], FakeClient(broken=[spotify_id("track", 1)]))
+
+def test_convert_sources_keeps_the_tracks_it_could_look_up(monkeypatch):
+    ids = [spotify_id("track", number) for number in range(60)]
+    monkeypatch.setattr(sc, "sp", FakeClient(broken=[ids[0]]))
+    errors, synced = [], []
+    monkeypatch.setattr(sc, "show_error", lambda title, message: errors.append(message))
+    monkeypatch.setattr(sc, "sync_folder", lambda name, folder, tracks, *args, **kwargs: synced.append(tracks))
+    sc.convert_sources([f"spotify:track:{track_id}" for track_id in ids])
+    assert [track.id for track in synced[0]] == ids[50:]
+    assert len(errors) == 1 and "Could not look up 50 tracks" in errors[0]
+
+def test_spool_sources_lists_tracks_like_convert_sources(tmp_path, monkeypatch):
+    track_ids = [spotify_id("track", number) for number in range(3)]
+    album_ids = [spotify_id("album", number) for number in range(2)]
+    monkeypatch.setattr(sc, "sp", FakeClient(broken=[track_ids[0]]))
+    errors = []
+    monkeypatch.setattr(sc, "show_error", lambda title, message: errors.append(message))
+    spool = sc.Spool(str(tmp_path / "spool.db"))
+    sources = [f"spotify:track:{track_id}" for track_id in track_ids]
+    sources += [f"spotify:album:{album_id}" for album_id in album_ids]
+    # The tracks of both albums are looked up with the loose ones, in the request that fails.
+    assert sc.spool_sources(sources + ["spotify:track:bad"], spool) == 0
+    assert len(errors) == 2
+    assert "spotify:track:bad" in errors[0]
+    monkeypatch.setattr(sc, "sp", FakeClient())
+    assert sc.spool_sources(sources, spool) == 5
+    spool.close()
@@ -0,0 +1,117 @@
+import threading
+
+import pytest
+
+import spotify_converter as sc
+
+class Job:
+    def __init__(self, priority=sc.PRIORITY_NORMAL, paused=False):
+        self.priority = priority
+        self.paused = paused
+
+class Recorder:
+    """Queues labelled calls behind a gate holding the scheduler's only worker, and records the order they run in."""
+
+    def __init__(self, **scheduler_options):
+        self.scheduler = sc.JobScheduler(1, "test", **scheduler_options)
+        self.gate = threading.Event()
+        self.order = []
+        self.blocker = self.scheduler.submit(Job(sc.PRIORITY_HIGH), self.gate.wait)
+
+    def submit(self, job, *labels):
+        return [self.scheduler.submit(job, self.order.append, label) for label in labels]
+
+    def start(self):
+        self.gate.set()
+        self.blocker.result(timeout=5)
+
+def results(futures):
+    return [future.result(timeout=5) for future in futures]
+
+def test_higher_priority_jobs_go_first():
+    recorder = Recorder()
+    low = recorder.submit(Job(sc.PRIORITY_LOW), "low1", "low2")
+    normal = recorder.submit(Job(sc.PRIORITY_NORMAL), "normal1")
+    high = recorder.submit(Job(sc.PRIORITY_HIGH), "high1", "high2")
+    recorder.start()
+    results(low + normal + high)
+    assert recorder.order == ["high1", "high2", "normal1", "low1", "low2"]
+
+def test_jobs_of_equal_priority_take_turns():
+    recorder = Recorder()
+    first = recorder.submit(Job(), "a1", "a2", "a3")
+    second = recorder.submit(Job(), "b1", "b2")
+    recorder.start()
+    results(first + second)
+    assert recorder.order == ["a1", "b1", "a2", "b2", "a3"]
+
+def test_priority_change_takes_effect_for_queued_work():
+    recorder = Recorder()
+    bulk = Job()
+    single = Job()
+    queued = recorder.submit(bulk, "bulk1", "bulk2") + recorder.submit(single, "single")
+    single.priority = sc.PRIORITY_HIGH
+    recorder.scheduler.wake()
+    recorder.start()
+    results(queued)
+    assert recorder.order == ["single", "bulk1", "bulk2"]
+
+def test_paused_jobs_wait_until_resumed():
+    recorder = Recorder()
+    paused = Job(paused=True)
+    held = recorder.submit(paused, "paused1", "paused2")
+    running = recorder.submit(Job(), "running1")
+    recorder.start()
+    results(running)
+    assert not any(future.done() for future in held)
+    assert recorder.order == ["running1"]
+    paused.paused = False
+    recorder.scheduler.wake()
+    results(held)
+    assert recorder.order == ["running1", "paused1", "paused2"]
+
+def test_paused_jobs_still_run_when_not_held():
+    recorder = Recorder(holds_paused=False)
+    queued = recorder.submit(Job(paused=True), "paused1")
+    recorder.start()
+    results(queued)
+    assert recorder.order == ["paused1"]
+
+def test_drop_cancels_queued_work():
+    recorder = Recorder()
+    job = Job()
+    queued = recorder.submit(job, "a1", "a2")
+    recorder.scheduler.drop(job)
+    recorder.start()
+    assert all(future.cancelled() for future in queued)
+    assert recorder.order == []
+
+def test_transcodes_ignore_pause():
+    # A paused job's downloaded tracks hold store claims other jobs may wait on.
+    assert not sc.get_transcode_scheduler().holds_paused
+    assert sc.get_download_scheduler().holds_paused
+
+def test_waiting_for_another_fetch_stops_on_cancel(tmp_path, monkeypatch):
+    monkeypatch.setattr(sc, "STORE_FOLDER", str(tmp_path))
+    monkeypatch.setattr(sc, "STORE_CLAIM_POLL_SECONDS", 0.05)
+    track = sc.Track("shared", "Song", "Artist")
+    assert sc.claim_store_key(sc.store_key(track)) is None
+    cancel = threading.Event()
+    result = []
+    waiter = threading.Thread(target=lambda: result.append(sc.start_store_fetch(track, sc.DEFAULT_AUDIO_FORMAT,
+                                                                                cancel_event=cancel)))
+    try:
+        waiter.start()
+        waiter.join(timeout=0.3)
+        assert waiter.is_alive()
+        cancel.set()
+        waiter.join(timeout=5)
+        assert not waiter.is_alive()
+        assert result == [None]
+    finally:
+        sc.release_store_key(sc.store_key(track))
+
+@pytest.fixture(autouse=True)
+def fresh_schedulers(monkeypatch):
+    monkeypatch.setattr(sc, "_download_scheduler", None)
+    monkeypatch.setattr(sc, "_transcode_scheduler", None)
@@ -0,0 +1,84 @@
+import pytest
+
+import spotify_converter as sc
+
+NAME, ARTISTS, DURATION_MS = "Blinding Lights", "The Weeknd", 200_000
+
+def entry(id, title, duration=200, channel="The Weeknd"):
+    return {"id": id, "title": title, "duration": duration, "channel": channel}
+
+STUDIO = entry("studio", "The Weeknd - Blinding Lights (Official Audio)", 201)
+LIVE = entry("live", "The Weeknd - Blinding Lights (Live at the Grammys)", 230)
+COVER = entry("cover", "Blinding Lights (cover)", 199, channel="Some Singer")
+KARAOKE = entry("karaoke", "Blinding Lights Karaoke Version - The Weeknd", 200)
+HOUR_LOOP = entry("loop", "Blinding Lights 1 hour loop", 3600)
+
+class StubExtractor:
+    """Stands in for yt-dlp: returns the given entries for any search."""
+
+    def __init__(self, entries):
+        self.entries = entries
+        self.queries = []
+
+    def extract_info(self, query, download=True):
+        assert not download
+        self.queries.append(query)
+        return {"entries": self.entries}
+
+@pytest.mark.parametrize("name, candidate, expected", [
+    # Duration: full marks within the tolerance, scaled down to none at the maximum.
+    (NAME, STUDIO, 1.0),
+    (NAME, entry("a", "The Weeknd - Blinding Lights", 205), 1.0),
+    (NAME, entry("a", "The Weeknd - Blinding Lights", 225), 0.75),
+    (NAME, entry("a", "The Weeknd - Blinding Lights", 245), 0.5),
+    (NAME, entry("a", "The Weeknd - Blinding Lights", 155), 0.5),
+    (NAME, entry("a", "The Weeknd - Blinding Lights", 246), None),
+    (NAME, HOUR_LOOP, None),
+    # Unknown duration is neither rewarded nor ruled out.
+    (NAME, entry("a", "The Weeknd - Blinding Lights", None), 0.75),
+    # Other recordings lose a penalty per unwanted word.
+    (NAME, KARAOKE, 0.75),
+    (NAME, COVER, 0.55),
+    (NAME, entry("a", "Blinding Lights live acoustic", 200), 0.5 + 0.3 + 0.2 - 0.5),
+    # ...unless the Spotify title has the word too.
+    ("Blinding Lights - Live", entry("a", "The Weeknd - Blinding Lights Live", 200), 1.0),
+    # Artists may be credited in the channel name instead of the title.
+    (NAME, entry("a", "Blinding Lights", 200), 1.0),
+    (NAME, entry("a", "Blinding Lights", 200, channel="Lyrics Hub"), 0.8),
+])
+def test_score_candidate(name, candidate, expected):
+    score = sc.score_candidate(name, ARTISTS, DURATION_MS, candidate)
+    if expected is None:
+        assert score is None
+    else:
+        assert score == pytest.approx(expected)
+
+@pytest.mark.parametrize("candidates, expected", [
+    ([STUDIO], "studio"),
+    ([LIVE, COVER, KARAOKE, STUDIO], "studio"),
+    ([HOUR_LOOP, STUDIO], "studio"),
+])
+def test_pick_candidate(candidates, expected):
+    best, score = sc.pick_candidate(NAME, ARTISTS, DURATION_MS, candidates)
+    assert best["id"] == expected
+    assert score >= sc.MATCH_MIN_SCORE
+
+@pytest.mark.parametrize("candidates, message", [
+    ([], "within"),
+    ([HOUR_LOOP], "within"),
+    ([COVER], "No close YouTube match"),
+    ([LIVE, COVER, KARAOKE | {"duration": 240}], "No close YouTube match"),
+    ([COVER, entry("a", "Some Other Song", 200, channel="Someone Else")], "No close YouTube match"),
+])
+def test_pick_candidate_without_a_close_match(candidates, message):
+    with pytest.raises(sc.NoMatchError, match=message):
+        sc.pick_candidate(NAME, ARTISTS, DURATION_MS, candidates)
+
+def test_resolve_youtube_match_uses_the_extractor():
+    extractor = StubExtractor([None, {"title": "no id"}, COVER, STUDIO])
+    assert sc.resolve_youtube_match(NAME, ARTISTS, DURATION_MS, extractor) == "studio"
+    assert extractor.queries == [f"ytsearch{sc.MATCH_CANDIDATES}:{NAME} {ARTISTS}"]
+
+def test_resolve_youtube_match_flags_unmatched_tracks():
+    with pytest.raises(sc.NoMatchError):
+        sc.resolve_youtube_match(NAME, ARTISTS, DURATION_MS, StubExtractor([COVER, HOUR_LOOP]))
@@ -0,0 +1,63 @@
+import os
+import time
+
+import pytest
+
+import spotify_converter as sc
+
+@pytest.fixture
+def partial_root(tmp_path, monkeypatch):
+    monkeypatch.setattr(sc, "STORE_FOLDER", str(tmp_path))
+    monkeypatch.setattr(sc, "SPOOL_LEASE_SECONDS", 60)
+    root = tmp_path / sc.PARTIAL_DIR_NAME
+    root.mkdir()
+    return root
+
+def age(path, seconds):
+    then = time.time() - seconds
+    os.utime(path, (then, then))
+
+def work_dir(root, owner, idle_seconds=0):
+    path = root / f"{owner}-abc_123"
+    path.mkdir()
+    (path / "source.webm.part").write_bytes(b"audio")
+    age(path / "source.webm.part", idle_seconds)
+    age(path, idle_seconds)
+    return path
+
+def heartbeat(root, owner, seconds_ago=0):
+    path = root / (owner + sc.PARTIAL_HEARTBEAT_SUFFIX)
+    path.write_bytes(b"")
+    age(path, seconds_ago)
+    return path
+
+def test_running_owners_keep_idle_work_dirs(partial_root):
+    # Downloaded long ago, still waiting for a transcode slot.
+    waiting = work_dir(partial_root, "host-1", idle_seconds=3600)
+    beat = heartbeat(partial_root, "host-1")
+    sc.cleanup_partial_downloads(sc.STORE_FOLDER)
+    assert waiting.exists() and beat.exists()
+
+def test_stopped_owners_lose_their_work_dirs(partial_root):
+    # Written to just now, but its process stopped beating a while ago.
+    abandoned = work_dir(partial_root, "host-2")
+    beat = heartbeat(partial_root, "host-2", seconds_ago=120)
+    sc.cleanup_partial_downloads(sc.STORE_FOLDER)
+    assert not abandoned.exists() and not beat.exists()
+
+def test_work_dirs_without_a_heartbeat_go_by_age(partial_root):
+    old = work_dir(partial_root, "tmp", idle_seconds=120)
+    recent = partial_root / "tmpxyz"
+    recent.mkdir()
+    sc.cleanup_partial_downloads(sc.STORE_FOLDER)
+    assert not old.exists() and recent.exists()
+
+def test_fetching_marks_this_process_alive(partial_root, monkeypatch):
+    # As if the beating thread were already running, so none outlives the test.
+    monkeypatch.setattr(sc, "_partial_heartbeat", object())
+    sc.start_partial_heartbeat()
+    beat = partial_root / (sc.worker_id() + sc.PARTIAL_HEARTBEAT_SUFFIX)
+    assert beat.exists()
+    own = work_dir(partial_root, sc.worker_id(), idle_seconds=3600)
+    sc.cleanup_partial_downloads(sc.STORE_FOLDER)
+    assert own.exists()
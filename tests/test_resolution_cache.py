@@ -0,0 +1,28 @@
+import spotify_converter as sc
+
+def test_tracks_with_an_id_are_keyed_by_it_alone():
+    cache = sc.ResolutionCache(":memory:")
+    cache.put("studio", "Song", "Artist", "video-studio")
+    assert cache.get("studio", "Song", "Artist") == ("video-studio", None)
+    # Another recording with the same title and artists is searched for on its own.
+    assert cache.get("live", "Song", "Artist") is None
+    assert cache.get(None, "Song", "Artist") is None
+
+def test_tracks_without_an_id_fall_back_to_their_name():
+    cache = sc.ResolutionCache(":memory:")
+    cache.put(None, "Local Song", "Artist", "video-local", "251")
+    assert cache.get(None, " local song ", "ARTIST") == ("video-local", "251")
+    cache.invalidate(None, "Local Song", "Artist")
+    assert cache.get(None, "Local Song", "Artist") is None
+
+def test_each_track_counts_once_against_max_entries():
+    cache = sc.ResolutionCache(":memory:", max_entries=2)
+    for track_id in ("a", "b"):
+        cache.put(track_id, f"Song {track_id}", "Artist", f"video-{track_id}")
+    assert cache.get("a", "Song a", "Artist") == ("video-a", None)
+    assert cache.get("b", "Song b", "Artist") == ("video-b", None)
+
+def test_expired_entries_are_misses():
+    cache = sc.ResolutionCache(":memory:", ttl=-1)
+    cache.put("a", "Song", "Artist", "video-a")
+    assert cache.get("a", "Song", "Artist") is None
@@ -0,0 +1,93 @@
+import pytest
+
+import spotify_converter as sc
+
+TRACK_ID = "4uLU6hMCjMI75M1A2tKUQC"
+
+class Entry:
+    def __init__(self, text):
+        self.text = text
+
+    def get(self):
+        return self.text
+
+class Background:
+    """Records run_in_background calls instead of running them."""
+
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, task, *args, on_done=None, **options):
+        self.calls.append((task, on_done))
+        return sc.Future()
+
+@pytest.fixture
+def gui(monkeypatch):
+    background = Background()
+    calls = []
+    monkeypatch.setattr(sc, "run_in_background", background)
+    monkeypatch.setattr(sc, "search_futures", [])
+    monkeypatch.setattr(sc, "search_after_id", None)
+    monkeypatch.setattr(sc, "search_query", "")
+    monkeypatch.setattr(sc, "search_generation", 0)
+    for name in ("load_search_tracks", "load_search_playlists", "show_search_tracks", "show_search_playlists"):
+        monkeypatch.setattr(sc, name, lambda *args, name=name: calls.append(name))
+    background.other_calls = calls
+    return background
+
+def search(monkeypatch, text, incremental):
+    monkeypatch.setattr(sc, "search_entry", Entry(text), raising=False)
+    sc.perform_search(incremental=incremental)
+
+@pytest.mark.parametrize("text", [
+    "https://open.spotify.com/",
+    "https://open.spotify.com/track/",
+    "https://open.spotify.com/track/4",
+    f"https://open.spotify.com/track/{TRACK_ID[:-1]}",
+    "spotify:track:4uLU",
+    "https://open.spotify.com/album/" + TRACK_ID,
+])
+def test_typing_a_url_looks_nothing_up_until_the_id_is_complete(gui, monkeypatch, text):
+    search(monkeypatch, text, incremental=True)
+    assert gui.calls == []
+    assert gui.other_calls == []
+
+@pytest.mark.parametrize("text", [
+    f"https://open.spotify.com/track/{TRACK_ID}",
+    f"https://open.spotify.com/track/{TRACK_ID}?si=abc",
+    f"spotify:track:{TRACK_ID}",
+])
+def test_a_complete_track_url_is_looked_up(gui, monkeypatch, text):
+    search(monkeypatch, text, incremental=True)
+    assert len(gui.calls) == 1
+
+def test_pressing_search_looks_up_a_partial_url(gui, monkeypatch):
+    search(monkeypatch, "https://open.spotify.com/track/4", incremental=False)
+    assert len(gui.calls) == 1
+
+def test_superseded_direct_results_are_dropped(gui, monkeypatch):
+    rendered = []
+    sc.load_direct_result(lambda: "old", rendered.append, "Error")
+    task, on_done = gui.calls[0]
+    monkeypatch.setattr(sc, "search_generation", sc.search_generation + 1)
+    assert task() is None
+    on_done("old")
+    assert rendered == []
+
+def test_current_direct_results_are_shown(gui):
+    rendered = []
+    sc.load_direct_result(lambda: "track", rendered.append, "Error")
+    task, on_done = gui.calls[0]
+    on_done(task())
+    assert rendered == ["track"]
+
+@pytest.mark.parametrize("value, expected", [
+    (TRACK_ID, True),
+    (TRACK_ID[:-1], False),
+    (TRACK_ID + "a", False),
+    ("4uLU6hMCjMI75M1A2tKU-C", False),
+    ("", False),
+    (None, False),
+])
+def test_is_spotify_id(value, expected):
+    assert sc.is_spotify_id(value) is expected
@@ -0,0 +1,95 @@
+import multiprocessing
+import os
+import sqlite3
+import time
+
+import spotify_converter as sc
+
+TRACKS = [sc.Track(f"track{i}", f"Song {i}", "Artist") for i in range(40)]
+
+def drain(path, worker, start, results):
+    """Lease and finish tracks until the spool has none free, then report the keys leased."""
+    start.wait()
+    spool = sc.Spool(path)
+    keys = []
+    try:
+        while True:
+            leased = spool.lease(worker)
+            if leased is None:
+                break
+            key, _, _ = leased
+            keys.append(key)
+            time.sleep(0.005)
+            spool.finish(key, worker, "done")
+    finally:
+        spool.close()
+    results.put((worker, keys))
+
+def lease_and_crash(path, lease_seconds):
+    spool = sc.Spool(path, lease_seconds)
+    spool.lease("crashed")
+    # Exit without finishing or releasing, as a killed worker would.
+    os._exit(0)
+
+def attempts(path, key):
+    conn = sqlite3.connect(path)
+    try:
+        return conn.execute("SELECT attempts FROM spool WHERE key = ?", (key,)).fetchone()[0]
+    finally:
+        conn.close()
+
+def test_two_processes_lease_each_track_once(tmp_path):
+    path = str(tmp_path / "spool.db")
+    spool = sc.Spool(path)
+    assert spool.add(TRACKS, sc.DEFAULT_AUDIO_FORMAT) == len(TRACKS)
+    spool.close()
+
+    context = multiprocessing.get_context("spawn")
+    start = context.Event()
+    results = context.Queue()
+    workers = [context.Process(target=drain, args=(path, name, start, results)) for name in ("a", "b")]
+    for process in workers:
+        process.start()
+    start.set()
+    leased = dict(results.get(timeout=60) for _ in workers)
+    for process in workers:
+        process.join(timeout=60)
+        assert process.exitcode == 0
+
+    assert leased["a"] and leased["b"]
+    keys = leased["a"] + leased["b"]
+    assert len(keys) == len(set(keys))
+    assert set(keys) == {f"{sc.store_key(track)}.mp3-192k" for track in TRACKS}
+    spool = sc.Spool(path)
+    assert spool.counts() == {"done": len(TRACKS)}
+    spool.close()
+
+def test_expired_lease_is_reclaimed(tmp_path):
+    path = str(tmp_path / "spool.db")
+    spool = sc.Spool(path, lease_seconds=1)
+    spool.add(TRACKS[:1], sc.DEFAULT_AUDIO_FORMAT)
+
+    process = multiprocessing.get_context("spawn").Process(target=lease_and_crash, args=(path, 1))
+    process.start()
+    process.join(timeout=60)
+    assert process.exitcode == 0
+    assert spool.counts() == {"leased": 1}
+    # Still held by the crashed worker until the lease runs out.
+    assert spool.lease("survivor") is None
+
+    time.sleep(1.1)
+    key, track, _ = spool.lease("survivor")
+    assert track.id == TRACKS[0].id
+    assert attempts(path, key) == 2
+    spool.finish(key, "survivor", "done")
+    assert spool.counts() == {"done": 1}
+    spool.close()
+
+def test_each_format_is_spooled_separately(tmp_path):
+    spool = sc.Spool(str(tmp_path / "spool.db"))
+    for audio in (sc.AudioFormat("mp3", 192), sc.AudioFormat("mp3", 320), sc.AudioFormat("mp3", 320)):
+        spool.add(TRACKS[:1], audio)
+    assert spool.counts() == {"pending": 2}
+    leased = {spool.lease("w")[2].bitrate, spool.lease("w")[2].bitrate}
+    assert leased == {192, 320}
+    spool.close()
@@ -0,0 +1,116 @@
+import threading
+import time
+import types
+
+import pytest
+from spotipy.exceptions import SpotifyException
+
+import spotify_converter as sc
+
+@pytest.fixture(autouse=True)
+def no_jitter(monkeypatch):
+    monkeypatch.setattr(sc.random, "uniform", lambda low, high: low)
+
+def throttle(retry_after="0"):
+    return SpotifyException(429, -1, "rate limited", headers={"Retry-After": retry_after})
+
+class Stub:
+    """A Spotify call that raises the given errors in turn, then returns "ok"."""
+
+    def __init__(self, *errors, delay=0):
+        self.errors = list(errors)
+        self.delay = delay
+        self.calls = 0
+        self.running = 0
+        self.most_running = 0
+        self._lock = threading.Lock()
+
+    def __call__(self):
+        with self._lock:
+            self.calls += 1
+            self.running += 1
+            self.most_running = max(self.most_running, self.running)
+            error = self.errors.pop(0) if self.errors else None
+        try:
+            time.sleep(self.delay)
+            if error is not None:
+                raise error
+            return "ok"
+        finally:
+            with self._lock:
+                self.running -= 1
+
+def test_retries_after_429():
+    scheduler = sc.SpotifyScheduler()
+    stub = Stub(throttle(), throttle())
+    assert scheduler.call(stub) == "ok"
+    assert stub.calls == 3
+    assert scheduler.calls == 3
+    assert scheduler.throttled == 2
+
+def test_waits_for_retry_after():
+    scheduler = sc.SpotifyScheduler()
+    stub = Stub(throttle("0.3"))
+    started = time.monotonic()
+    assert scheduler.call(stub) == "ok"
+    assert time.monotonic() - started >= 0.3
+    assert scheduler.throttled == 1
+
+def test_gives_up_after_max_retries():
+    scheduler = sc.SpotifyScheduler(max_retries=2)
+    stub = Stub(*[throttle() for _ in range(5)])
+    with pytest.raises(SpotifyException):
+        scheduler.call(stub)
+    assert stub.calls == 3
+    assert scheduler.throttled == 2
+
+def test_does_not_retry_client_errors():
+    scheduler = sc.SpotifyScheduler()
+    stub = Stub(SpotifyException(404, -1, "not found"))
+    with pytest.raises(SpotifyException):
+        scheduler.call(stub)
+    assert stub.calls == 1
+    assert scheduler.throttled == 0
+
+def test_caps_calls_in_flight():
+    scheduler = sc.SpotifyScheduler(rate=1000, burst=100, max_in_flight=2)
+    stub = Stub(throttle(), delay=0.05)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(scheduler.call(stub))) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(timeout=30)
+    assert results == ["ok"] * 8
+    assert stub.calls == 9
+    assert stub.most_running == 2
+    assert scheduler.throttled == 1
+
+@pytest.fixture
+def bench_server():
+    """benchmark.py's stand-in Spotify API, answering every second request with a 429."""
+    import benchmark
+    options = types.SimpleNamespace(media_seconds=1, latency=0, api_latency=0, bandwidth=0,
+                                    throttle_every=2, retry_after=0.1)
+    server = benchmark.start_bench_server(options, 40, b"", b"")
+    yield server
+    server.shutdown()
+    server.server_close()
+
+def test_spotipy_hands_429s_to_the_scheduler(bench_server, monkeypatch):
+    scheduler = sc.SpotifyScheduler()
+    monkeypatch.setattr(sc, "spotify_scheduler", scheduler)
+    monkeypatch.setattr(sc, "SPOTIFY_API_PREFIX", f"{bench_server.base_url}/v1/")
+    client = sc.make_spotify_client(lambda: types.SimpleNamespace(get_access_token=lambda as_dict=False: "bench"))
+    track_ids = [f"benchtrack{i:07d}" for i in range(40)]
+    started = time.monotonic()
+    tracks = sc.fetch_tracks_by_id(track_ids, client)
+    playlist = list(sc.iter_playlist_tracks(client, "bench40"))
+    elapsed = time.monotonic() - started
+    assert [track.id for track in tracks] == track_ids
+    assert len(playlist) == 40
+    # Every request the server saw went through the scheduler, and each 429 was retried after its Retry-After.
+    assert bench_server.throttled > 0
+    assert scheduler.throttled == bench_server.throttled
+    assert scheduler.calls == bench_server.api_requests
+    assert elapsed >= bench_server.throttled * 0.1
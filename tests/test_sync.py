@@ -0,0 +1,61 @@
+import pytest
+
+import spotify_converter as sc
+
+FOUND = sc.Track("found0000000000000000a", "Found", "Artist")
+MISSING = sc.Track("missing00000000000000a", "Missing", "Artist")
+
+@pytest.fixture
+def fetches(tmp_path, monkeypatch):
+    """Stands in for the download stage: MISSING has no YouTube match, anything else is already stored."""
+    monkeypatch.setattr(sc, "_job_queue", sc.JobQueue(str(tmp_path / "jobs.sqlite3")))
+    store = tmp_path / "store"
+    store.mkdir()
+    fetched = []
+
+    def start_store_fetch(track, audio, on_state=None, cancel_event=None):
+        fetched.append(track.id)
+        if track is MISSING:
+            raise sc.NoMatchError("No close YouTube match")
+        path = store / f"{track.id}.mp3"
+        path.write_bytes(b"audio")
+        return str(path)
+
+    monkeypatch.setattr(sc, "start_store_fetch", start_store_fetch)
+    return fetched
+
+def sync(folder, snapshot_id="snap1"):
+    manifest = sc.load_manifest(folder)
+    job = sc.sync_folder("Playlist", folder, [FOUND, MISSING], "playlist1", snapshot_id, manifest=manifest)
+    return job, sc.load_manifest(folder)
+
+def test_unmatched_tracks_do_not_hold_back_the_snapshot(tmp_path, fetches):
+    folder = str(tmp_path / "Playlist")
+    job, manifest = sync(folder)
+    assert (job.completed, job.failed, job.unmatched) == (1, 1, 1)
+    assert manifest["snapshot_id"] == "snap1"
+    assert list(manifest["unmatched"]) == [MISSING.id]
+    assert sc.manifest_is_current(folder, manifest, "playlist1", "snap1")
+
+def test_unmatched_tracks_are_searched_again_after_a_while(tmp_path, fetches, monkeypatch):
+    folder = str(tmp_path / "Playlist")
+    sync(folder)
+    # A changed playlist is synced again, but the unmatched track isn't searched for yet.
+    job, manifest = sync(folder, "snap2")
+    assert fetches == [FOUND.id, MISSING.id]
+    assert job.skipped == 2
+    assert manifest["snapshot_id"] == "snap2"
+
+    monkeypatch.setattr(sc, "UNMATCHED_RETRY_SECONDS", 0)
+    assert not sc.manifest_is_current(folder, manifest, "playlist1", "snap2")
+    sync(folder, "snap2")
+    assert fetches == [FOUND.id, MISSING.id, MISSING.id]
+
+def test_failed_tracks_still_hold_back_the_snapshot(tmp_path, fetches, monkeypatch):
+    def broken(track, audio, on_state=None, cancel_event=None):
+        raise RuntimeError("download failed")
+
+    monkeypatch.setattr(sc, "start_store_fetch", broken)
+    _, manifest = sync(str(tmp_path / "Playlist"))
+    assert manifest["snapshot_id"] is None
+    assert manifest["unmatched"] == {}
@@ -0,0 +1,48 @@
+import pytest
+
+import spotify_converter as sc
+
+TRACK = sc.Track("4uLU6hMCjMI75M1A2tKUQC", "Song", "Artist")
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    monkeypatch.setattr(sc, "STORE_FOLDER", str(tmp_path))
+    return tmp_path
+
+def put(store, name):
+    path = store / name
+    path.write_bytes(b"audio")
+    return str(path)
+
+@pytest.mark.parametrize("audio, source_codec, expected", [
+    (sc.AudioFormat("mp3", 192), "opus", ("mp3", "192k")),
+    (sc.AudioFormat("mp3", 320), "mp4a.40.2", ("mp3", "320k")),
+    (sc.AudioFormat("aac", 256), "mp4a.40.2", ("m4a", "256k")),
+    (sc.AudioFormat("aac", 256, passthrough=True), "mp4a.40.2", ("m4a", "copy")),
+    (sc.AudioFormat("aac", 256, passthrough=True), "opus", ("opus", "copy")),
+    (sc.AudioFormat("aac", 256, passthrough=True), "vorbis", ("m4a", "256k")),
+])
+def test_plan_names_the_store_variant(audio, source_codec, expected):
+    extension, _, variant = audio.plan(source_codec)
+    assert (extension, variant) == expected
+
+def test_stored_bitrate_must_match(store):
+    stored = put(store, f"{TRACK.id}.192k.mp3")
+    assert sc.find_in_store(TRACK, sc.AudioFormat("mp3", 192)) == stored
+    assert sc.find_in_store(TRACK, sc.AudioFormat("mp3", 320)) is None
+
+def test_copies_only_satisfy_passthrough_jobs(store):
+    stored = put(store, f"{TRACK.id}.copy.m4a")
+    assert sc.find_in_store(TRACK, sc.AudioFormat("aac", 128)) is None
+    assert sc.find_in_store(TRACK, sc.AudioFormat("aac", 128, passthrough=True)) == stored
+    assert sc.find_in_store(TRACK, sc.AudioFormat("opus", 96, passthrough=True)) == stored
+
+def test_passthrough_jobs_fall_back_to_an_encoded_file(store):
+    stored = put(store, f"{TRACK.id}.160k.opus")
+    assert sc.find_in_store(TRACK, sc.AudioFormat("opus", 160, passthrough=True)) == stored
+    assert sc.find_in_store(TRACK, sc.AudioFormat("opus", 96, passthrough=True)) is None
+
+def test_format_names_are_distinct():
+    formats = [sc.AudioFormat("mp3", 192), sc.AudioFormat("mp3", 320), sc.AudioFormat("aac", 192),
+               sc.AudioFormat("aac", 192, passthrough=True)]
+    assert len({audio.name for audio in formats}) == len(formats)